@@ -0,0 +1,119 @@
+"""
+Calibration of the ISO-TP link profile of one ECU (see _isotp_pool.PROFILE). The same multi-frame request
+(by default a multi-DID read of the ECU's data identifiers) goes out a few times with every candidate profile,
+each on a fresh socket, and the candidate with the highest throughput among the ones without errors wins.
+Two rounds keep it short: first flow control (STmin x block size) for the responses, then with the best of it
+the gap between our own frames and, on CAN-FD, the frame size. Padding stays as configured, it does not change the
+speed but some ECUs ignore frames without it.
+
+usage: python3 gateway.py --calibrate disp [--probe ReadDataByIdentifier/VehicleIdentificationNumberOriginal] [--fd]
+       (writes the best profile to "link" of the ECU in the config, the socket pool uses it from the next start;
+       if no candidate works without errors the config stays as it is and the exit status is 1)
+"""
+
+import time
+import logging
+
+import _uds_helper
+import _isotp_pool
+
+
+logger = logging.getLogger(__name__)
+
+STMINS = (0, 0xF5, 1, 2, 5, 10) # flow control STmin candidates, ms (0xF5: 500 us)
+BLOCK_SIZES = (0, 32, 16, 8, 4)
+TX_STMINS = (None, 500000, 1000000) # ns between our frames
+FD_FRAME_SIZES = (8, 16, 32, 64)
+REQUESTS = 10 # per candidate
+MAX_ERROR_RATE = 0.0 # candidates with more errors lose against every one below
+TOLERANCE = 0.03 # throughputs this close count as equal, the earlier candidate wins (no tx STmin, smaller frames)
+PAUSE = 0.2 # seconds between candidates, an overrun ECU may need to recover
+
+
+def probe_request(catalog, services, max_length, probe=None):
+    """
+    request payload for the measurements: probe ("<service>/<parameter>") or all ReadDataByIdentifier
+    parameters of services in one request (as many as fit max_length)
+    """
+    if probe:
+        service, parameter = probe.split("/", 1)
+        return catalog.encode(service, parameter)
+    dids = [parameter for service, parameter in services if service == "ReadDataByIdentifier"]
+    if not dids:
+        raise ValueError("no ReadDataByIdentifier parameters to probe with, choose a probe")
+    return catalog.readBatches(dids, max_length)[0][0]
+
+
+def measure(socket_factory, interface, txid, rxid, profile, payload, requests=REQUESTS, p2=_uds_helper.P2_TIMEOUT, p2_star=_uds_helper.P2_STAR_TIMEOUT):
+    """ {"profile", "throughput" (response bytes/s), "error_rate", "response_length"} of one candidate profile """
+    errors = 0
+    received = 0
+    responses = 0
+    seconds = 0.0
+    try:
+        isotp_socket = socket_factory(interface, txid, rxid, profile)
+    except OSError as e:
+        logger.info("Profile %s not usable on %s: %s", profile, interface, e)
+        return {"profile": profile, "throughput": 0, "error_rate": 1.0, "response_length": None}
+    try:
+        helper = _uds_helper.UDSHelper(isotp_socket=isotp_socket, p2=p2, p2_star=p2_star)
+        started = time.perf_counter()
+        for _ in range(requests):
+            try:
+                helper._transmitISOTP(payload)
+                response = helper._receivePayload()
+            except OSError as e:
+                logger.debug("Request failed with %s: %s", profile, e)
+                response = None
+            if response and response[0] == payload[0] + 0x40:
+                received += len(response)
+                responses += 1
+            else:
+                errors += 1
+        seconds = time.perf_counter() - started
+    finally:
+        isotp_socket.close()
+    return {"profile": profile, "throughput": round(received / seconds) if seconds else 0, "error_rate": errors / requests,
+            "response_length": received // responses if responses else None}
+
+
+def best(results, max_error_rate=MAX_ERROR_RATE):
+    """ fastest result within max_error_rate (measurement noise aside), None if every candidate had more errors """
+    usable = [result for result in results if result["error_rate"] <= max_error_rate]
+    if not usable:
+        return None
+    fastest = max(result["throughput"] for result in usable)
+    return [result for result in usable if result["throughput"] >= fastest * (1 - TOLERANCE)][0]
+
+
+def calibrate(socket_factory, interface, txid, rxid, payload, base=None, fd=False, requests=REQUESTS,
+              p2=_uds_helper.P2_TIMEOUT, p2_star=_uds_helper.P2_STAR_TIMEOUT):
+    """
+    (best link profile, all results) for an ECU, base: the profile to start from (padding, frame size),
+    the profile is None when no candidate got through without errors
+    """
+    base = _isotp_pool.link_profile(base)
+    txid, rxid = _isotp_pool._to_int(txid), _isotp_pool._to_int(rxid)
+    results = []
+
+    def run(candidates):
+        round_results = []
+        for profile in candidates:
+            result = measure(socket_factory, interface, txid, rxid, profile, payload, requests, p2, p2_star)
+            logger.info("STmin %s, block size %s, tx STmin %s ns, frame %s: %s bytes/s, %.0f%% errors", profile["stmin"], profile["bs"],
+                        profile["tx_stmin"], profile["tx_dl"], result["throughput"], result["error_rate"] * 100)
+            round_results.append(result)
+            time.sleep(PAUSE)
+        results.extend(round_results)
+        return best(round_results)
+
+    flow_control = run([dict(base, stmin=stmin, bs=bs) for stmin in STMINS for bs in BLOCK_SIZES])
+    if flow_control is None:
+        return None, results
+    frame_sizes = FD_FRAME_SIZES if fd else (base["tx_dl"],)
+    chosen = run([dict(flow_control["profile"], tx_stmin=tx_stmin, tx_dl=tx_dl) for tx_dl in frame_sizes for tx_stmin in TX_STMINS])
+    if chosen is None:
+        return None, results
+    if chosen["response_length"] is not None and chosen["response_length"] <= 7:
+        logger.warning("The probe response fits into one frame, choose a probe with a longer response")
+    return chosen["profile"], results
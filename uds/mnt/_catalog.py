@@ -0,0 +1,324 @@
+"""
+Compiled view of a UDS catalog (see catalog.json) and the catalog file with its per-ECU sections.
+Built once per catalog and shared by all requests, nothing in here gets modified afterwards.
+Decoders and request templates are compiled on first use, so catalogs with thousands of DIDs load quickly.
+
+catalog.json: {"services": {<service>: {"ID": <SID>, <parameter>: {"ID": <PID>, ...}}},
+               "ecus": {<section>: {<service>: {...}} or "<file>.json"}}
+An ECU section adds to (or replaces parameters of) the common services, sections in own files are read on first use.
+A request entry can carry its positive response as "response": {"decode", "length", "unit", "name"}
+instead of an entry in the "... Positive Response" service.
+"""
+
+import os
+import json
+import logging
+import threading
+import _decoders
+
+
+logger = logging.getLogger(__name__)
+
+MAX_LENGTH = 4095 # ISO-TP payload limit, ECUs may accept less
+
+
+class Request(object):
+    """
+    Precompiled request of one catalog entry: SID + PID template plus the positions of its request parameters.
+    A parameter ends at its "bit" (hex, counted from the start of the PID) and starts where the previous one ended,
+    unless it declares its "length" in bytes.
+    """
+
+    def __init__(self, sid, entry, encoders):
+        pid = bytes.fromhex(entry["ID"])
+        self.template = bytes.fromhex(sid) + pid
+        self.fields = [] # (name, start, end, encoder, default)
+        position = len(self.template)
+        parameters = sorted(entry.get("parameters", {}).items(), key=lambda item: int(item[1]["bit"], 16))
+        for name, parameter in parameters:
+            end = 1 + int(parameter["bit"], 16) // 8
+            start = end - parameter["length"] if "length" in parameter else position
+            self.fields.append((name, start, end, encoders[name], parameter.get("default")))
+            position = end
+        self.length = position
+
+    def encode(self, message):
+        """ request payload (bytes) for the request parameters in message, missing ones use their default """
+        if not self.fields:
+            return self.template
+        payload = bytearray(self.length)
+        payload[:len(self.template)] = self.template
+        for name, start, end, encoder, default in self.fields:
+            value = encoder(message.get(name, default))
+            if isinstance(value, int):
+                payload[start:end] = value.to_bytes(end - start, "big")
+            else:
+                payload[start:start + len(value)] = value[:end - start]
+        return bytes(payload)
+
+
+class _Compiled(dict):
+    """ (service, parameter) -> compiled entry, compiled on first access, KeyError for unknown entries """
+
+    def __init__(self, entries, compile):
+        dict.__init__(self)
+        self.entries = entries
+        self.compile = compile
+
+    def __missing__(self, key):
+        value = self.compile(key, *self.entries[key])
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Catalog(object):
+    def __init__(self, uds_dict):
+        self.uds_dict = uds_dict
+        self.entries = {} # (service, parameter) -> (SID hex, entry)
+        self.decoders = _Compiled(self.entries, self._compileDecoder) # (service, parameter) -> callable(hex data) or None
+        self.requests = _Compiled(self.entries, self._compileRequest) # (service, parameter) -> Request
+        self.services_by_sid = {} # SID byte -> service
+        self.parameters_by_pid = {} # service -> [(PID length in bytes, {PID bytes: parameter}), ...], shortest first
+        self.lengths = {} # (SID byte, PID bytes) -> data length in bytes, for entries that declare "length"
+        self.ttls = {} # (service, parameter) -> seconds a response may be cached, for entries that declare "ttl"
+        self.sessions = {} # service -> diagnostic session (DiagnosticSessionControl parameter) it needs
+        for service, parameters in uds_dict.items():
+            # first entry wins, like the linear search did
+            self.services_by_sid.setdefault(int(parameters["ID"], 16), service)
+            by_length = {}
+            if "session" in parameters:
+                self.sessions[service] = parameters["session"]
+            for parameter, entry in parameters.items():
+                if not isinstance(entry, dict):
+                    continue # service attributes like "ID" or "session"
+                self.entries[(service, parameter)] = (parameters["ID"], entry)
+                pid = bytes.fromhex(entry["ID"])
+                by_length.setdefault(len(pid), {}).setdefault(pid, parameter)
+                if "ttl" in entry:
+                    self.ttls[(service, parameter)] = entry["ttl"]
+                if "length" in entry:
+                    self.lengths.setdefault((int(parameters["ID"], 16), pid), entry["length"])
+            self.parameters_by_pid[service] = sorted(by_length.items())
+
+    def _compileDecoder(self, key, sid, entry):
+        if "decode" in entry:
+            return _decoders.compile_decoder(entry["decode"])
+        if entry.get("interpretation"):
+            return _decoders.compile_legacy(entry["interpretation"])
+        return None
+
+    def _compileRequest(self, key, sid, entry):
+        encoders = dict((name, _decoders.compile_encoder(request_parameter)) for name, request_parameter in entry.get("parameters", {}).items())
+        return Request(sid, entry, encoders)
+
+    def lookup(self, payload):
+        """
+        find service and parameter of a response payload (bytes),
+        returns (service or None, parameter or None, length of SID + PID in bytes)
+        """
+        if not isinstance(payload, bytes):
+            payload = bytes(payload) # bytearray slices are not hashable
+        service = self.services_by_sid.get(payload[0])
+        if service is None:
+            return None, None, 1
+        for length, parameters in self.parameters_by_pid[service]:
+            parameter = parameters.get(payload[1:1 + length])
+            if parameter is not None:
+                return service, parameter, 1 + length
+        return service, None, 1
+
+    def readBatches(self, parameters, max_length=MAX_LENGTH):
+        """
+        group ReadDataByIdentifier parameters into multi-DID requests that fit max_length (request and response),
+        returns [(request payload, [parameter, ...]), ...]. A DID without known length can only be the last of its request.
+        """
+        service = "ReadDataByIdentifier"
+        sid = bytes.fromhex(self.uds_dict[service]["ID"])
+        response_sid = sid[0] + 0x40
+        batches = [] # [parameters, request length, response length, ends with unknown length]
+        dids = [(parameter, self.requests[(service, parameter)].template[1:]) for parameter in parameters]
+        dids = [(parameter, did, self.lengths.get((response_sid, did))) for parameter, did in dids]
+        # known lengths first, every request can take one DID of unknown length at its end
+        dids.sort(key=lambda item: item[2] is None)
+        for parameter, did, length in dids:
+            for batch in batches:
+                if batch[3] or batch[1] + len(did) > max_length:
+                    continue
+                if length is not None and batch[2] + len(did) + length > max_length:
+                    continue
+                break
+            else:
+                batch = [[], 1, 1, False]
+                batches.append(batch)
+            batch[0].append(parameter)
+            batch[1] += len(did)
+            batch[2] += len(did) + (length or 0)
+            batch[3] = length is None
+        return [(sid + b"".join(self.requests[(service, parameter)].template[1:] for parameter in batch[0]), batch[0]) for batch in batches]
+
+    def splitRead(self, payload, dids):
+        """
+        split a multi-DID ReadDataByIdentifier response into single responses [(DID bytes, data bytes), ...]
+        following the order of the request, raises ValueError if the payload does not match
+        """
+        parts = []
+        position = 1
+        for index, did in enumerate(dids):
+            if payload[position:position + len(did)] != did:
+                raise ValueError("expected DID {} at byte {}".format(did.hex(), position))
+            position += len(did)
+            length = self.lengths.get((payload[0], did))
+            if length is None:
+                if index != len(dids) - 1:
+                    raise ValueError("length of DID {} unknown".format(did.hex()))
+                length = len(payload) - position
+            parts.append((did, payload[position:position + length]))
+            position += length
+        if position != len(payload):
+            raise ValueError("{} unexpected bytes at the end".format(len(payload) - position))
+        return parts
+
+    def decode(self, service, parameter, data):
+        """ decoded value of a response parameter or None if the catalog does not know how to decode it """
+        decoder = self.decoders.get((service, parameter))
+        if decoder is None or data is None:
+            return None
+        try:
+            return decoder(data)
+        except (ValueError, TypeError, IndexError) as e:
+            logger.info("Could not decode %s / %s data %s: %s", service, parameter, data, e)
+            return None
+
+    def encode(self, service, parameter, message={}):
+        """ request payload (bytes), raises KeyError for unknown services/parameters, ValueError for bad values """
+        return self.requests[(service, parameter)].encode(message)
+
+
+def expand(services):
+    """ services with the "response" entries of requests added to their positive response services """
+    expanded = dict(services)
+    responses = {} # SID -> service, first one wins like in Catalog
+    for service, parameters in services.items():
+        responses.setdefault(int(parameters["ID"], 16), service)
+    for service, parameters in services.items():
+        for parameter, entry in parameters.items():
+            if not isinstance(entry, dict) or "response" not in entry:
+                continue
+            sid = int(parameters["ID"], 16) + 0x40
+            if sid not in responses:
+                responses[sid] = service + " Positive Response"
+                expanded[responses[sid]] = {"ID": "{:02X}".format(sid)}
+            response_service = responses[sid]
+            if expanded[response_service] is services.get(response_service):
+                expanded[response_service] = dict(services[response_service]) # copy before adding to it
+            response = dict(entry["response"], ID=entry["ID"])
+            expanded[response_service][response.pop("name", parameter + " Response")] = response
+    return expanded
+
+
+def merge(services, section):
+    """ common services with the services of an ECU section, section parameters win """
+    merged = dict(services)
+    for service, parameters in section.items():
+        merged[service] = dict(merged.get(service, {}), **parameters)
+    return merged
+
+
+class Catalogs(object):
+    """
+    The catalogs of a catalog file, one per ECU section (None: the common services only).
+    Sections are read and compiled on first use, reload() swaps in a changed file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0 # counts the reloads
+        self._lock = threading.Lock()
+        self._load()
+
+    def _stamp(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self, path):
+        with open(path, encoding="utf-8") as catalog_file:
+            return json.load(catalog_file)
+
+    def _load(self):
+        stamps = {self.path: self._stamp(self.path)}
+        document = self._read(self.path)
+        if "services" not in document:
+            document = {"services": document} # a plain catalog without sections
+        self._document = document
+        self._stamps = stamps # file -> (mtime, size) of every file read so far
+        self._compiled = {} # section -> Catalog, bound last: get() compiles from the new document then
+
+    def sections(self):
+        return list(self._document.get("ecus", {}))
+
+    def get(self, section=None):
+        """
+        compiled catalog of an ECU section, the common one for unknown sections. Lock free if compiled already:
+        _load() never changes the dict of a running reader but binds a new one, and a reference assignment is atomic,
+        so the snapshot is either the old or the new dict.
+        """
+        compiled = self._compiled
+        catalog = compiled.get(section)
+        if catalog is not None:
+            return catalog
+        with self._lock:
+            compiled = self._compiled # a reload may have swapped it meanwhile
+            if section not in compiled:
+                services = self._document["services"]
+                entry = self._document.get("ecus", {}).get(section)
+                if isinstance(entry, str):
+                    path = os.path.join(os.path.dirname(self.path), entry)
+                    try:
+                        self._stamps[path] = self._stamp(path)
+                        entry = self._read(path)
+                    except (OSError, ValueError) as e:
+                        logger.error("Could not read catalog section %s (%s), using the common services", path, e)
+                        entry = None
+                if entry:
+                    services = merge(services, entry)
+                compiled[section] = Catalog(expand(services))
+            return compiled[section]
+
+    def changed(self):
+        """ True if a file read so far changed on disk """
+        for path, stamp in list(self._stamps.items()):
+            try:
+                if self._stamp(path) != stamp:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def reload(self):
+        """ read the catalog again if it changed, True if it did. A broken file keeps the current catalogs. """
+        if not self.changed():
+            return False
+        try:
+            with self._lock:
+                self._load()
+        except (OSError, ValueError) as e:
+            logger.error("Could not reload catalog %s: %s", self.path, e)
+            # try again after the next change only
+            for path in self._stamps:
+                try:
+                    self._stamps[path] = self._stamp(path)
+                except OSError:
+                    pass
+            return False
+        self.version += 1
+        logger.info("Reloaded catalog %s", self.path)
+        return True
@@ -0,0 +1,90 @@
+"""
+Turns the "decode" (responses) and "encoding" (request parameters) entries of the UDS catalog into plain callables.
+Compiled once when the catalog is loaded, no source gets parsed per message.
+
+Response entries declare how the hex data is read, e.g.
+    "decode": {"scale": 0.1}                                 -> 1.6 (unsigned big endian integer times scale plus offset)
+    "decode": {"encoding": "utf-8"}                          -> "WVW..."
+    "decode": {"enum": {"00080201": "Default Session"}}      -> "Default Session" (unknown values stay hex)
+    "decode": {"fields": [{"start": 0, "length": 2, "unit": "ms"}, ...]} -> "50ms, 5000ms"
+    "decode": {}                                             -> data as hex string
+Old style "interpretation" source strings ("x = ...") still work, they get compiled once and cached.
+"""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# the only names legacy interpretation strings can use
+_LEGACY_BUILTINS = {"str": str, "int": int, "float": float, "bytes": bytes, "format": format, "len": len, "round": round}
+_legacy_code = {} # interpretation source -> code object
+
+
+def _number(spec):
+    scale = spec.get("scale", 1)
+    offset = spec.get("offset", 0)
+    if scale == 1 and offset == 0:
+        return lambda x: int(x, 16)
+    return lambda x: int(x, 16) * scale + offset
+
+
+def _value(spec):
+    """ callable for a single value: enum, text or number, hex data otherwise """
+    if "enum" in spec:
+        mapping = dict((key.lower(), value) for key, value in spec["enum"].items())
+        return lambda x: mapping.get(x.lower(), x)
+    encoding = spec.get("encoding")
+    if encoding in ("utf-8", "ascii", "latin-1"):
+        return lambda x: bytes.fromhex(x).decode(encoding)
+    if encoding == "uint" or "scale" in spec or "offset" in spec:
+        return _number(spec)
+    return lambda x: x
+
+
+def _field(spec):
+    start = spec.get("start", 0) * 2
+    end = start + spec["length"] * 2 if "length" in spec else None
+    value = _value(spec) if "enum" in spec or "encoding" in spec else _number(spec) # fields are numbers by default
+    unit = spec.get("unit", "")
+    return lambda x: str(value(x[start:end])) + unit
+
+
+def compile_decoder(spec):
+    """ callable hex string -> decoded value for a "decode" entry """
+    if "fields" in spec:
+        fields = [_field(field) for field in spec["fields"]]
+        separator = spec.get("separator", ", ")
+        return lambda x: separator.join(field(x) for field in fields)
+    return _value(spec)
+
+
+def compile_legacy(source):
+    """ callable for an old style interpretation string, x in, x out """
+    code = _legacy_code.get(source)
+    if code is None:
+        code = compile(source, "<interpretation>", "exec")
+        _legacy_code[source] = code
+
+    def interpret(x):
+        local = {"x": x}
+        exec(code, {"__builtins__": _LEGACY_BUILTINS}, local)
+        return local["x"]
+    return interpret
+
+
+def compile_encoder(spec):
+    """ callable request value -> int (numbers) or bytes (text, hex) for a request parameter """
+    if "interpretation" in spec:
+        interpret = compile_legacy(spec["interpretation"])
+        return lambda x: int(interpret(x), 16) # legacy strings produce hex
+    encoding = spec.get("encoding", "uint")
+    if encoding == "uint":
+        scale = spec.get("scale", 1)
+        offset = spec.get("offset", 0)
+        if scale == 1 and offset == 0:
+            return lambda x: int(x)
+        return lambda x: int(round((float(x) - offset) / scale))
+    if encoding in ("utf-8", "ascii", "latin-1"):
+        return lambda x: x.encode(encoding)
+    return lambda x: bytes.fromhex(x)
@@ -0,0 +1,59 @@
+"""
+Change driven service discovery: the retained descriptors are published once per connect
+and afterwards only the ones whose content hash changed (e.g. after a catalog update).
+Descriptors removed while disconnected get cleared on the broker when the connection is back.
+Payloads are serialized once when the descriptors are set, never per publish.
+"""
+
+import json
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Discovery(object):
+    def __init__(self, client, manifest_topic=None):
+        self.client = client
+        self.manifest_topic = manifest_topic # optional single topic listing all descriptors and their hashes
+        self._entries = {} # topic -> (payload, hash)
+        self._published = {} # topic -> hash retained on the broker, kept across reconnects
+        self.publishes = 0
+
+    def update(self, descriptors):
+        """ set the descriptors (service discovery messages), publishes the changes if connected """
+        entries = {}
+        for descriptor in descriptors:
+            topic, payload = self.client.buildService(descriptor)
+            entries[topic] = (payload, hashlib.sha1(payload.encode("utf-8")).hexdigest())
+        if self.manifest_topic:
+            manifest = json.dumps({"services": dict((topic, entry[1]) for topic, entry in sorted(entries.items()))}, separators=(",", ":"))
+            entries[self.manifest_topic] = (manifest, hashlib.sha1(manifest.encode("utf-8")).hexdigest())
+        self._entries = entries
+        if self.client.is_connected():
+            self.publish()
+
+    def publish(self):
+        """ publish changed and new descriptors, clear the retained ones that are gone """
+        changed = 0
+        for topic, (payload, digest) in self._entries.items():
+            if self._published.get(topic) != digest:
+                self.client.publish(topic, payload, 1, True)
+                self._published[topic] = digest
+                changed += 1
+        for topic in [topic for topic in self._published if topic not in self._entries]:
+            self.client.publish(topic, "", 1, True) # an empty retained message deletes it on the broker
+            del self._published[topic]
+            changed += 1
+        self.publishes += changed
+        if changed:
+            logger.info("Published %s of %s service descriptors", changed, len(self._entries))
+
+    def on_connect(self):
+        """
+        the broker may have lost retained messages (restart), publish every descriptor once more,
+        the ones published before and gone since get cleared
+        """
+        self._published = dict((topic, None) for topic in self._published)
+        self.publish()
@@ -0,0 +1,233 @@
+"""
+Time series sink for decoded UDS responses: every response becomes one InfluxDB line protocol line,
+lines are written in batches (by size or time) over one pooled HTTP session from a writer thread.
+While the database is unreachable new lines wait in memory (beyond MAX_BUFFER they are spilled to disk),
+writes are retried with exponential backoff and the spill file is written later in order, from where the last
+acknowledged batch ended (kept in <spill>.offset) instead of rewriting it.
+"""
+
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+URL = "http://localhost:8086"
+DATABASE = "mqttdb"
+MEASUREMENT = "uds"
+BATCH_SIZE = 500 # lines per write
+FLUSH_INTERVAL = 1.0 # seconds until a not yet full batch gets written
+MAX_BUFFER = 10000 # lines kept in memory, older ones go to the spill file
+MAX_SPILL = 16 * 1024 * 1024 # bytes, lines beyond are dropped
+TIMEOUT = 5.0 # seconds per HTTP request
+MAX_BACKOFF = 60.0 # seconds between writes while the database is down, doubling from flush_interval
+SPILL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "influx.spill")
+
+
+def _tag(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def _string(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def line(ecu, result, timestamp=None):
+    """ line protocol for one UDS response dict, None for errors and results without a service """
+    if not isinstance(result, dict) or result.get("type") != "uds":
+        return None
+    tags = "{},ecu={},service={},parameter={}".format(MEASUREMENT, _tag(ecu), _tag(result["service"]), _tag(result["parameter"]))
+    if result.get("unit"):
+        tags += ",unit=" + _tag(result["unit"])
+    fields = []
+    interpretation = result.get("interpretation")
+    if interpretation is not None:
+        try:
+            value = float(interpretation)
+        except (TypeError, ValueError):
+            fields.append("text=" + _string(interpretation))
+        else:
+            if math.isfinite(value): # the line protocol has no nan or inf, the database rejects the whole batch
+                fields.append("value={!r}".format(value))
+    if result.get("data") is not None:
+        fields.append("data=" + _string(result["data"]))
+    fields.append("sid=" + _string(result["SID"]))
+    timestamp = timestamp if timestamp is not None else time.time()
+    return "{} {} {}".format(tags, ",".join(fields), int(timestamp * 10**9))
+
+
+class InfluxSink(object):
+    """ add() never blocks, the writer thread does all network and disk I/O """
+
+    def __init__(self, url=URL, database=DATABASE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_buffer=MAX_BUFFER, spill_path=SPILL, max_spill=MAX_SPILL, timeout=TIMEOUT):
+        self.url = url.rstrip("/") + "/write"
+        self.params = {"db": database, "precision": "ns"}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self.max_spill = max_spill
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._buffer = deque()
+        self._overflow = [] # lines pushed out of the buffer, spilled by the writer
+        self._condition = threading.Condition()
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._backoff = 0.0
+        self._retry_at = 0.0 # monotonic time of the next write after a failure
+        self._thread = threading.Thread(target=self._run, name="influx", daemon=True)
+        self._thread.start()
+
+    def add(self, ecu, result, timestamp=None):
+        """ queue one UDS response (dict), other results are ignored """
+        entry = line(ecu, result, timestamp)
+        if entry is None:
+            return
+        with self._condition:
+            self._buffer.append(entry)
+            if len(self._buffer) > self.max_buffer:
+                self._overflow.append(self._buffer.popleft())
+            if len(self._buffer) == self.batch_size:
+                self._condition.notify()
+
+    def _write(self, lines):
+        """ one HTTP write, True on success """
+        started = time.monotonic()
+        try:
+            response = self.session.post(self.url, params=self.params, data="\n".join(lines).encode("utf-8"), timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.info("InfluxDB not reachable: %r", e)
+            self._failed()
+            return False
+        latency = time.monotonic() - started
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.batches += 1
+        if response.status_code >= 500:
+            logger.info("InfluxDB write failed: %s %s", response.status_code, response.text)
+            self._failed()
+            return False
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        if response.status_code >= 300:
+            # the database will never accept these lines, do not retry them
+            logger.error("InfluxDB rejected %s lines: %s %s", len(lines), response.status_code, response.text)
+            self.dropped += len(lines)
+            return True
+        self.written += len(lines)
+        return True
+
+    def _failed(self):
+        """ no writes until the backoff is over """
+        self.failures += 1
+        self._backoff = min(self._backoff * 2 or self.flush_interval, MAX_BACKOFF)
+        self._retry_at = time.monotonic() + self._backoff
+
+    def _offset(self):
+        """ bytes of the spill file already written to the database """
+        try:
+            with open(self.spill_path + ".offset") as offset:
+                return int(offset.read())
+        except (OSError, ValueError):
+            return 0
+
+    def _spill(self, lines):
+        if not lines:
+            return
+        size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+        if size > self.max_spill:
+            self.dropped += len(lines)
+            return
+        with open(self.spill_path, "a") as spill:
+            spill.write("\n".join(lines) + "\n")
+
+    def _replay(self):
+        """ write spilled lines (oldest first), True once the spill file is empty """
+        if not os.path.exists(self.spill_path):
+            return True
+        written = 0
+        with open(self.spill_path, "rb") as spill:
+            spill.seek(self._offset())
+            while True:
+                lines = [entry.decode("utf-8").rstrip("\n") for entry in itertools.islice(spill, self.batch_size)]
+                if not lines:
+                    break
+                if not self._write(lines):
+                    return False # the next try starts after the last acknowledged batch
+                written += len(lines)
+                # only acknowledged batches cost a (tiny) write
+                with open(self.spill_path + ".offset", "w") as offset:
+                    offset.write(str(spill.tell()))
+        # offset first, a stale one must never apply to a new spill file
+        if os.path.exists(self.spill_path + ".offset"):
+            os.remove(self.spill_path + ".offset")
+        os.remove(self.spill_path)
+        logger.info("Wrote %s spilled lines to InfluxDB", written)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                down = self._retry_at - time.monotonic()
+                if self._closed:
+                    pass
+                elif down > 0:
+                    # new lines wait in the buffer, only the overflow goes to disk
+                    self._condition.wait(down)
+                elif len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                overflow, self._overflow = self._overflow, []
+                closing = self._closed
+                down = time.monotonic() < self._retry_at
+                batch = None
+                if closing or not down:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                closed = closing and not self._buffer
+            # older lines first: spill file, then overflow, then the new batch
+            self._spill(overflow)
+            if batch is None:
+                continue
+            if down:
+                self._spill(batch) # closing, kept for the next start
+            elif not self._replay() or (batch and not self._write(batch)):
+                self._spill(batch)
+            if closed:
+                return
+
+    def stats(self):
+        with self._condition:
+            queued = len(self._buffer)
+        return {
+            "queued": queued,
+            "spilled_bytes": os.path.getsize(self.spill_path) - self._offset() if os.path.exists(self.spill_path) else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "failures": self.failures,
+            "latency_avg_ms": round(self.latency_total / self.batches * 1000, 3) if self.batches else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 3),
+        }
+
+    def close(self, timeout=TIMEOUT):
+        """ write or spill what is left and stop the writer """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self.session.close()
@@ -0,0 +1,157 @@
+"""
+Pool of bound ISO-TP sockets, one per (interface, txid, rxid).
+Sockets are reused between requests and closed after being idle for too long.
+Every ECU can have its own link profile (flow control, padding, CAN-FD frame size, see PROFILE and _calibration).
+"""
+
+import time
+import threading
+import logging
+import isotp
+
+
+logger = logging.getLogger(__name__)
+
+INTERFACE = "can0" # use vcan0 for virtual can or can0 for PiCAN2
+IDLE_TIMEOUT = 60 # seconds until an unused socket gets closed
+MAX_SOCKETS = 16
+# link profile of ECUs without an own one ("link" in the gateway config):
+# stmin / bs: flow control sent to the ECU (STmin in ms or 0xF1-0xF9 for 100-900 us, block size, 0 = no limit),
+# tx_stmin: least gap between our consecutive frames in ns, for ECUs that get overrun despite their flow control,
+# txpad / rxpad: padding byte (None = no padding), tx_dl: bytes per CAN frame, above 8 (up to 64) for CAN-FD
+PROFILE = {"stmin": 0, "bs": 8, "tx_stmin": None, "txpad": 0x55, "rxpad": 0xAA, "tx_dl": 8}
+CANFD_MTU = 72 # sizeof(struct canfd_frame)
+
+
+def _to_int(can_id):
+    """ accepts a can id as int, hex string ("063B") or "0x" prefixed string """
+    if isinstance(can_id, str):
+        return int(can_id, 0) if can_id.startswith("0x") else int(can_id, 16)
+    return can_id
+
+
+def link_profile(profile=None):
+    """ complete link profile, missing keys from PROFILE, padding bytes may be hex strings ("0x55") """
+    profile = dict(PROFILE, **(profile or {}))
+    for key in ("txpad", "rxpad"):
+        if profile[key] is not None:
+            profile[key] = _to_int(profile[key])
+    return profile
+
+
+def apply_profile(isotp_socket, profile=None):
+    """ set the options of a link profile on an ISO-TP socket, before it gets bound """
+    profile = link_profile(profile)
+    isotp_socket.set_opts(txpad=profile["txpad"], rxpad=profile["rxpad"], tx_stmin=profile["tx_stmin"])
+    isotp_socket.set_fc_opts(stmin=profile["stmin"], bs=profile["bs"])
+    if profile["tx_dl"] > 8:
+        isotp_socket.set_ll_opts(mtu=CANFD_MTU, tx_dl=profile["tx_dl"])
+
+
+def open_socket(interface, txid, rxid, profile=None):
+    """ default socket factory: a bound ISO-TP socket on a CAN interface, with the link profile of the ECU """
+    isotp_socket = isotp.socket()
+    apply_profile(isotp_socket, profile)
+    isotp_socket.bind(interface, isotp.Address(rxid=rxid, txid=txid))
+    return isotp_socket
+
+
+class _Connection(object):
+    def __init__(self, isotp_socket):
+        self.isotp_socket = isotp_socket
+        self.lock = threading.Lock() # UDS is request/response, one user per address at a time
+        self.last_used = time.monotonic()
+
+
+class ISOTPPool(object):
+    """
+    Keeps bound ISO-TP sockets alive between requests.
+    acquire() a connection and release() it afterwards, one user per address pair at a time.
+    """
+
+    def __init__(self, interface=INTERFACE, idle_timeout=IDLE_TIMEOUT, max_sockets=MAX_SOCKETS, socket_factory=open_socket):
+        self.interface = interface
+        self.socket_factory = socket_factory # (interface, txid, rxid, link profile) -> bound socket, e.g. _virtual_ecu.VirtualBus.open
+        self.profiles = {} # (txid, rxid) -> link profile, see PROFILE
+        self.idle_timeout = idle_timeout
+        self.max_sockets = max_sockets
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _open(self, txid, rxid):
+        isotp_socket = self.socket_factory(self.interface, txid, rxid, self.profiles.get((txid, rxid)))
+        logger.info("Opened ISO-TP socket on %s (txid %03X, rxid %03X)", self.interface, txid, rxid)
+        return isotp_socket
+
+    def _close(self, key, connection):
+        try:
+            connection.isotp_socket.close()
+        except Exception as e:
+            logger.info("Could not close ISO-TP socket %s: %s", key, e)
+        logger.info("Closed ISO-TP socket on %s (txid %03X, rxid %03X)", *key)
+
+    def _evict(self, now):
+        """ close idle sockets, then the least recently used ones while above max_sockets (needs self._lock) """
+        for key, connection in list(self._connections.items()):
+            if now - connection.last_used > self.idle_timeout and not connection.lock.locked():
+                self._close(key, self._connections.pop(key))
+        idle = sorted((c.last_used, k) for k, c in self._connections.items() if not c.lock.locked())
+        while len(self._connections) >= self.max_sockets and idle:
+            key = idle.pop(0)[1]
+            self._close(key, self._connections.pop(key))
+
+    def acquire(self, txid, rxid):
+        """ returns the (locked) connection for the given address pair, opens a socket if needed """
+        key = (self.interface, _to_int(txid), _to_int(rxid))
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                connection = self._connections.get(key)
+                if connection is None or now - self._last_sweep > self.idle_timeout:
+                    self._last_sweep = now
+                    self._evict(now)
+                    connection = self._connections.get(key)
+                if connection is None:
+                    connection = _Connection(self._open(key[1], key[2]))
+                    self._connections[key] = connection
+            connection.lock.acquire()
+            if self._connections.get(key) is connection:
+                return connection
+            # evicted while waiting for the lock, get a fresh one
+            connection.lock.release()
+
+    def release(self, connection, broken=False):
+        """ hand a connection back, broken connections get closed and reopened on next use """
+        connection.last_used = time.monotonic()
+        if broken:
+            with self._lock:
+                for key, value in list(self._connections.items()):
+                    if value is connection:
+                        self._close(key, self._connections.pop(key))
+        connection.lock.release()
+
+    def set_profile(self, txid, rxid, profile):
+        """ link profile for an address pair (None: PROFILE), an idle socket with the old one gets closed """
+        txid, rxid = _to_int(txid), _to_int(rxid)
+        with self._lock:
+            self.profiles[(txid, rxid)] = profile
+            key = (self.interface, txid, rxid)
+            connection = self._connections.get(key)
+            if connection is not None and not connection.lock.locked():
+                self._close(key, self._connections.pop(key))
+
+    def evict(self):
+        """ close all sockets that have been idle for longer than idle_timeout """
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def close(self):
+        """ close all sockets """
+        with self._lock:
+            for key in list(self._connections):
+                self._close(key, self._connections.pop(key))
+
+    def __len__(self):
+        return len(self._connections)
+
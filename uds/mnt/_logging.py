@@ -0,0 +1,80 @@
+"""
+Logging setup of the services: records are handed to a queue and written by one listener thread,
+so a slow stdout (SD card, docker json-file log driver) never blocks the event loop.
+UDS_LOG_LEVEL sets the level (INFO), per-request lines are logged for every UDS_LOG_SAMPLE-th request only (100, 0 = off).
+Log calls on the request path use %-style arguments, formatting is skipped below the level.
+"""
+
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+
+
+LEVEL = os.environ.get("UDS_LOG_LEVEL", "INFO").upper()
+SAMPLE = int(os.environ.get("UDS_LOG_SAMPLE", "100"))
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+MAX_QUEUE = 10000 # records waiting for the listener, newer ones are dropped
+
+_listener = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ drops records instead of blocking (or raising) while the queue is full """
+
+    def __init__(self, records):
+        logging.handlers.QueueHandler.__init__(self, records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(level=LEVEL, stream=None):
+    """ route all records of the process through the queue, calling it again only changes the level """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return
+    records = queue.Queue(MAX_QUEUE)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(logging.Formatter(FORMAT))
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop) # write what is queued before exiting
+
+
+class Hex(object):
+    """ log argument, bytes formatted as hex only if the record gets written """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return self.payload.hex()
+
+
+class Sampler(object):
+    """ calling it is True for every n-th call, never for n = 0 """
+
+    def __init__(self, every=SAMPLE):
+        self.every = every
+        self._calls = 0
+
+    def __call__(self):
+        if not self.every:
+            return False
+        self._calls += 1
+        if self._calls < self.every:
+            return False
+        self._calls = 0
+        return True
@@ -0,0 +1,167 @@
+"""
+Per-request stage timing for the gateway. Every request carries a Trace that marks the end of each stage
+(MQTT receipt -> handler, ECU lock, socket, session, transmit, ECU response, decode, publish), finished traces
+are aggregated into HDR-style histograms per ECU, UDS service and stage. A few clock reads and dict updates
+per request, cheap enough to stay on.
+"""
+
+import time
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE = "queue" # MQTT receipt until the handler runs
+LOCK = "lock" # waiting for earlier requests of the ECU
+CONNECT = "connect" # ISO-TP socket from the pool (connectISOTP)
+SESSION = "session" # switching the diagnostic session
+TRANSMIT = "transmit" # sending the request (_transmitISOTP)
+WAIT = "wait" # until the final response arrived (_receiveISOTP)
+DECODE = "decode"
+PUBLISH = "publish" # encoding and handing the response to the MQTT client
+TOTAL = "total"
+STAGES = (QUEUE, LOCK, CONNECT, SESSION, TRANSMIT, WAIT, DECODE, PUBLISH, TOTAL)
+INTERVAL = 60.0 # seconds between metrics messages
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram(object):
+    """
+    latencies in microseconds with a relative error below 1 / 2**precision (HDR histogram layout):
+    values below 2 * 2**precision get one bucket each, above every power of two is split into 2**precision buckets
+    """
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        self.counts = {} # bucket index -> count, sparse
+        self.count = 0
+        self.total = 0 # microseconds
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < 2 * self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision - 1
+        return self.sub_buckets * shift + (value >> shift)
+
+    def _value(self, index):
+        """ highest value of a bucket """
+        if index < 2 * self.sub_buckets:
+            return index
+        shift = index // self.sub_buckets - 1
+        return ((index - self.sub_buckets * shift + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def quantiles(self, quantiles=QUANTILES):
+        """ {quantile: seconds}, upper bound of the bucket holding the quantile """
+        result = {}
+        if not self.count:
+            return result
+        pending = sorted(quantiles)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending and seen >= pending[0] * self.count:
+                result[pending.pop(0)] = min(self._value(index), self.max) / 1000000
+            if not pending:
+                break
+        return result
+
+    def stats(self):
+        """ summary in ms """
+        stats = {"count": self.count}
+        if self.count:
+            stats["mean"] = round(self.total / self.count / 1000, 3)
+            stats["min"] = round(self.min / 1000, 3)
+            stats["max"] = round(self.max / 1000, 3)
+            for quantile, value in self.quantiles().items():
+                stats["p{:g}".format(quantile * 100)] = round(value * 1000, 3)
+        return stats
+
+
+class Trace(object):
+    """ stage timings of one request, mark(stage) ends a stage that began at the previous mark """
+    __slots__ = ("ecu", "service", "started", "last", "stages")
+
+    def __init__(self, ecu, service, started=None):
+        self.ecu = ecu
+        self.service = service
+        self.started = self.last = started or time.monotonic()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.monotonic()
+        # stages repeat (e.g. one wait per request of a batch), they add up
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+class Metrics(object):
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.histograms = {} # (ecu, service, stage) -> Histogram
+
+    def trace(self, ecu, service, started=None):
+        """ new Trace, started is the time.monotonic() of the MQTT receipt (paho's msg.timestamp) """
+        return Trace(ecu, service, started)
+
+    def finish(self, trace):
+        trace.stages[TOTAL] = time.monotonic() - trace.started
+        for stage, seconds in trace.stages.items():
+            key = (trace.ecu, trace.service, stage)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.precision)
+            histogram.record(seconds)
+
+    def stats(self):
+        """ {ecu: {service: {stage: summary in ms}}} since the start """
+        result = {}
+        for (ecu, service, stage), histogram in sorted(self.histograms.items()):
+            result.setdefault(ecu, {}).setdefault(service, {})[stage] = histogram.stats()
+        return result
+
+    def prometheus(self):
+        """ all histograms in the Prometheus text format, as summaries in seconds """
+        lines = ["# HELP uds_stage_seconds Time per request stage of the UDS gateway.", "# TYPE uds_stage_seconds summary"]
+        for (ecu, service, stage), histogram in sorted(self.histograms.items()):
+            labels = 'ecu="{}",service="{}",stage="{}"'.format(ecu, service, stage)
+            for quantile, value in histogram.quantiles().items():
+                lines.append('uds_stage_seconds{{{},quantile="{:g}"}} {:.6f}'.format(labels, quantile, value))
+            lines.append("uds_stage_seconds_sum{{{}}} {:.6f}".format(labels, histogram.total / 1000000))
+            lines.append("uds_stage_seconds_count{{{}}} {}".format(labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port, host="0.0.0.0"):
+        """ Prometheus scrape endpoint (any path), for the lifetime of the returned server """
+        async def handle(reader, writer):
+            try:
+                # the request itself does not matter, read up to the end of its headers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                body = self.prometheus().encode("utf-8")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             + "Content-Length: {}\r\nConnection: close\r\n\r\n".format(len(body)).encode("ascii") + body)
+                await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+        server = await asyncio.start_server(handle, host, port)
+        logger.info("Prometheus metrics on port %s", port)
+        return server
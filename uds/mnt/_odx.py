@@ -0,0 +1,272 @@
+"""
+Import of ODX diagnostic databases (ASAM MCD-2D: .odx/.odx-d files or .pdx archives of them) into catalog sections
+(see _catalog). Every diagnostic layer (base variant, ECU variant, ...) becomes one section with the services it defines
+or inherits from its parent layers. Imported are what the catalog can express: SID and ID of the requests, their
+value parameters and the data of the positive responses (identical, linear and text table conversions, units).
+Session preconditions, negative responses and dynamic lengths are left out.
+
+usage: python3 gateway.py --import-catalog vendor.pdx (writes one catalog section per layer)
+"""
+
+import zipfile
+import logging
+import xml.etree.ElementTree as ElementTree
+
+
+logger = logging.getLogger(__name__)
+
+# ISO 14229 names for SIDs the base catalog does not know
+SERVICE_NAMES = {
+    0x10: "DiagnosticSessionControl",
+    0x11: "ECUReset",
+    0x14: "ClearDiagnosticInformation",
+    0x19: "ReadDTCInformation",
+    0x22: "ReadDataByIdentifier",
+    0x23: "ReadMemoryByAddress",
+    0x27: "SecurityAccess",
+    0x28: "CommunicationControl",
+    0x2E: "WriteDataByIdentifier",
+    0x2F: "InputOutputControlByIdentifier",
+    0x31: "RoutineControl",
+    0x34: "RequestDownload",
+    0x35: "RequestUpload",
+    0x36: "TransferData",
+    0x37: "RequestTransferExit",
+    0x3E: "TesterPresent",
+    0x85: "ControlDTCSetting",
+}
+LAYERS = ("PROTOCOL", "FUNCTIONAL-GROUP", "BASE-VARIANT", "ECU-VARIANT", "ECU-SHARED-DATA")
+TEXT_TYPES = ("A_ASCIISTRING", "A_UTF8STRING", "A_UNICODE2STRING")
+
+
+def _documents(path):
+    """ root elements of an .odx file or of all ODX files in a .pdx archive """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.lower().rsplit(".", 1)[-1] in ("odx", "odx-d", "odx-c", "odx-cs"):
+                    yield ElementTree.fromstring(archive.read(name))
+    else:
+        yield ElementTree.parse(path).getroot()
+
+
+def _strip(root):
+    """ drop XML namespaces (xsi:type becomes type) """
+    for element in root.iter():
+        element.tag = element.tag.rsplit("}", 1)[-1]
+        if element.attrib:
+            element.attrib = dict((key.rsplit("}", 1)[-1], value) for key, value in element.attrib.items())
+    return root
+
+
+def _text(element, path, default=None):
+    found = element.find(path)
+    if found is None:
+        return default
+    return "".join(found.itertext()).strip() or default
+
+
+def _integer(text):
+    """ CODED-VALUE, decimal or 0x hex """
+    text = text.strip()
+    return int(text, 16) if text.lower().startswith("0x") else int(text)
+
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+class _Database(object):
+    """ all elements with an ID of the imported files, references get resolved over file boundaries """
+
+    def __init__(self, roots, names):
+        self.names = names # SID -> service name
+        self.ids = {}
+        self.layers = []
+        for root in roots:
+            for element in _strip(root).iter():
+                if "ID" in element.attrib:
+                    self.ids[element.get("ID")] = element
+                if element.tag in LAYERS:
+                    self.layers.append(element)
+        self._services = {} # layer ID -> services
+
+    def ref(self, element, path):
+        found = element.find(path)
+        return None if found is None else self.ids.get(found.get("ID-REF"))
+
+    def _length(self, element):
+        """ bytes of a DIAG-CODED-TYPE with fixed length, else None """
+        coded = element.find("DIAG-CODED-TYPE")
+        if coded is None or coded.get("type", "STANDARD-LENGTH-TYPE") != "STANDARD-LENGTH-TYPE":
+            return None
+        bits = _text(coded, "BIT-LENGTH")
+        return (int(bits) + 7) // 8 if bits else None
+
+    def _conversion(self, dop):
+        """ catalog spec ("scale", "offset", "enum", "encoding") of a DATA-OBJECT-PROP """
+        coded = dop.find("DIAG-CODED-TYPE")
+        base = coded.get("BASE-DATA-TYPE") if coded is not None else None
+        length = self._length(dop)
+        category = _text(dop, "COMPU-METHOD/CATEGORY")
+        spec = {}
+        if category == "LINEAR":
+            coefficients = dop.find("COMPU-METHOD/COMPU-INTERNAL-TO-PHYS/COMPU-SCALES/COMPU-SCALE/COMPU-RATIONAL-COEFFS")
+            numerator = [_number(v.text) for v in coefficients.findall("COMPU-NUMERATOR/V")] if coefficients is not None else []
+            denominator = [_number(v.text) for v in coefficients.findall("COMPU-DENOMINATOR/V")] if coefficients is not None else []
+            denominator = denominator[0] if denominator else 1
+            offset = numerator[0] / denominator if numerator else 0
+            scale = numerator[1] / denominator if len(numerator) > 1 else 1
+            spec["encoding"] = "uint"
+            if scale != 1:
+                spec["scale"] = _number(scale)
+            if offset:
+                spec["offset"] = _number(offset)
+        elif category == "TEXTTABLE":
+            enum = {}
+            for scale in dop.findall("COMPU-METHOD/COMPU-INTERNAL-TO-PHYS/COMPU-SCALES/COMPU-SCALE"):
+                lower, upper = _text(scale, "LOWER-LIMIT"), _text(scale, "UPPER-LIMIT")
+                text = _text(scale, "COMPU-CONST/VT")
+                if lower is None or text is None or (upper is not None and upper != lower) or not length:
+                    continue # ranges can not be expressed
+                enum[int(_number(lower)).to_bytes(length, "big").hex().upper()] = text
+            spec["enum"] = enum
+        elif base in TEXT_TYPES:
+            spec["encoding"] = "utf-8"
+        elif base in ("A_UINT32", "A_INT32"):
+            spec["encoding"] = "uint"
+        unit = self.ref(dop, "UNIT-REF")
+        if unit is not None:
+            spec["unit"] = _text(unit, "DISPLAY-NAME") or _text(unit, "SHORT-NAME")
+        return spec, length
+
+    def _params(self, message):
+        """ (ID bytes after the SID, [(name, byte position, length or None, spec, param)]) of a REQUEST or POS-RESPONSE """
+        identifier = b""
+        values = []
+        for param in sorted(message.findall("PARAMS/PARAM"), key=lambda param: int(_text(param, "BYTE-POSITION", "0"))):
+            kind = param.get("type")
+            position = int(_text(param, "BYTE-POSITION", "0"))
+            if kind == "CODED-CONST":
+                if position == 0:
+                    continue # the SID
+                length = self._length(param) or 1
+                identifier += _integer(_text(param, "CODED-VALUE")).to_bytes(length, "big")
+            elif kind == "MATCHING-REQUEST-PARAM":
+                continue # echo of the request, part of the ID
+            elif kind in ("VALUE", "PHYS-CONST"):
+                dop = self.ref(param, "DOP-REF")
+                spec, length = self._conversion(dop) if dop is not None else ({}, None)
+                values.append((_text(param, "SHORT-NAME"), position, length, spec, param))
+        return identifier, values
+
+    def _sid(self, message):
+        for param in message.findall("PARAMS/PARAM"):
+            if param.get("type") == "CODED-CONST" and int(_text(param, "BYTE-POSITION", "0")) == 0:
+                return _integer(_text(param, "CODED-VALUE"))
+        return None
+
+    def _response(self, service, start):
+        """ "response" entry of a request: decoding of the data of the first positive response """
+        response = self.ref(service, "POS-RESPONSE-REFS/POS-RESPONSE-REF")
+        if response is None:
+            return None
+        _, values = self._params(response)
+        entry = {}
+        if len(values) == 1:
+            name, position, length, spec, _ = values[0]
+            unit = spec.pop("unit", None)
+            entry["decode"] = spec
+            if unit:
+                entry["unit"] = unit
+            if length:
+                entry["length"] = length
+        elif values:
+            fields = []
+            for name, position, length, spec, _ in values:
+                field = dict(spec, start=position - start)
+                if length:
+                    field["length"] = length
+                fields.append(field)
+            entry["decode"] = {"fields": fields}
+            if all(length for _, _, length, _, _ in values):
+                entry["length"] = max(position + length for _, position, length, _, _ in values) - start
+        else:
+            entry["decode"] = {}
+        return entry
+
+    def _service(self, service):
+        """ (service name, SID, parameter name, entry) of a DIAG-SERVICE or None """
+        request = self.ref(service, "REQUEST-REF")
+        if request is None:
+            return None
+        sid = self._sid(request)
+        if sid is None:
+            return None
+        identifier, values = self._params(request)
+        entry = {"ID": identifier.hex().upper()}
+        description = _text(service, "DESC") or _text(service, "LONG-NAME")
+        if description:
+            entry["description"] = description
+        parameters = {}
+        for name, position, length, spec, param in values:
+            spec.pop("unit", None)
+            parameter = dict(spec, type="string" if spec.get("encoding") == "utf-8" else "integer")
+            if length:
+                parameter["length"] = length
+                parameter["bit"] = "{:X}".format((position + length - 1) * 8)
+            else:
+                parameter["bit"] = "{:X}".format(position * 8) # unknown length, assume one byte
+            default = _text(param, "PHYSICAL-DEFAULT-VALUE")
+            if default is not None:
+                parameter["default"] = default
+            description = _text(param, "DESC") or _text(param, "LONG-NAME")
+            if description:
+                parameter["description"] = description
+            parameters[name] = parameter
+        if parameters:
+            entry["parameters"] = parameters
+        response = self._response(service, 1 + len(identifier))
+        if response is not None:
+            entry["response"] = response
+        name = self.names.get(sid) or SERVICE_NAMES.get(sid) or "Service{:02X}".format(sid)
+        return name, sid, _text(service, "SHORT-NAME"), entry
+
+    def services(self, layer):
+        """ catalog services of a layer, with the ones inherited from its parents """
+        key = layer.get("ID")
+        if key in self._services:
+            return self._services[key]
+        self._services[key] = services = {}
+        for parent_ref in layer.findall("PARENT-REFS/PARENT-REF"):
+            parent = self.ids.get(parent_ref.get("ID-REF"))
+            if parent is not None:
+                for name, parameters in self.services(parent).items():
+                    services.setdefault(name, {}).update(parameters)
+        elements = layer.findall("DIAG-COMMS/DIAG-SERVICE")
+        elements += [self.ids[ref.get("ID-REF")] for ref in layer.findall("DIAG-COMMS/DIAG-COMM-REF") if ref.get("ID-REF") in self.ids]
+        for element in elements:
+            try:
+                result = self._service(element)
+            except (ValueError, TypeError, AttributeError, OverflowError) as e:
+                logger.info("Skipping ODX service %s: %s", _text(element, "SHORT-NAME"), e)
+                continue
+            if result is None:
+                continue
+            name, sid, parameter, entry = result
+            services.setdefault(name, {"ID": "{:02X}".format(sid)})[parameter] = entry
+        return services
+
+
+def read(path, names=None):
+    """ {layer short name: services} of an ODX or PDX file, names maps SIDs to the service names to use """
+    database = _Database(_documents(path), names or {})
+    sections = {}
+    for layer in database.layers:
+        services = database.services(layer)
+        if services:
+            sections[_text(layer, "SHORT-NAME")] = services
+    logger.info("Imported %s layers with %s services from %s", len(sections),
+                sum(len(parameters) - 1 for services in sections.values() for parameters in services.values()), path)
+    return sections
@@ -0,0 +1,58 @@
+"""
+On-disk ring buffer (SQLite) for MQTT publishes that could not be sent while the broker was unreachable.
+Writes are not synced to disk one by one (synchronous=OFF), a crash of the OS may lose the newest entries,
+a crash of the process does not. When full, the oldest entries are dropped.
+"""
+
+import sqlite3
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 10000
+
+
+class Outbox(object):
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, payload BLOB, qos INTEGER, retain INTEGER)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        if self._count:
+            logger.info("%s stored messages in %s", self._count, path)
+
+    def put(self, topic, payload, qos, retain):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self._lock:
+            self._db.execute("INSERT INTO messages (topic, payload, qos, retain) VALUES (?, ?, ?, ?)", (topic, payload, qos, int(retain)))
+            self._count += 1
+            if self._count > self.max_entries:
+                evict = self._count - self.max_entries
+                self._db.execute("DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)", (evict,))
+                self._count -= evict
+                self.dropped += evict
+
+    def oldest(self, limit, after=0):
+        """ up to limit entries (id, topic, payload, qos, retain) with an id above after, oldest first """
+        with self._lock:
+            return self._db.execute("SELECT id, topic, payload, qos, retain FROM messages WHERE id > ? ORDER BY id LIMIT ?", (after, limit)).fetchall()
+
+    def remove(self, ids):
+        with self._lock:
+            removed = self._db.executemany("DELETE FROM messages WHERE id = ?", [(id,) for id in ids]).rowcount
+            self._count -= max(removed, 0)
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,232 @@
+"""
+Payload formats for responses: "json" (default, hex strings as before), "cbor" (built in) and
+"msgpack" (if the msgpack package is installed). The binary formats carry SID, PID and data as raw bytes,
+the decoded value typed (number, text, fields) instead of its string and leave out empty keys and descriptions.
+Testers select the format per request ({"format": "cbor"}) or the gateway per response topic (config "formats").
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = "json"
+CBOR = "cbor"
+MSGPACK = "msgpack"
+FORMATS = [JSON, CBOR] + ([MSGPACK] if msgpack else [])
+HEX_KEYS = ("SID", "PID", "data")
+
+
+class Interpretation(str):
+    """ interpretation string of a response (as published in JSON) that keeps the decoded value for the binary formats """
+
+    def __new__(cls, value):
+        interpretation = str.__new__(cls, value)
+        interpretation.value = value
+        return interpretation
+
+
+def _compact(result):
+    """ result with raw bytes and typed values, for the binary formats """
+    if not isinstance(result, dict):
+        return result
+    if result.get("type") == "batch":
+        return {"type": "batch", "results": dict((parameter, _compact(value)) for parameter, value in result["results"].items())}
+    compact = {}
+    for key, value in result.items():
+        if value is None or key == "description":
+            continue # the descriptions are in the service discovery messages
+        if key in HEX_KEYS and isinstance(value, str):
+            value = bytes.fromhex(value)
+        elif key == "interpretation":
+            value = getattr(value, "value", value) # as decoded, see Interpretation
+        compact[key] = value
+    return compact
+
+
+def _cbor_head(major, length):
+    if length < 24:
+        return bytes([major << 5 | length])
+    if length < 0x100:
+        return struct.pack(">BB", major << 5 | 24, length)
+    if length < 0x10000:
+        return struct.pack(">BH", major << 5 | 25, length)
+    if length < 0x100000000:
+        return struct.pack(">BI", major << 5 | 26, length)
+    return struct.pack(">BQ", major << 5 | 27, length)
+
+
+_STRINGS = {} # str -> CBOR item, keys and catalog names repeat in every response
+MAX_STRINGS = 4096
+
+
+def _cbor_str(value, parts):
+    item = _STRINGS.get(value)
+    if item is None:
+        encoded = value.encode("utf-8")
+        item = _cbor_head(3, len(encoded)) + encoded
+        if len(_STRINGS) < MAX_STRINGS:
+            _STRINGS[value] = item
+    parts.append(item)
+
+
+def _cbor_bytes(value, parts):
+    parts.append(_cbor_head(2, len(value)))
+    parts.append(bytes(value))
+
+
+def _cbor_int(value, parts):
+    if -0x10000000000000000 <= value < 0x10000000000000000:
+        parts.append(_cbor_head(0, value) if value >= 0 else _cbor_head(1, -1 - value))
+        return
+    # beyond 64 bits: bignum, tag 2 (positive) or 3 (negative) on the big endian bytes
+    tag, magnitude = (0xc2, value) if value >= 0 else (0xc3, -1 - value)
+    parts.append(bytes([tag]))
+    _cbor_bytes(magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "big"), parts)
+
+
+def _cbor_float(value, parts):
+    parts.append(struct.pack(">Bd", 0xfb, value))
+
+
+def _cbor_list(value, parts):
+    parts.append(_cbor_head(4, len(value)))
+    for item in value:
+        _cbor(item, parts)
+
+
+def _cbor_dict(value, parts):
+    parts.append(_cbor_head(5, len(value)))
+    for key, item in value.items():
+        _cbor(key, parts)
+        _cbor(item, parts)
+
+
+def _cbor_constant(item):
+    return lambda value, parts: parts.append(item)
+
+
+_ENCODERS = {
+    str: _cbor_str,
+    bytes: _cbor_bytes,
+    bytearray: _cbor_bytes,
+    memoryview: _cbor_bytes,
+    int: _cbor_int,
+    float: _cbor_float,
+    list: _cbor_list,
+    tuple: _cbor_list,
+    dict: _cbor_dict,
+    bool: lambda value, parts: parts.append(b"\xf5" if value else b"\xf4"),
+    type(None): _cbor_constant(b"\xf6"),
+}
+
+
+def _cbor(value, parts):
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        # subclasses, e.g. OrderedDict
+        for kind in (dict, str, bytes, int, float, list, tuple):
+            if isinstance(value, kind):
+                encoder = _ENCODERS[kind]
+                break
+        else:
+            raise TypeError("Cannot encode {!r} as CBOR".format(value))
+    encoder(value, parts)
+
+
+def cbor_dumps(value):
+    parts = []
+    _cbor(value, parts)
+    return b"".join(parts)
+
+
+def _cbor_read(data, offset):
+    """ (value, next offset) of the CBOR item at offset, definite lengths only """
+    head = data[offset]
+    major, info = head >> 5, head & 0x1f
+    offset += 1
+    if major == 7:
+        if info == 20:
+            return False, offset
+        if info == 21:
+            return True, offset
+        if info == 22:
+            return None, offset
+        if info == 27:
+            return struct.unpack_from(">d", data, offset)[0], offset + 8
+        if info == 26:
+            return struct.unpack_from(">f", data, offset)[0], offset + 4
+        raise ValueError("Unsupported CBOR simple value {}".format(info))
+    if info < 24:
+        length = info
+    elif info <= 27:
+        size = 1 << (info - 24)
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    else:
+        raise ValueError("Unsupported CBOR length {}".format(info))
+    if major == 6:
+        item, offset = _cbor_read(data, offset)
+        if length in (2, 3) and isinstance(item, bytes):
+            magnitude = int.from_bytes(item, "big")
+            return (magnitude if length == 2 else -1 - magnitude), offset
+        raise ValueError("Unsupported CBOR tag {}".format(length))
+    if major == 0:
+        return length, offset
+    if major == 1:
+        return -1 - length, offset
+    if major == 2:
+        return bytes(data[offset:offset + length]), offset + length
+    if major == 3:
+        return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+    if major == 4:
+        items = []
+        for _ in range(length):
+            item, offset = _cbor_read(data, offset)
+            items.append(item)
+        return items, offset
+    if major == 5:
+        items = {}
+        for _ in range(length):
+            key, offset = _cbor_read(data, offset)
+            items[key], offset = _cbor_read(data, offset)
+        return items, offset
+    raise ValueError("Unsupported CBOR major type {}".format(major))
+
+
+def cbor_loads(data):
+    return _cbor_read(data, 0)[0]
+
+
+def response_format(message, response, formats=None):
+    """ payload format asked for in the request, else the one configured for the response topic, else json """
+    if message.get("format"):
+        return message["format"]
+    for _, format in formats.match(response) if formats is not None and response else ():
+        return format
+    return JSON
+
+
+def encode(result, format=JSON):
+    """ MQTT payload of a result dict in the given format, TypeError or ValueError if a value does not fit the format """
+    if format == CBOR:
+        return cbor_dumps(_compact(result))
+    if format == MSGPACK and msgpack:
+        try:
+            return msgpack.packb(_compact(result), use_bin_type=True)
+        except OverflowError as e: # integers beyond 64 bits
+            raise ValueError(e)
+    return json.dumps(result)
+
+
+def decode(payload, format=JSON):
+    """ result dict of a payload in the given format (for testers) """
+    if format == CBOR:
+        return cbor_loads(payload)
+    if format == MSGPACK and msgpack:
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload)
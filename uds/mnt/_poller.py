@@ -0,0 +1,136 @@
+"""
+Periodic DID polling for the gateway: testers register (ECU, parameter, period, topic) once,
+the poller reads all due parameters of an ECU with as few (multi-DID) requests as possible
+and streams every decoded sample to the topic of the subscription.
+"""
+
+import time
+import asyncio
+import logging
+import itertools
+import _payload
+
+
+logger = logging.getLogger(__name__)
+
+MIN_PERIOD = 0.05 # seconds
+
+
+class Subscription(object):
+    def __init__(self, id, ecu, parameter, period, topic, payload_format=_payload.JSON):
+        self.id = id
+        self.ecu = ecu
+        self.parameter = parameter
+        self.period = period
+        self.topic = topic
+        self.payload_format = payload_format
+        self.deadline = 0.0 # loop time of the next sample
+        self.samples = 0
+        self.missed = 0 # deadlines skipped because the previous read was late
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    def stats(self):
+        return {
+            "id": self.id,
+            "ecu": self.ecu.name,
+            "parameter": self.parameter,
+            "period": self.period,
+            "topic": self.topic,
+            "format": self.payload_format,
+            "samples": self.samples,
+            "missed": self.missed,
+            "jitter_avg_ms": round(self.jitter_total / self.samples * 1000, 3) if self.samples else 0.0,
+            "jitter_max_ms": round(self.jitter_max * 1000, 3),
+        }
+
+
+class Poller(object):
+    def __init__(self, ecus, client):
+        self.ecus = dict((ecu.name, ecu) for ecu in ecus)
+        self.client = client
+        self.subscriptions = {}
+        self._ids = itertools.count(1)
+        self._reading = {} # ECU name -> task of its running read
+        self._wakeup = asyncio.Event()
+
+    def add(self, ecu, parameter, period, topic, payload_format=_payload.JSON):
+        """ start polling, returns the new subscription """
+        if ecu not in self.ecus:
+            raise ValueError("unknown ECU {}".format(ecu))
+        if ("ReadDataByIdentifier", parameter) not in self.ecus[ecu].exposed:
+            raise ValueError("ReadDataByIdentifier / {} is not available on {}".format(parameter, ecu))
+        if payload_format not in _payload.FORMATS:
+            raise ValueError("Unknown payload format {}".format(payload_format))
+        subscription = Subscription(next(self._ids), self.ecus[ecu], parameter, max(float(period), MIN_PERIOD), topic, payload_format)
+        subscription.deadline = asyncio.get_running_loop().time()
+        self.subscriptions[subscription.id] = subscription
+        self._wakeup.set()
+        return subscription
+
+    def remove(self, id):
+        return self.subscriptions.pop(id, None) is not None
+
+    def stats(self):
+        return [subscription.stats() for subscription in self.subscriptions.values()]
+
+    async def _read(self, ecu, due):
+        """ one batched read for all due subscriptions of an ECU, then publish the samples """
+        parameters = list(dict.fromkeys(subscription.parameter for subscription in due))
+        try:
+            result = await ecu.read(self.client, None, parameters, use_cache=False)
+        except Exception as e:
+            logger.error("Polling %s on %s failed: %r", parameters, ecu.name, e)
+            result = {"type": "error", "error": str(e)}
+        timestamp = time.time()
+        try:
+            for subscription in due:
+                if subscription.id not in self.subscriptions:
+                    continue # removed meanwhile
+                if result.get("type") == "error":
+                    sample = dict(result)
+                else:
+                    sample = dict(result["results"].get(subscription.parameter) or {"type": "error", "error": "no response"})
+                sample["timestamp"] = timestamp
+                sample["subscription"] = subscription.id
+                try:
+                    self.client.publish(subscription.topic, _payload.encode(sample, subscription.payload_format), 0)
+                except Exception as e:
+                    logger.error("Publishing sample of subscription %s failed: %r", subscription.id, e)
+        finally:
+            # the ECU is free again, its next deadlines count from now on
+            self._reading.pop(ecu.name, None)
+            self._wakeup.set()
+
+    def _schedule(self, now):
+        """ start reads for all due subscriptions of idle ECUs, returns the next deadline """
+        due = {}
+        for subscription in self.subscriptions.values():
+            if subscription.deadline <= now and subscription.ecu.name not in self._reading:
+                due.setdefault(subscription.ecu.name, []).append(subscription)
+        for name, subscriptions in due.items():
+            for subscription in subscriptions:
+                late = now - subscription.deadline
+                skipped = int(late // subscription.period)
+                # lateness against the deadline actually served, skipped ones only count as missed
+                jitter = late - skipped * subscription.period
+                subscription.samples += 1
+                subscription.missed += skipped
+                subscription.jitter_total += jitter
+                subscription.jitter_max = max(subscription.jitter_max, jitter)
+                # stay on the original grid, skipped deadlines are not made up for
+                subscription.deadline += (skipped + 1) * subscription.period
+            self._reading[name] = asyncio.ensure_future(self._read(self.ecus[name], subscriptions))
+        waiting = [s.deadline for s in self.subscriptions.values() if s.ecu.name not in self._reading]
+        return min(waiting) if waiting else None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            deadline = self._schedule(loop.time())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,112 @@
+"""
+Per-ECU cache of UDS responses with a time to live per entry (see "ttl" in the catalog) and LRU eviction.
+Concurrent identical requests share one bus transaction (fetch), also for entries that are not cached.
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 256
+
+
+class ResponseCache(object):
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires, response), least recently used first
+        self._inflight = {} # key -> task of the running request
+        self._waiters = {} # key -> _Waiters of the running request
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """ cached response or None """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, response, ttl):
+        if not ttl or ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, keys=None):
+        """ drop the given keys, or everything """
+        if keys is None:
+            self._entries.clear()
+            return
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def fetch(self, key, ttl, request, on_pending=None):
+        """
+        cached response for key (looked up only if ttl > 0), otherwise await request(pending) once for all
+        concurrent callers and cache the result for ttl seconds if cacheable(result).
+        pending(payload) passes a "response pending" notice on to on_pending of every waiting caller
+        """
+        if ttl and ttl > 0:
+            response = self.get(key)
+            if response is not None:
+                return response
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            waiters = self._waiters[key]
+            if on_pending is not None:
+                waiters.append(on_pending)
+                if waiters.last is not None:
+                    on_pending(waiters.last) # joined after the ECU asked for more time
+            return await asyncio.shield(task)
+        waiters = self._waiters[key] = _Waiters([on_pending] if on_pending is not None else [])
+        task = asyncio.ensure_future(request(waiters.pending))
+        self._inflight[key] = task
+        try:
+            response = await asyncio.shield(task)
+        finally:
+            self._inflight.pop(key, None)
+            self._waiters.pop(key, None)
+        if cacheable(response):
+            self.put(key, response, ttl)
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class _Waiters(list):
+    """ on_pending callbacks of the callers sharing one request """
+
+    def __init__(self, callbacks):
+        list.__init__(self, callbacks)
+        self.last = None # latest "response pending" payload
+
+    def pending(self, payload):
+        self.last = payload
+        for on_pending in self:
+            on_pending(payload)
+
+
+def cacheable(response):
+    """ only positive UDS responses get cached """
+    return isinstance(response, dict) and response.get("type") == "uds" and response.get("SID") not in (None, "7f")
@@ -0,0 +1,173 @@
+"""
+ECU address discovery: finds the (txid, rxid) pairs of all ECUs on the bus in seconds.
+A raw CAN socket sends single frame TesterPresent requests to a window of request ids at once
+(plus one functional request on 0x7DF), only windows that got an answer are probed id by id.
+The found ECUs are identified (F18C serial number, F190 VIN) over ISO-TP, many at the same time.
+"""
+
+import time
+import socket
+import struct
+import select
+import asyncio
+import logging
+
+import _catalog
+import _uds_async
+import _uds_helper
+import _isotp_pool
+
+
+logger = logging.getLogger(__name__)
+
+FIRST_ID = 0x000
+LAST_ID = 0x7F7 # highest physical request id of 11 bit OBD/UDS addressing
+FUNCTIONAL_ID = 0x7DF # OBD functional request, answered on 0x7E8-0x7EF
+WINDOW = 32 # request ids probed at once
+TIMEOUT = 0.05 # seconds to wait for answers of one window
+PADDING = 0x55
+
+_FRAME = struct.Struct("=IB3x8s") # struct can_frame
+PROBE = bytes.fromhex("3E00") # TesterPresent
+IDENTIFY = ["ElectroniControlUnitSerialNumber", "VehicleIdentificationNumberOriginal"] # F18C, F190
+
+
+def _frame(can_id, payload):
+    """ ISO-TP single frame """
+    data = bytes([len(payload)]) + payload
+    return _FRAME.pack(can_id, 8, data + bytes([PADDING]) * (8 - len(data)))
+
+
+def _answers(can_id, dlc, data):
+    """
+    True for a single frame positive (7E 00) or negative (7F 3E NRC) response to PROBE,
+    other traffic on the bus (requests of other testers, multi-frame responses, error frames) is not an answer
+    """
+    if can_id & (socket.CAN_EFF_FLAG | socket.CAN_RTR_FLAG | socket.CAN_ERR_FLAG):
+        return False
+    length = data[0] # single frame: PCI type 0 in the high nibble
+    if length not in (2, 3) or dlc < 1 + length:
+        return False
+    if length == 2:
+        return data[1] == PROBE[0] + 0x40 and data[2] == PROBE[1]
+    return data[1] == 0x7F and data[2] == PROBE[0]
+
+
+class Sweep(object):
+    """ TesterPresent probes on a raw CAN socket, every answer is (request id, response id) """
+
+    def __init__(self, interface=_isotp_pool.INTERFACE, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.frames = 0
+        self._socket = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        self._socket.bind((interface,))
+        self._socket.setblocking(False)
+
+    def _probe(self, ids):
+        """ send TesterPresent to all ids, returns the ids that answered within timeout """
+        for can_id in ids:
+            while True:
+                try:
+                    self._socket.send(_frame(can_id, PROBE))
+                    break
+                except BlockingIOError:
+                    select.select([], [self._socket], [], self.timeout) # TX queue full
+            self.frames += 1
+        responders = set()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._socket], [], [], remaining)[0]:
+                return responders
+            can_id, dlc, data = _FRAME.unpack(self._socket.recv(_FRAME.size))
+            if _answers(can_id, dlc, data):
+                responders.add(can_id & socket.CAN_SFF_MASK)
+
+    def run(self, first=FIRST_ID, last=LAST_ID, window=WINDOW):
+        """ sorted list of (txid, rxid) pairs that answered """
+        pairs = set()
+        for rxid in self._probe([FUNCTIONAL_ID]):
+            if 0x7E8 <= rxid <= 0x7EF:
+                pairs.add((rxid - 8, rxid))
+        ids = [can_id for can_id in range(first, last + 1) if can_id != FUNCTIONAL_ID]
+        for start in range(0, len(ids), window):
+            block = ids[start:start + window]
+            if not self._probe(block):
+                continue
+            # somebody answered, find out who answered to which id
+            for txid in block:
+                for rxid in self._probe([txid]):
+                    pairs.add((txid, rxid))
+        return sorted(pairs)
+
+    def close(self):
+        self._socket.close()
+
+
+async def _identify(pool, semaphore, txid, rxid, p2):
+    """ identification DIDs of one ECU, None for DIDs it did not answer """
+    async with semaphore:
+        connection = pool.acquire(txid, rxid)
+        broken = False
+        try:
+            transport = _uds_async.AsyncUDSTransport(connection.isotp_socket, p2=p2, p2_star=p2)
+            results, _ = await transport.read(IDENTIFY, _catalog.MAX_LENGTH, multi_did=False)
+        except OSError as e:
+            logger.info("Could not identify %03X/%03X: %r", txid, rxid, e)
+            broken = True
+            results = {}
+        finally:
+            pool.release(connection, broken)
+    identification = {}
+    for parameter in IDENTIFY:
+        result = results.get(parameter)
+        positive = isinstance(result, dict) and result.get("SID") == "62"
+        identification[parameter] = result["interpretation"] if positive else None
+    return {"txid": txid, "rxid": rxid, "identification": identification}
+
+
+async def identify(pairs, interface=_isotp_pool.INTERFACE, window=WINDOW, p2=_uds_helper.P2_TIMEOUT):
+    """ read the identification DIDs of all pairs, window ECUs at a time """
+    pool = _isotp_pool.ISOTPPool(interface, max_sockets=window)
+    try:
+        semaphore = asyncio.Semaphore(window)
+        return await asyncio.gather(*[_identify(pool, semaphore, txid, rxid, p2) for txid, rxid in pairs])
+    finally:
+        pool.close()
+
+
+def scan(interface=_isotp_pool.INTERFACE, first=FIRST_ID, last=LAST_ID, window=WINDOW, timeout=TIMEOUT):
+    """ list of found ECUs: {"txid", "rxid", "identification": {parameter: value}} """
+    started = time.monotonic()
+    sweep = Sweep(interface, timeout)
+    try:
+        pairs = sweep.run(first, last, window)
+    finally:
+        sweep.close()
+    logger.info("Sweep of %03X-%03X found %s ECUs with %s frames in %.1f s", first, last, len(pairs), sweep.frames, time.monotonic() - started)
+    found = asyncio.run(identify(pairs, interface, window)) if pairs else []
+    logger.info("Scan finished in %.1f s", time.monotonic() - started)
+    return found
+
+
+def merge(config, found):
+    """ add found ECUs to a gateway config, known address pairs only get their identification updated """
+    known = dict(((_isotp_pool._to_int(ecu["txid"]), _isotp_pool._to_int(ecu["rxid"])), ecu) for ecu in config.setdefault("ecus", {}).values())
+    added = []
+    for result in found:
+        identification = dict((k, v) for k, v in result["identification"].items() if v is not None)
+        ecu = known.get((result["txid"], result["rxid"]))
+        if ecu is None:
+            name = "ecu_{:03x}".format(result["txid"])
+            services = [["TesterPresent", "Request"]] + [["ReadDataByIdentifier", parameter] for parameter in IDENTIFY if parameter in identification]
+            ecu = config["ecus"][name] = {
+                "txid": "{:04X}".format(result["txid"]),
+                "rxid": "{:04X}".format(result["rxid"]),
+                "p2": _uds_helper.P2_TIMEOUT,
+                "p2_star": _uds_helper.P2_STAR_TIMEOUT,
+                "response": "tester1/" + name,
+                "services": services,
+            }
+            added.append(name)
+        ecu["identification"] = identification
+    return added
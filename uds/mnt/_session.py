@@ -0,0 +1,86 @@
+"""
+Diagnostic session state of one ECU: switches the session when a service needs another one
+(DiagnosticSessionControl only if the session really changes) and keeps non-default sessions
+alive with TesterPresent (suppressed response) before the ECU falls back after S3.
+"""
+
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT = "Default"
+S3_TIMEOUT = 5.0 # seconds without requests until the ECU falls back to the default session
+TESTER_PRESENT_INTERVAL = 2.0 # seconds, well below S3
+
+SESSION_CONTROL = "DiagnosticSessionControl"
+ECU_RESET_RESPONSE = 0x51 # positive response to ECUReset, the ECU restarts in the default session
+NRC_NOT_IN_ACTIVE_SESSION = (0x7E, 0x7F) # sub-function / service not supported in active session
+
+
+class SessionState(object):
+    def __init__(self, catalog, s3=S3_TIMEOUT, interval=TESTER_PRESENT_INTERVAL):
+        self.s3 = s3
+        self.interval = interval
+        self.session = DEFAULT
+        self.last_activity = 0.0 # monotonic time of the last request or response
+        self.switches = 0
+        self.use(catalog)
+
+    def use(self, catalog):
+        """ switch to another (reloaded) catalog """
+        self.catalog = catalog
+        # DiagnosticSessionControl level byte -> session name
+        self._levels = dict((int(entry["ID"], 16), name) for name, entry in catalog.uds_dict[SESSION_CONTROL].items() if isinstance(entry, dict))
+        self._session_control = int(catalog.uds_dict[SESSION_CONTROL]["ID"], 16) + 0x40
+
+    def current(self):
+        """ session the ECU is in, a non-default session is gone after S3 without traffic """
+        if self.session != DEFAULT and time.monotonic() - self.last_activity > self.s3:
+            logger.info("%s session timed out (S3)", self.session)
+            self.session = DEFAULT
+        return self.session
+
+    def idle(self):
+        """ True if a TesterPresent is due to keep the session alive """
+        return self.current() != DEFAULT and time.monotonic() - self.last_activity >= self.interval
+
+    def observe(self, request, response):
+        """ update the state from a request payload and its response payload (bytes or None) """
+        self.last_activity = time.monotonic()
+        if not response:
+            return
+        if response[0] == self._session_control and len(request) > 1:
+            session = self._levels.get(request[1] & 0x7F, DEFAULT)
+            if session != self.session:
+                logger.debug("session changed: %s -> %s", self.session, session)
+                self.session = session
+        elif response[0] == ECU_RESET_RESPONSE:
+            self.session = DEFAULT
+        elif response[0] == 0x7F and len(response) > 2 and response[2] in NRC_NOT_IN_ACTIVE_SESSION:
+            # the ECU left the session on its own, switch again on the next request
+            self.session = DEFAULT
+
+    async def enter(self, transport, service):
+        """ switch to the session service needs, returns None or an error response """
+        required = self.catalog.sessions.get(service)
+        if required is None or service == SESSION_CONTROL or required == self.current():
+            return None
+        result = await transport.execute(SESSION_CONTROL, required)
+        self.switches += 1
+        if self.session == required:
+            return None
+        logger.info("Could not switch to %s session for %s", required, service)
+        if isinstance(result, dict) and result.get("type") == "uds":
+            return result
+        return {"type": "error", "error": "Could not switch to {} session.".format(required)}
+
+    def keepalive(self, transport):
+        """ TesterPresent without response, only call while a non-default session is active """
+        payload = self.catalog.encode("TesterPresent", "SuppressResponse")
+        transport.send(payload)
+        self.observe(payload, None)
+
+    def stats(self):
+        return {"session": self.current(), "switches": self.switches}
@@ -0,0 +1,81 @@
+"""
+Topic filter trie with MQTT wildcard semantics:
+"+" matches exactly one level, "#" (last level only) matches the parent and any number of levels below,
+wildcards at the first level do not match topics starting with "$".
+"""
+
+
+class _Node(object):
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = {} # topic filter -> value, for filters ending at this node
+
+
+class TopicRouter(object):
+    def __init__(self):
+        self._root = _Node()
+        self._count = 0
+
+    def add(self, topic_filter, value):
+        """ add or replace the value of a topic filter """
+        levels = topic_filter.split("/")
+        if "#" in levels[:-1] or any(("#" in level or "+" in level) and len(level) > 1 for level in levels):
+            raise ValueError("Invalid topic filter \"{}\"".format(topic_filter))
+        node = self._root
+        for level in levels:
+            node = node.children.setdefault(level, _Node())
+        if topic_filter not in node.values:
+            self._count += 1
+        node.values[topic_filter] = value
+
+    def remove(self, topic_filter):
+        """ remove a topic filter, unknown filters are ignored """
+        path = [self._root]
+        for level in topic_filter.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if topic_filter not in path[-1].values:
+            return # values may be None (subscriptions without callback)
+        del path[-1].values[topic_filter]
+        self._count -= 1
+        # prune empty nodes
+        levels = topic_filter.split("/")
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.children or node.values:
+                break
+            del path[index - 1].children[levels[index - 1]]
+
+    def match(self, topic):
+        """ list of (topic filter, value) matching a topic """
+        result = []
+        levels = topic.split("/")
+        system = topic.startswith("$")
+        nodes = [self._root]
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                wildcards = not (system and depth == 0)
+                if wildcards and "#" in node.children:
+                    result.extend(node.children["#"].values.items())
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if wildcards and "+" in node.children:
+                    next_nodes.append(node.children["+"])
+            nodes = next_nodes
+            if not nodes:
+                return result
+        for node in nodes:
+            result.extend(node.values.items())
+            # "a/#" matches "a" as well
+            if "#" in node.children:
+                result.extend(node.children["#"].values.items())
+        return result
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,242 @@
+"""
+Large reads of ECU memory: ReadMemoryByAddress (0x23) and RequestUpload / TransferData / RequestTransferExit
+(0x35 / 0x36 / 0x37). The data goes block by block from the response payloads into a caller supplied buffer
+(anything writable through a memoryview) or binary file, without hex strings in between.
+A transfer knows how far it got, after an interruption resume() continues there instead of starting over
+(an interrupted upload is closed with RequestTransferExit first, then a new RequestUpload asks for the rest).
+
+The transports drive it (UDSHelper.transfer, AsyncUDSTransport.transfer): request() is the next request payload
+(None when done), accept() takes its response. A received block gets stored while the ECU works on the next request.
+"""
+
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_BYTES = 4 # memoryAddress length in the requests, must match what the ECU expects
+RETRIES = 2 # repeated requests per block after a timeout
+DATA_FORMAT = 0x00 # dataFormatIdentifier of RequestUpload: neither compressed nor encrypted
+
+
+class TransferError(Exception):
+    """ negative, unexpected or missing response, the transfer stopped and can be resumed """
+
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.response = response # payload (bytes) that ended the transfer, None after a timeout
+
+
+def _size_bytes(size):
+    """ fewest bytes that hold size """
+    return max(1, (size.bit_length() + 7) // 8)
+
+
+def _negative(response):
+    """ text for a negative response """
+    return "negative response 0x{:02X} (NRC 0x{:02X})".format(response[1], response[2]) if len(response) > 2 else "negative response"
+
+
+class _Transfer(object):
+    """ what both transfers share: the sink, the position and the statistics """
+
+    def __init__(self, address, size, sink, offset=0, address_bytes=ADDRESS_BYTES, size_bytes=None, retries=RETRIES):
+        self.address = address
+        self.size = size
+        self.address_bytes = address_bytes
+        self.size_bytes = size_bytes # memorySize length in the requests, None: as few as needed
+        self.retries = retries
+        self.offset = offset # bytes that were there already (resumed file)
+        self.received = offset # bytes received, the next request starts there
+        self.blocks = 0
+        self.repeated = 0 # requests sent again after a timeout
+        self.seconds = 0.0 # spent transferring, without the pauses between resumes
+        self._started = None
+        self._attempts = 0
+        self._pending = None # (position, memoryview) received but not stored yet
+        if hasattr(sink, "write"):
+            self._file = sink
+            self._view = None
+            sink.seek(offset)
+        else:
+            self._file = None
+            self._view = memoryview(sink).cast("B")
+            if len(self._view) < size:
+                raise ValueError("buffer of {} bytes is too small for {} bytes".format(len(self._view), size))
+
+    def _format(self, address, size):
+        """ addressAndLengthFormatIdentifier, memoryAddress and memorySize of a request """
+        size_bytes = self.size_bytes or _size_bytes(size)
+        return (bytes([size_bytes << 4 | self.address_bytes]) + address.to_bytes(self.address_bytes, "big")
+                + size.to_bytes(size_bytes, "big"))
+
+    def _receive(self, data):
+        """ a block (memoryview of a response payload) arrived, it gets stored with the next store() """
+        self.store()
+        if not len(data) or len(data) > self.size - self.received:
+            raise TransferError("block of {} bytes at {} of {}".format(len(data), self.received, self.size))
+        self._pending = (self.received, data)
+        self.received += len(data)
+        self.blocks += 1
+        self._attempts = 0
+
+    def _timeout(self, what):
+        """ missing response: the same request goes out again, up to retries times """
+        self.store()
+        if self._attempts >= self.retries:
+            raise TransferError("no response to {} at {} of {} bytes".format(what, self.received, self.size))
+        self._attempts += 1
+        self.repeated += 1
+        logger.info("no response to %s at %s of %s bytes, asking again", what, self.received, self.size)
+
+    def _clock(self):
+        now = time.monotonic()
+        if self._started is not None:
+            self.seconds += now - self._started
+        self._started = now
+
+    def store(self):
+        """ write the received block to the sink, the transports call it while waiting for the next one """
+        if self._pending is None:
+            return
+        position, data = self._pending
+        self._pending = None
+        if self._file is not None:
+            self._file.write(data) # blocks arrive in order, the file position follows
+        else:
+            self._view[position:position + len(data)] = data
+
+    def done(self):
+        return self.received >= self.size
+
+    def resume(self):
+        """ continue after a TransferError (or any other interruption) where the transfer stopped """
+        self.store()
+        self._attempts = 0
+        self._started = None # the pause does not count
+
+    def stats(self):
+        """ progress and throughput in bytes/s (of the bytes received by this transfer) """
+        return {"address": self.address, "size": self.size, "transferred": self.received, "blocks": self.blocks,
+                "repeated": self.repeated, "seconds": round(self.seconds, 3),
+                "throughput": round((self.received - self.offset) / self.seconds) if self.seconds else None}
+
+
+class MemoryRead(_Transfer):
+    """
+    ReadMemoryByAddress of size bytes at address, one request per block of up to max_length - 1 bytes
+    (max_length: longest response payload the ECU sends)
+    """
+
+    def __init__(self, address, size, sink, max_length, offset=0, address_bytes=ADDRESS_BYTES, size_bytes=None, retries=RETRIES):
+        _Transfer.__init__(self, address, size, sink, offset, address_bytes, size_bytes, retries)
+        self.block_length = max_length - 1
+        self._request = None
+        self._length = 0 # of the block requested
+
+    def request(self):
+        self._clock()
+        if self.done():
+            return None
+        if self._request is None:
+            self._length = min(self.block_length, self.size - self.received)
+            self._request = b"\x23" + self._format(self.address + self.received, self._length)
+        return self._request
+
+    def accept(self, response):
+        if response is None:
+            self._timeout("ReadMemoryByAddress")
+            return
+        if response[0] == 0x7F:
+            self.store()
+            raise TransferError(_negative(response), response)
+        if response[0] != 0x63 or len(response) != 1 + self._length:
+            self.store()
+            raise TransferError("unexpected response {}".format(bytes(response[:8]).hex()), response)
+        self._receive(memoryview(response)[1:])
+        self._request = None
+
+    def resume(self):
+        _Transfer.resume(self)
+        self._request = None
+
+
+class Upload(_Transfer):
+    """
+    RequestUpload of size bytes at address, then TransferData blocks as long as the ECU allows
+    (maxNumberOfBlockLength, at most max_length) and RequestTransferExit
+    """
+
+    START, DATA, EXIT, DONE, ABORT = "start", "data", "exit", "done", "abort"
+
+    def __init__(self, address, size, sink, max_length, offset=0, address_bytes=ADDRESS_BYTES, size_bytes=None, retries=RETRIES, data_format=DATA_FORMAT):
+        _Transfer.__init__(self, address, size, sink, offset, address_bytes, size_bytes, retries)
+        self.max_length = max_length
+        self.data_format = data_format
+        self.block_length = None # data bytes per TransferData response, from the ECU
+        self.state = Upload.START
+        self.counter = 1 # blockSequenceCounter of the next TransferData
+
+    def request(self):
+        self._clock()
+        if self.state == Upload.START:
+            # a resumed upload asks for the rest only
+            return b"\x35" + bytes([self.data_format]) + self._format(self.address + self.received, self.size - self.received)
+        if self.state == Upload.DATA:
+            return bytes([0x36, self.counter])
+        if self.state in (Upload.EXIT, Upload.ABORT):
+            return b"\x37"
+        return None
+
+    def _check(self, response, sid):
+        if response[0] == 0x7F:
+            self.store()
+            raise TransferError(_negative(response), response)
+        if response[0] != sid + 0x40 or (sid == 0x36 and (len(response) < 2 or response[1] != self.counter)):
+            self.store()
+            raise TransferError("unexpected response {}".format(bytes(response[:8]).hex()), response)
+
+    def accept(self, response):
+        if self.state == Upload.START:
+            if response is None:
+                self._timeout("RequestUpload")
+                return
+            self._check(response, 0x35)
+            length_bytes = response[1] >> 4 if len(response) > 1 else 0
+            if not length_bytes or len(response) < 2 + length_bytes:
+                raise TransferError("no maxNumberOfBlockLength in {}".format(bytes(response).hex()), response)
+            # maxNumberOfBlockLength counts SID and blockSequenceCounter as well
+            self.block_length = min(int.from_bytes(response[2:2 + length_bytes], "big"), self.max_length) - 2
+            logger.debug("upload of %s bytes at 0x%X in blocks of %s bytes", self.size - self.received, self.address + self.received, self.block_length)
+            self._attempts = 0
+            self.state = Upload.EXIT if self.done() else Upload.DATA
+        elif self.state == Upload.DATA:
+            if response is None:
+                # the same counter again, the ECU repeats the block
+                self._timeout("TransferData {}".format(self.counter))
+                return
+            self._check(response, 0x36)
+            self._receive(memoryview(response)[2:])
+            self.counter = (self.counter + 1) & 0xFF # wraps to 0, not to 1
+            if self.done():
+                self.state = Upload.EXIT
+        elif self.state == Upload.EXIT:
+            if response is None:
+                self._timeout("RequestTransferExit")
+                return
+            self._check(response, 0x37)
+            self.state = Upload.DONE
+        elif self.state == Upload.ABORT:
+            # the ECU may have ended the interrupted transfer already, a negative or missing response is fine
+            self.state = Upload.START
+
+    def resume(self):
+        """
+        RequestTransferExit for the interrupted transfer, then a new RequestUpload for the rest
+        (without the exit most ECUs reject the RequestUpload with requestSequenceError)
+        """
+        _Transfer.resume(self)
+        if self.state in (Upload.DATA, Upload.ABORT):
+            self.state = Upload.ABORT
+        self.counter = 1
@@ -0,0 +1,143 @@
+"""
+asyncio version of UDSHelper.executeUDS: the ISO-TP socket is watched by the event loop (add_reader),
+so many requests on different ECUs can wait at the same time on one thread without polling.
+"""
+
+import time
+import asyncio
+import logging
+import _catalog
+import _metrics
+import _logging
+import _uds_helper
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncUDSTransport(object):
+    """
+    UDS requests on one bound ISO-TP socket. Only one request at a time may use a socket,
+    callers serialize per ECU (see gateway.Ecu).
+    """
+
+    def __init__(self, isotp_socket, catalog=None, p2=_uds_helper.P2_TIMEOUT, p2_star=_uds_helper.P2_STAR_TIMEOUT, on_pending=None, on_response=None, trace=None):
+        # the helper is used for building requests and responses only, it never blocks here
+        self.helper = _uds_helper.UDSHelper(isotp_socket=isotp_socket, catalog=catalog, p2=p2, p2_star=p2_star)
+        self.isotp_socket = isotp_socket
+        self.on_pending = on_pending # called with the payload of every "response pending"
+        self.on_response = on_response # called with (request, final response or None) of every request
+        self.trace = trace # _metrics.Trace of the request being served, if traced
+
+    async def _wait(self, timeout):
+        """ next payload (bytes) on the socket or None after timeout seconds """
+        loop = asyncio.get_running_loop()
+        fileno = _uds_helper._fileno(self.isotp_socket)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable = loop.create_future()
+            loop.add_reader(fileno, lambda: readable.done() or readable.set_result(True))
+            try:
+                await asyncio.wait_for(readable, remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                loop.remove_reader(fileno)
+            try:
+                payload = self.isotp_socket.recv()
+            except BlockingIOError:
+                payload = None
+            if payload:
+                return payload
+
+    def send(self, payload):
+        """ send a request payload (bytes) without waiting for a response (suppressed responses) """
+        self.helper._flushISOTP()
+        self.isotp_socket.send(payload)
+
+    async def request(self, payload):
+        """ send a request payload (bytes) and wait for the final response payload, None on timeout """
+        self.send(payload)
+        if self.trace:
+            self.trace.mark(_metrics.TRANSMIT)
+        return await self.receive(payload)
+
+    async def receive(self, payload):
+        """ final response payload to the request payload sent before, None on timeout """
+        timeout = self.helper.p2
+        while True:
+            response = await self._wait(timeout)
+            if response is None or not _uds_helper.is_pending(response):
+                if self.trace:
+                    self.trace.mark(_metrics.WAIT)
+                if self.on_response:
+                    self.on_response(payload, response)
+                return response
+            if self.on_pending:
+                self.on_pending(response)
+            timeout = self.helper.p2_star
+
+    async def execute(self, service, parameter, message={}):
+        """ same result as UDSHelper.executeUDS, without blocking the event loop """
+        payload = self.helper._prepareRequest(service, parameter, message)
+        if isinstance(payload, dict):
+            return payload
+        SID = payload[:1].hex()
+        logger.debug("transmit (execute) SID, PID: %s, %s", SID, _logging.Hex(payload[1:]))
+        response = await self.request(payload)
+        if not response:
+            logger.info("no message received for SID %s and PID/LEV %s", SID, _logging.Hex(payload[1:]))
+            return False
+        result = self.helper._buildResponse(SID, response)
+        if self.trace:
+            self.trace.mark(_metrics.DECODE)
+        return result
+
+    async def transfer(self, transfer):
+        """
+        same as UDSHelper.transfer, without blocking the event loop: the blocks are stored
+        (file writes) on the default executor while the loop waits for the next response
+        """
+        loop = asyncio.get_running_loop()
+        payload = transfer.request()
+        while payload is not None:
+            self.send(payload)
+            stored = loop.run_in_executor(None, transfer.store) # the previous block, while the ECU prepares the next one
+            try:
+                response = await self.receive(payload)
+            finally:
+                await stored # accept() and resume() must not store at the same time
+            transfer.accept(response)
+            payload = transfer.request()
+        await loop.run_in_executor(None, transfer.store)
+        return transfer.stats()
+
+    async def read(self, parameters, max_length=_catalog.MAX_LENGTH, multi_did=True):
+        """
+        same as UDSHelper.readDataByIdentifiers, returns ({parameter: response}, multi_did),
+        multi_did is False once the ECU rejected a multi-DID request
+        """
+        for parameter in parameters:
+            if ("ReadDataByIdentifier", parameter) not in self.helper.catalog.requests:
+                info = "Could not find PID by Name (PID not implemented yet)."
+                logger.info(info)
+                return {"type": "error", "error": info}, multi_did
+        results = {}
+        batches = self.helper.catalog.readBatches(parameters, max_length) if multi_did else [(None, [parameter]) for parameter in parameters]
+        for payload, batch in batches:
+            if len(batch) > 1:
+                response = await self.request(payload)
+                split = self.helper._splitRead(batch, response)
+                if self.trace:
+                    self.trace.mark(_metrics.DECODE)
+                if split is not None:
+                    results.update(split)
+                    continue
+                if _uds_helper.rejects_multi_did(response):
+                    multi_did = False
+            for parameter in batch:
+                results[parameter] = await self.execute("ReadDataByIdentifier", parameter)
+        return results, multi_did
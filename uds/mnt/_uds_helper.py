@@ -1,7 +1,13 @@
+import os
 import time
+import select
+import socket
 # import can
 import isotp
-import json
+import _catalog
+import _payload
+import _logging
+import _isotp_pool
 # import udsoncan
 # from udsoncan.connections import PythonIsoTpConnection
 import logging
@@ -12,6 +18,27 @@ logger = logging.getLogger(__name__)
 # standard values
 RXID = 0x7DF
 TXID = 0x7E8
+INTERFACE = "can0" # use vcan0 for virtual can or can0 for PiCAN2, an unbound isotp_socket can be passed instead
+# response timing in seconds, P2: wait for a response, P2*: wait after a "response pending" (NRC 0x78)
+P2_TIMEOUT = 1.0
+P2_STAR_TIMEOUT = 5.0
+
+
+def _fileno(isotp_socket):
+    """ file descriptor of an isotp.socket (or any socket like object) for select """
+    if hasattr(isotp_socket, "fileno"):
+        return isotp_socket.fileno()
+    return isotp_socket._socket.fileno()
+
+
+def is_pending(payload):
+    """ True for a "request correctly received - response pending" negative response (NRC 0x78) """
+    return len(payload) == 3 and payload[0] == 0x7F and payload[2] == 0x78
+
+
+def rejects_multi_did(payload):
+    """ True if a multi-DID ReadDataByIdentifier got "incorrect message length or invalid format" (NRC 0x13) """
+    return bool(payload) and len(payload) == 3 and payload[0] == 0x7F and payload[1] == 0x22 and payload[2] == 0x13
 
 
 def is_hex(s):
@@ -22,246 +49,24 @@ def is_hex(s):
         return False
 
 
+# diagnostic catalog, read once and shared by all UDSHelper instances (see _catalog for the format)
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+CATALOGS = _catalog.Catalogs(CATALOG_FILE)
+CATALOG = CATALOGS.get() # common services, without ECU sections
+UDS_DICT = CATALOG.uds_dict
+
+
 class UDSHelper(object):
-    def __init__(self, client=None, response=None):
+    def __init__(self, client=None, response=None, isotp_socket=None, catalog=None, p2=P2_TIMEOUT, p2_star=P2_STAR_TIMEOUT, payload_format=_payload.JSON):
         self.mqtt_client = client
         self.response_topic = response
-        self.uds_dict = {
-            "DiagnosticSessionControl": {
-                "ID": "10",
-                "Default": {
-                    "ID": "01",
-                    "description": "Change to Default Session, standard session if no other session is running.",
-                },
-                "Programming": {
-                    "ID": "02",
-                    "description": "Change to Programming Session specific functionality required for ECU flashing.",
-                },
-                "Extended": {
-                    "ID": "03",
-                    "description": "Change to Extended Session to get access to all supported diagnostic services.",
-                },
-            },
-            "ReadDataByIdentifier": {
-                "ID": "22",
-                "ReadOdometerValueFromBus": {
-                    "ID": "010C",
-                    "description": "Represents the current ODO-Information of the vehicle bus.",
-                },
-                "ReadAnalogDigitalConverterRawValues": {
-                    "ID": "0301",
-                    "description": "Read the current raw values of the CT ADC.",
-                },
-                "InputOutputStates": {
-                    "ID": "0310",
-                    "description": "With this service, the current values of the signals present at the ECU inputs and outputs as well as internal states can be queried.",
-                },
-                "ActiveDiagnosticInformation": {
-                    "ID": "F100",
-                    "description": "This Data Identifier provides the diagnostic information used by the tester to uniquely identify the respective diagnostic data set assigned to a specific ECU version.",
-                },
-                "ElectroniControlUnitSerialNumber": {
-                    "ID": "F18C",
-                    "description": "This record shall be used to uniquely identify a specific ECU hardware to be able to identify ECUs of a specific batch.",
-                },
-                "VehicleIdentificationNumberOriginal": {
-                    "ID": "F190",
-                    "description": "This data record reflects the Vehicle Identification Number of the vehicle an ECU was originally installed.",
-                },
-                "VehicleIdentificationNumberCurrent": {
-                    "ID": "F1A0",
-                    "description": "This data record reflects the Vehicle Identification Number of the vehicle an ECU is currently installed.",
-                },
-            },
-            
-            "InputOutputControlByIdentifier": {
-                "ID": "2F",
-                "OpenTrunk": {
-                    "ID": "D0010302",
-                    "description": "Starts the trunk motor to open the trunk lid.",
-                },
-                "BrakeTrunk": {
-                    "ID": "D0010304",
-                    "description": "Brakes the trunk motor.",
-                },
-                "SetDisplayIntensity": {
-                    "ID": "D01303",
-                    "description": "Sets the display intensity.",
-                    "parameters": {
-                        "intensity": {
-                            "default": "50",
-                            "description": "Percentage of maximum intensity possible.",
-                            "type": "integer",
-                            "interpretation": "x = format(int(x), 'x')",
-                            "bit": "20", # parameter position in hex
-                        }
-                    },
-                },
-                "ResetDisplayIntensity": {
-                    "ID": "D01301",
-                    "description": "Resets the display intensity to the default value.",
-                },
-            },
-
-            "AsynchronousRoutine": {
-                "ID": "31",
-                "StartDisplayPatternBlack": {
-                    "ID": "0103B104",
-                },
-                "StartDisplayPatternWhite": {
-                    "ID": "0103B105",
-                },
-                "StartDisplayPatternRed": {
-                    "ID": "0103B106",
-                },
-                "StartDisplayPatternGreen": {
-                    "ID": "0103B107",
-                },
-                "StartDisplayPatternBlue": {
-                    "ID": "0103B108",
-                },
-                "StopDisplayPattern": {
-                    "ID": "0203B1",
-                },
-                "RequestResults": {
-                    "ID": "0303B1",
-                },
-            },
-
-            "TesterPresent": {
-                "ID": "3E",
-                "Request": {
-                    "ID": "00",
-                    "description": "Check if ECU is reachable (keep ECU awake/connection alive).",
-                },
-            },
-
-            "Diagnostic Session Control Positive Response": {
-                "ID": "50",
-                "Default Session Response": {
-                    "ID": "01",
-                    "interpretation": "x = str(int(x[0:4], 16) * 1) + 'ms, ' + str(int(x[4:8], 16) * 10) + 'ms'",
-                    "description": "Changed to Default Session with Timing Parameters \"P2_CAN_ECU_max\" and \"P2s_CAN_ECU_max\"",
-                },"Programming Session Response": {
-                    "ID": "02",
-                    "interpretation": "x = str(int(x[0:4], 16) * 1) + 'ms, ' + str(int(x[4:8], 16) * 10) + 'ms'",
-                    "description": "Changed to Programmingim gegensatz zu Session with Timing Parameters \"P2_CAN_ECU_max\" and \"P2s_CAN_ECU_max\"",
-                },
-                "Extended Session Response": {
-                    "ID": "03",
-                    "interpretation": "x = str(int(x[0:4], 16) * 1) + 'ms, ' + str(int(x[4:8], 16) * 10) + 'ms'",
-                    "description": "Changed to Extended Session with Timing Parameters \"P2_CAN_ECU_max\" and \"P2s_CAN_ECU_max\"",
-                },
-            },
-
-            "Read Data By Identifier Positive Response": {
-                "ID": "62",
-                "Read Odometer Response": {
-                    "ID": "010C",
-                    "interpretation": "x = str(int(x, 16) * 0.1)",
-                    "unit": "km",
-                },
-                "Read Analog Digital Converter Raw Values Response": {
-                    "ID": "0301",
-                    "interpretation": "x = x",
-                },
-                "Input Output States Response": {
-                    "ID": "0310",
-                    "interpretation": "x = x"
-                },
-                "Active Diagnostic Information Response": {
-                    "ID": "F100",
-                    "interpretation": """
-if x=="00080201": x="Default Session"
-elif x=="00080202": x="Programming Session"
-elif x=="00080203": x="Extended Session" """,
-                },
-                "Electronic Control Unit Serial Number Response": {
-                    "ID": "F18C",
-                    "interpretation": "x = x",
-                },
-                "Vehicle Identification Number Original Response": {
-                    "ID": "F190",
-                    "interpretation": "x = bytes.fromhex(x).decode('utf-8')",
-                },
-                "Vehicle Identification Number Current Response": {
-                    "ID": "F1A0",
-                    "interpretation": "x = bytes.fromhex(x).decode('utf-8')",
-                },
-            },
-
-            "Input Output Control By Identifier Positive Response": {
-                "ID": "6F",
-                "Open Trunk Response": {
-                    "ID": "D0010302",
-                },
-                "Brake Trunk Response": {
-                    "ID": "D0010304",
-                },
-                "Display Control Reset Intensity Response": {
-                    "ID": "D01301",
-                    "description": "Display intensity reset to default (returns last set intensity, not the default value).",
-                    "interpretation": "x = str(int(x, 16))",
-                    "unit": "%",
-                },
-                "Display Control Set Intensity Response": {
-                    "ID": "D01303",
-                    "description": "New intesity set.",
-                    "interpretation": "x = str(int(x, 16))",
-                    "unit": "%",
-                },
-            },
-
-            "Asynchronous Routine Positive Response": {
-                "ID": "71",
-                "Start Display Pattern Response": {
-                    "ID": "0103B101",
-                },
-                "Stop Display Pattern Response": {
-                    "ID": "0203B100",
-                },
-                "Routine successfully completed": {
-                    "ID": "0303B100",
-                },
-                "Routine in progress": {
-                    "ID": "0303B101",
-                },
-                "Routine stopped without results": {
-                    "ID": "0303B100",
-                },
-            },
-
-            "Tester Present Response": {
-                "ID": "7E",
-                "Positive Response": {
-                    "ID": "00",
-                },
-            },
-
-            "Negative Response": {
-                "ID": "7F",
-                "Incorrect message length or invalid format (by ReadDataByIdentifier)": {
-                    "ID": "2213",
-                },
-                "Conditions not correct (by ReadDataByIdentifier)": {
-                    "ID": "2222",
-                },
-                "Request out of range (by ReadDataByIdentifier)": {
-                    "ID": "2231",
-                },
-                # "Request correctly received - response pending": {
-                #     "ID": "3178",
-                # },
-                "Incorrect message length or invalid format (by InputOutputControlByIdentifier)": {
-                    "ID": "2F13",
-                },
-                "Service not supported in (currently) active session (by AsynchronousRoutine)": {
-                    "ID": "317F",
-                },
-            }
-        }
-        
-        self.isotp_socket = isotp.socket()
+        self.payload_format = payload_format # of messages published to the response topic, see _payload
+        self.catalog = CATALOG if catalog is None else catalog # shared, compiled catalog, do not modify
+        self.uds_dict = self.catalog.uds_dict
+        self.isotp_socket = isotp_socket # pass a pooled socket (see _isotp_pool) or use connectISOTP
+        self.p2 = p2 # ECU specific timing, see P2_TIMEOUT and P2_STAR_TIMEOUT
+        self.p2_star = p2_star
+        self.multi_did = True # becomes False if the ECU rejects multi-DID ReadDataByIdentifier requests
 
     def getSIDbyName(self, name):
         """ needs a SID name, returns SID as hex string """
@@ -304,107 +109,121 @@ elif x=="00080203": x="Extended Session" """,
         logger.info("Could not find SID by Name (SID not implemented yet)")
         return False
 
-    def connectISOTP(self, txid="07DF", rxid="07E8"):
-        self.isotp_socket.set_opts(txpad=0x55, rxpad=0xAA)
-        self.isotp_socket.set_fc_opts(stmin=0, bs=8) # configure stmin and blocksize for flow control options (0, 8)
-        self.isotp_socket.bind('can0', isotp.Address(rxid=int(rxid,16), txid=int(txid,16))) # use vcan for virtual can or can0 for PiCAN2
-
-    def _transmitISOTP(self, SID, PID):
-        # build request (hex values), fill remaining bytes to fit 8 byte can message
-        payload = SID + PID
-        # logger.debug("uds payload raw: {}".format(payload))
-        # print("uds transmit payload raw: {}".format(payload))
-        payload = bytearray.fromhex(payload)
-        # logger.debug("uds payload: {}".format(payload))
+    def connectISOTP(self, txid="07DF", rxid="07E8", interface=INTERFACE, profile=None):
+        """ bind an own (unpooled) socket, prefer _isotp_pool for long running services, profile: see _isotp_pool.PROFILE """
+        if self.isotp_socket is None:
+            self.isotp_socket = isotp.socket()
+        _isotp_pool.apply_profile(self.isotp_socket, profile)
+        self.isotp_socket.bind(interface, isotp.Address(rxid=int(rxid,16), txid=int(txid,16)))
+
+    def _transmitISOTP(self, payload):
+        """ send a request payload (bytes, SID + PID + parameters), padding is done by the socket """
+        # logger.debug("uds payload: {}".format(payload.hex()))
+        # drop late responses of earlier (timed out) requests, sockets are reused
+        self._flushISOTP()
         # send message
         self.isotp_socket.send(payload)
         # while self.isotp_socket.transmitting():
         #     self.isotp_socket.process()
         #     time.sleep(self.isotp_socket.sleep_time())
 
-    def _interpretParameter(self, parameter):
-        # print("_interpretParameter", response)
-        # if "length" in self.uds_dict[response["SID"]][response["PID"]]:
-        #     response["Data"] = response["Data"][:self.uds_dict[response["SID"]][response["PID"]]["length"]]
-        # if "encoding" in self.uds_dict[response["SID"]][response["PID"]]:
-        #     response["Datastr"] = response["Data"].decode(self.uds_dict[response["SID"]][response["PID"]]["encoding"])
-        # response["Data"] = int.from_bytes(response["Data"], byteorder='big')
-        if "interpretation" in parameter and parameter["interpretation"]:
-            local = {"x": parameter["data"]}
-            exec(parameter["interpretation"], {}, local)
-            parameter["interpretation"] = local["x"]
-        return parameter
+    def _interpretParameter(self, response):
+        """ decode response["data"] with the precompiled decoder of the catalog """
+        value = self.catalog.decode(response["service"], response["parameter"], response["data"])
+        if value is not None:
+            # keep the interpretation a string, as published before, the binary formats get the decoded value
+            response["interpretation"] = value if isinstance(value, str) else _payload.Interpretation(value)
+            if "unit" in self.uds_dict[response["service"]][response["parameter"]]:
+                response["unit"] = self.uds_dict[response["service"]][response["parameter"]]["unit"]
+        return response
 
     def _getUDSInformation(self, payload, response):
-        # check if response SID is known -> get name
-        for service in self.uds_dict:
-            # print("compare service", self.uds_dict[service]["ID"].lower(), format(response["SID"], "x"), service)
-            if self.uds_dict[service]["ID"].lower() == response["SID"]:
-                response["service"] = service
-                break
-        
-        # check if response PID is known -> get name
-        pid_length = 2
-        found = False
-        while not found and response["service"] != "unknown UDS service":
-            pid_length += 2
-            if pid_length > 15:
-                response["PID"] = payload[2:]
-                break
-            response["PID"] = payload[2:pid_length]
-            # print("PID raw", response["PID"])
-            # print("PID", hex(response["PID"]))
-
-            for parameter in self.uds_dict[service]:
-                if parameter in ["ID", ""]:
-                    continue
-                # print("compare parameter", self.uds_dict[service][parameter]["ID"].lower(), response["PID"], parameter)
-                if self.uds_dict[service][parameter]["ID"].lower() == response["PID"]:
-                    found = True
-                    response["parameter"] = parameter
-                    if "description" in self.uds_dict[service][parameter]:
-                        response["description"] = self.uds_dict[service][parameter]["description"]
-                    if "interpretation" in self.uds_dict[service][parameter]:
-                        response["interpretation"] = self.uds_dict[service][parameter]["interpretation"]
-                        if "unit" in self.uds_dict[service][parameter]:
-                            response["unit"] = self.uds_dict[service][parameter]["unit"]
-                    break
-        
-            response["data"] = payload[pid_length:]
-
+        """ fill in service, parameter and decoded data of a response payload (bytes) using the catalog index """
+        service, parameter, end = self.catalog.lookup(payload)
+        if service is None:
+            return response
+        response["service"] = service
+        response["PID"] = payload[1:end].hex() if parameter else payload[1:].hex()
+        if parameter is None:
+            return response
+        response["parameter"] = parameter
+        if "description" in self.uds_dict[service][parameter]:
+            response["description"] = self.uds_dict[service][parameter]["description"]
+        response["data"] = payload[end:].hex()
         return self._interpretParameter(response)
 
-    def _receiveISOTP(self, SID, PID):
-        # print("_receiveISOTP", SID, PID)
-        # wait for response
+    def _waitISOTP(self, timeout):
+        """ block until a payload arrives or timeout (seconds) is over, returns payload bytes or None """
+        deadline = time.monotonic() + timeout
+        fileno = _fileno(self.isotp_socket)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fileno], [], [], remaining)
+            if readable:
+                try:
+                    payload = self.isotp_socket.recv()
+                except (BlockingIOError, socket.timeout):
+                    payload = None
+                if payload:
+                    return payload
+
+    def _flushISOTP(self):
+        """ discard everything already waiting on the socket """
+        fileno = _fileno(self.isotp_socket)
+        while select.select([fileno], [], [], 0)[0]:
+            try:
+                payload = self.isotp_socket.recv()
+            except (BlockingIOError, socket.timeout):
+                payload = None
+            if not payload:
+                break
+            logger.info("dropped late payload: %s", _logging.Hex(payload))
+
+    def _receivePayload(self):
+        """ final response payload (bytes) of the request just sent or None """
+        # wait P2 for the response, every "response pending" (NRC 0x78) restarts the wait with P2*
         payload = None
-        t1 = time.time()
-        delta = 7
-        # check for delta seconds
-        while time.time() - t1 < delta and not payload:
-            # if self.isotp_socket.available():
-            payload = self.isotp_socket.recv().hex()
-            if payload == "7F2F78".lower() or payload == "7F3178".lower():
+        timeout = self.p2
+        while not payload:
+            payload = self._waitISOTP(timeout)
+            if not payload:
+                break
+            if is_pending(payload):
                 # print("Request correctly received - response pending")
-                pending = json.dumps({"type": "info",
-                            "SID": "7f",
-                            "service": "Negative Response",
-                            "PID": payload[2:],
-                            "parameter": "Request correctly received - response pending",
-                            "data": None,
-                            "description": None,
-                            "interpretation": None,
-                            "unit": None})
-                self.mqtt_client.publish(self.response_topic, pending, 1)
+                self._publishPending(payload)
                 payload = None
+                timeout = self.p2_star
             # logger.info("Received payload: {}".format(payload))
-            time.sleep(0.05)
+        return payload
+
+    def _receiveISOTP(self, SID, PID):
+        # print("_receiveISOTP", SID, PID)
+        payload = self._receivePayload()
         if not payload:
-            logger.info("no message received for SID {} and PID/LEV {}".format(SID, hex(PID)))
+            logger.info("no message received for SID %s and PID/LEV %s", SID, PID)
             return False
-        # print("received payload", payload)
-        # print("received payload hex", payload.hex()[0])
-
+        # print("received payload", payload.hex())
+        return self._buildResponse(SID, payload)
+
+    def _publishPending(self, payload):
+        """ tell the requester that the ECU asked for more time """
+        if not self.mqtt_client or not self.response_topic:
+            return
+        pending = _payload.encode({"type": "info",
+                    "SID": "7f",
+                    "service": "Negative Response",
+                    "PID": payload[1:].hex(),
+                    "parameter": "Request correctly received - response pending",
+                    "data": None,
+                    "description": None,
+                    "interpretation": None,
+                    "unit": None}, self.payload_format)
+        self.mqtt_client.publish(self.response_topic, pending, 1)
+
+    def _buildResponse(self, SID, payload):
+        """ response dict for a received payload (bytes) of a request with SID (hex string) """
         response = {
             "type": "uds",
             "SID": None,
@@ -416,59 +235,109 @@ elif x=="00080203": x="Extended Session" """,
             "interpretation": None,
             "unit": None,
         }
-        response["SID"] = payload[:2]
+        response["SID"] = payload[:1].hex()
         # print("SID", response["SID"], format(int(SID, 16) + 4*16, "x"))
 
         # check if UDS execution was successfull
-        if response["SID"] == format(int(SID, 16) + 4*16, "x"):# and response["PID"] == PID:
-            logger.info("successfully received uds message: {}".format(payload))
+        if payload[0] == int(SID, 16) + 0x40:# and response["PID"] == PID:
+            logger.debug("successfully received uds message: %s", _logging.Hex(payload))
             response = self._getUDSInformation(payload, response)
-            
+
         else:
-            logger.info("received error message: {}".format(payload))
+            logger.debug("received error message: %s", _logging.Hex(payload))
             response = self._getUDSInformation(payload, response)
         # print("final response", response)
         return response
 
-    def executeUDS(self, service, parameter, message={}):
-        #print("sendRequest " + format(SID, 'x').upper()+ " " + format(PID, 'x').upper())
-        print("executeUDS ", service, parameter, self.uds_dict[service][parameter])
-
-        SID = ""
-        if service in self.uds_dict:
-            SID = self.uds_dict[service]["ID"]
-        else:
+    def _prepareRequest(self, service, parameter, message):
+        """ request payload (bytes) or an error response (dict) """
+        if service not in self.uds_dict:
             info = "Could not find SID by Name (SID not implemented yet)."
             logger.info(info)
             return {"type": "error", "error": info}
-
-        PID = ""
-        if parameter in self.uds_dict[service]:
-            PID = self.uds_dict[service][parameter]["ID"]
-            if "parameters" in self.uds_dict[service][parameter]:
-                dict_parameters = self.uds_dict[service][parameter]["parameters"]
-                for dict_parameter in dict_parameters:
-                    # print("parameter, para", parameter, dict_parameter)
-                    dict_parameters[dict_parameter]["data"] = message[dict_parameter]
-                    # print("dict_parameters", dict_parameters)
-                    dict_parameters[dict_parameter] = self._interpretParameter(dict_parameters[dict_parameter])
-                    # print("PID interpretation: {}".format(interpretation))
-                    shift = int(dict_parameters[dict_parameter]["bit"], 16) - len(PID)*4
-                    print("PID before", PID, dict_parameters[dict_parameter]["bit"], dict_parameters[dict_parameter]["interpretation"])
-                    PID = format((int(PID, 16) << shift) + int(dict_parameters[dict_parameter]["interpretation"], 16), 'x')
-                    print("PID after", PID)
-
-        else:
+        if (service, parameter) not in self.catalog.requests:
             info = "Could not find PID by Name (PID not implemented yet)."
             logger.info(info)
             return {"type": "error", "error": info}
 
-        logger.info("transmit (execute) SID, PID: {}, {}".format(SID, PID))
-        self._transmitISOTP(SID, PID)
+        # the catalog is shared, the request gets built in a fresh buffer
+        try:
+            return self.catalog.encode(service, parameter, message)
+        except (ValueError, TypeError, OverflowError, AttributeError) as e:
+            info = "Invalid request parameter value ({})".format(e)
+            logger.info(info)
+            return {"type": "error", "error": info}
+
+    def executeUDS(self, service, parameter, message={}):
+        payload = self._prepareRequest(service, parameter, message)
+        if isinstance(payload, dict):
+            return payload
+        SID = payload[:1].hex()
+        PID = payload[1:].hex()
+
+        logger.debug("transmit (execute) SID, PID: %s, %s", SID, PID)
+        self._transmitISOTP(payload)
         response = self._receiveISOTP(SID, PID)
-        logger.info("response: {}".format(response))
+        logger.debug("response: %s", response)
         return response
 
+    def transfer(self, transfer):
+        """
+        run a _transfer.MemoryRead or _transfer.Upload until all data is in its sink, returns its stats,
+        raises _transfer.TransferError (call transfer.resume() and this again to continue)
+        """
+        payload = transfer.request()
+        while payload is not None:
+            self._transmitISOTP(payload)
+            transfer.store() # the previous block, while the ECU prepares the next one
+            transfer.accept(self._receivePayload())
+            payload = transfer.request()
+        transfer.store()
+        return transfer.stats()
+
+    def _splitRead(self, parameters, payload):
+        """
+        responses of a multi-DID ReadDataByIdentifier request {parameter: response},
+        None if the ECU rejected it or the response can not be split (then read them one by one)
+        """
+        if not payload or payload[0] != 0x62:
+            return None
+        dids = [self.catalog.requests[("ReadDataByIdentifier", parameter)].template[1:] for parameter in parameters]
+        try:
+            parts = self.catalog.splitRead(payload, dids)
+        except ValueError as e:
+            logger.info("could not split multi-DID response %s: %s", _logging.Hex(payload), e)
+            return None
+        return dict((parameter, self._buildResponse("22", payload[:1] + did + data)) for parameter, (did, data) in zip(parameters, parts))
+
+    def readDataByIdentifiers(self, parameters, max_length=_catalog.MAX_LENGTH, multi_did=None):
+        """
+        read several ReadDataByIdentifier parameters with as few requests as possible (multi_did None: self.multi_did),
+        falls back to single reads if the ECU rejects multiple DIDs (and sets multi_did to False), returns {parameter: response}
+        """
+        if multi_did is None:
+            multi_did = self.multi_did
+        for parameter in parameters:
+            if ("ReadDataByIdentifier", parameter) not in self.catalog.requests:
+                info = "Could not find PID by Name (PID not implemented yet)."
+                logger.info(info)
+                return {"type": "error", "error": info}
+        results = {}
+        batches = self.catalog.readBatches(parameters, max_length) if multi_did else [(None, [parameter]) for parameter in parameters]
+        for payload, batch in batches:
+            if len(batch) > 1:
+                self._transmitISOTP(payload)
+                response = self._receivePayload()
+                split = self._splitRead(batch, response)
+                if split is not None:
+                    results.update(split)
+                    continue
+                if rejects_multi_did(response):
+                    self.multi_did = False
+            for parameter in batch:
+                results[parameter] = self.executeUDS("ReadDataByIdentifier", parameter)
+        return results
+
     def rawUDS(self, RxID, TxID, SID, PID):
         if isinstance(RxID, str):
             if RxID.startswith("0x"):
@@ -481,10 +350,12 @@ elif x=="00080203": x="Extended Session" """,
             else:
                 TxID = int(TxID, 16)
 
+        if self.isotp_socket is None:
+            self.isotp_socket = isotp.socket()
         self.isotp_socket.bind('can0', rxid=RxID, txid=TxID)
         response = self.executeUDS(SID, PID)
         if response:
-            logger.info("response: {}".format(response))
+            logger.info("response: %s", response)
 
     # def getECUIDs(self):
     #     SID = self.getSIDbyName("VehicleInformation")
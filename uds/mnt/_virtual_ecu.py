@@ -0,0 +1,268 @@
+"""
+Record and replay of ISO-TP traffic, for running the gateway (and UDSHelper) without CAN hardware.
+The recorder wraps the sockets of the pool and writes every request and response payload with a timestamp
+to a compact binary file. VirtualBus answers requests from such a recording over in-process socketpairs,
+with the recorded response times or faster (speed).
+"""
+
+import time
+import heapq
+import select
+import socket
+import struct
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+INTERFACE = "virtual"
+MAGIC = b"UDSREC1\n"
+_RECORD = struct.Struct(">dHHBH") # time, txid, rxid, direction, payload length
+REQUEST = 0
+RESPONSE = 1
+
+
+class SocketPairISOTP(object):
+    """ minimal isotp.socket replacement on one end of a socketpair """
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._socket.setblocking(False)
+
+    def send(self, payload):
+        self._socket.send(payload)
+
+    def recv(self, n=4095):
+        try:
+            return self._socket.recv(n)
+        except BlockingIOError:
+            return None
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        self._socket.close()
+
+
+def socket_pair():
+    """ returns (tester side, ecu side), SOCK_SEQPACKET keeps message boundaries like ISO-TP """
+    tester, ecu = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    return SocketPairISOTP(tester), ecu
+
+
+class Recorder(object):
+    """ appends records to a file, wrap() a socket factory to record everything sent and received """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()
+
+    def write(self, txid, rxid, direction, payload, timestamp=None):
+        with self._lock:
+            self._file.write(_RECORD.pack(time.time() if timestamp is None else timestamp, txid, rxid, direction, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+
+    def wrap(self, socket_factory):
+        """ socket factory (interface, txid, rxid) whose sockets get recorded """
+        return lambda interface, txid, rxid, profile=None: RecordingSocket(socket_factory(interface, txid, rxid, profile), self, txid, rxid)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        logger.info("Recorded %s payloads to %s", self.records, self.path)
+
+
+class RecordingSocket(object):
+    def __init__(self, isotp_socket, recorder, txid, rxid):
+        self.isotp_socket = isotp_socket
+        self.recorder = recorder
+        self.txid = txid
+        self.rxid = rxid
+
+    def send(self, payload):
+        self.isotp_socket.send(payload)
+        self.recorder.write(self.txid, self.rxid, REQUEST, payload)
+
+    def recv(self, n=4095):
+        payload = self.isotp_socket.recv(n)
+        if payload:
+            self.recorder.write(self.txid, self.rxid, RESPONSE, payload)
+        return payload
+
+    def fileno(self):
+        return self.isotp_socket.fileno()
+
+    def close(self):
+        self.isotp_socket.close()
+
+
+def read_records(path):
+    """ yields (time, txid, rxid, direction, payload) of a recording """
+    with open(path, "rb") as record_file:
+        data = record_file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("{} is not a UDS recording".format(path))
+    offset = len(MAGIC)
+    view = memoryview(data)
+    while offset + _RECORD.size <= len(data):
+        timestamp, txid, rxid, direction, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        yield timestamp, txid, rxid, direction, bytes(view[offset:offset + length])
+        offset += length
+
+
+class VirtualEcu(object):
+    """
+    Answers requests like the recorded ECU: every recorded exchange (request -> responses with their delays)
+    is replayed in turn, unknown requests get generic or negative responses
+    """
+
+    def __init__(self):
+        self.exchanges = {} # request -> [[(delay, response), ...], ...] one list per recorded exchange
+        self._turns = {}
+        self.unknown = 0
+
+    def add(self, request, responses):
+        self.exchanges.setdefault(request, []).append(responses)
+
+    def _recorded(self, request):
+        variants = self.exchanges.get(request)
+        if not variants:
+            return None
+        turn = self._turns.get(request, 0)
+        self._turns[request] = turn + 1
+        return variants[turn % len(variants)]
+
+    def respond(self, request):
+        """ list of (delay in seconds, response payload) """
+        responses = self._recorded(request)
+        if responses is not None:
+            return responses
+        sid = request[0]
+        if sid == 0x22 and len(request) > 3 and len(request) % 2 == 1:
+            # multi-DID read, put it together from the recorded single reads
+            data, delay = [b"\x62"], 0.0
+            for index in range(1, len(request), 2):
+                single = self._recorded(request[:1] + request[index:index + 2])
+                if not single or single[-1][1][0] != 0x62:
+                    break
+                delay = max(delay, single[-1][0])
+                data.append(single[-1][1][1:])
+            else:
+                return [(delay, b"".join(data))]
+        self.unknown += 1
+        if sid == 0x3E:
+            return [] if len(request) > 1 and request[1] & 0x80 else [(0.0, b"\x7e" + request[1:2])]
+        if sid == 0x10 and len(request) > 1:
+            return [(0.0, b"\x50" + request[1:2] + b"\x00\x32\x01\xf4")] # P2 50 ms, P2* 5 s
+        if sid == 0x22:
+            return [(0.0, bytes([0x7F, sid, 0x31]))] # request out of range
+        return [(0.0, bytes([0x7F, sid, 0x11]))] # service not supported
+
+
+class VirtualBus(object):
+    """
+    In-process stand-in for the CAN interface: open() is a socket factory for the ISO-TP pool,
+    one thread answers the requests of all virtual ECUs. speed 2 halves the recorded response times,
+    speed 0 answers immediately.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.ecus = {} # (txid, rxid) -> VirtualEcu
+        self.requests = 0
+        self._sockets = {} # ecu side socket -> (txid, rxid)
+        self._scheduled = [] # heap of (due, sequence, socket, payload)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="virtual-bus", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def load(cls, path, speed=1.0):
+        """ virtual ECUs of all address pairs in a recording """
+        bus = cls(speed)
+        current = {} # (txid, rxid) -> (request time, request, responses)
+        for timestamp, txid, rxid, direction, payload in read_records(path):
+            key = (txid, rxid)
+            if direction == REQUEST:
+                if key in current:
+                    bus.ecu(*key).add(current[key][1], current[key][2])
+                current[key] = (timestamp, payload, [])
+            elif key in current:
+                current[key][2].append((max(0.0, timestamp - current[key][0]), payload))
+        for key, (_, request, responses) in current.items():
+            bus.ecu(*key).add(request, responses)
+        logger.info("Loaded %s virtual ECUs from %s", len(bus.ecus), path)
+        return bus
+
+    def ecu(self, txid, rxid):
+        return self.ecus.setdefault((txid, rxid), VirtualEcu())
+
+    def open(self, interface, txid, rxid, profile=None):
+        """ socket factory (see _isotp_pool.ISOTPPool), returns the tester side of a new socketpair, the link profile does not matter """
+        tester, ecu = socket_pair()
+        ecu.setblocking(False)
+        with self._lock:
+            self._sockets[ecu] = (txid, rxid)
+        self.ecu(txid, rxid)
+        self._wakeup_write.send(b"\0")
+        return tester
+
+    def _schedule(self, ecu_socket, request):
+        responses = self.ecus[self._sockets[ecu_socket]].respond(request)
+        now = time.monotonic()
+        with self._lock:
+            for delay, payload in responses:
+                self._sequence += 1
+                heapq.heappush(self._scheduled, (now + (delay / self.speed if self.speed else 0.0), self._sequence, ecu_socket, payload))
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                sockets = list(self._sockets)
+                timeout = max(0.0, self._scheduled[0][0] - time.monotonic()) if self._scheduled else 1.0
+            readable = select.select(sockets + [self._wakeup_read], [], [], timeout)[0]
+            for sock in readable:
+                if sock is self._wakeup_read:
+                    sock.recv(64)
+                    continue
+                try:
+                    request = sock.recv(4095)
+                except (BlockingIOError, OSError):
+                    continue
+                if not request:
+                    with self._lock:
+                        self._sockets.pop(sock, None) # tester side closed
+                    sock.close()
+                    continue
+                self.requests += 1
+                self._schedule(sock, request)
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._scheduled or self._scheduled[0][0] > now:
+                        break
+                    _, _, sock, payload = heapq.heappop(self._scheduled)
+                try:
+                    sock.send(payload)
+                except OSError:
+                    pass # tester side is gone
+
+    def close(self):
+        self._running = False
+        self._wakeup_write.send(b"\0")
+        self._thread.join(1.0)
+        for sock in list(self._sockets):
+            sock.close()
+        self._wakeup_read.close()
+        self._wakeup_write.close()
@@ -0,0 +1,199 @@
+"""
+Micro benchmarks for the UDS request path, they run without CAN hardware.
+A socketpair (SOCK_SEQPACKET keeps message boundaries like ISO-TP, see _virtual_ecu) stands in for the bus.
+
+usage: python3 benchmark.py receive [--requests 100] [--delay 5]
+       python3 benchmark.py decode [--corpus responses.txt] [--rounds 2000]
+       python3 benchmark.py router [--subscriptions 5000] [--messages 20000]
+       python3 benchmark.py payload [--rounds 2000]
+"""
+
+import re
+import sys
+import time
+import random
+import select
+import argparse
+import threading
+import statistics
+
+import _payload
+import _virtual_ecu
+import _uds_helper
+import _topic_router
+
+
+# recorded ECU responses (hex), positive and negative ones
+CORPUS = [
+    "5001003201f4",
+    "5003003201f4",
+    "62010c01e240",
+    "62030100ff00ff01c2",
+    "62031000000100",
+    "62f10000080203",
+    "62f18c3132333435363738",
+    "62f190" + b"WVWZZZ1JZXW000001".hex(),
+    "6fd0130332",
+    "6fd0130132",
+    "6fd0010302",
+    "710103b101",
+    "710303b100",
+    "7e00",
+    "7f2231",
+    "7f2f13",
+    "7f317f",
+    "7f2f78",
+    "62ffff00",
+]
+
+
+def echo_ecu(ecu, delay, stop):
+    """ answers every request with a positive response after delay seconds """
+    while not stop.is_set():
+        if not select.select([ecu], [], [], 0.1)[0]:
+            continue
+        request = ecu.recv(4095)
+        if not request:
+            break
+        time.sleep(delay)
+        ecu.send(bytes([request[0] + 0x40]) + request[1:] + b"\x00\x01\x02")
+
+
+def legacy_receive(isotp_socket, delta=7):
+    """ receive loop as it was before the select based _receiveISOTP (sleep-poll, wall clock) """
+    payload = None
+    t1 = time.time()
+    while time.time() - t1 < delta and not payload:
+        payload = isotp_socket.recv()
+        time.sleep(0.05)
+    return payload
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print("{:<10} n={:<5} mean={:8.2f}ms p50={:8.2f}ms p99={:8.2f}ms".format(
+        name, len(samples), statistics.mean(samples) * 1000, statistics.median(samples) * 1000, p99 * 1000))
+
+
+def bench_receive(args):
+    """ request/response latency of the legacy sleep-poll loop compared to the select based receive """
+    tester, ecu = _virtual_ecu.socket_pair()
+    stop = threading.Event()
+    thread = threading.Thread(target=echo_ecu, args=(ecu, args.delay / 1000, stop), daemon=True)
+    thread.start()
+    helper = _uds_helper.UDSHelper(isotp_socket=tester)
+
+    for name, receive in [("legacy", lambda: legacy_receive(tester)), ("select", lambda: helper._waitISOTP(helper.p2))]:
+        samples = []
+        for _ in range(args.requests):
+            t1 = time.perf_counter()
+            helper._transmitISOTP(b"\x22\x01\x0c")
+            if not receive():
+                print("{}: no response".format(name))
+            samples.append(time.perf_counter() - t1)
+        report(name, samples)
+    stop.set()
+
+
+def bench_decode(args):
+    """ throughput of the response decoding (catalog lookup and decoders) """
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus) as corpus_file:
+            corpus = [line.strip() for line in corpus_file if line.strip() and not line.startswith("#")]
+    payloads = [bytes.fromhex(payload) for payload in corpus]
+    helper = _uds_helper.UDSHelper()
+
+    t1 = time.perf_counter()
+    for _ in range(args.rounds):
+        for payload in payloads:
+            helper._getUDSInformation(payload, {"service": None, "parameter": None, "PID": None, "data": None, "description": None, "interpretation": None, "unit": None})
+    duration = time.perf_counter() - t1
+    count = args.rounds * len(payloads)
+    print("decoded {} responses in {:.3f}s: {:.0f} responses/s, {:.2f}us/response".format(count, duration, count / duration, duration / count * 10**6))
+
+
+def legacy_match(subscribed, topic):
+    """ topic matching as it was before the TopicRouter (regex built per subscription and message) """
+    result = []
+    for key in subscribed:
+        pattern = key.replace("#", ".*")
+        pattern = pattern.replace("/", "\\/")
+        if re.match(pattern, topic):
+            result.append(key)
+    return result
+
+
+def bench_router(args):
+    """ dispatch cost per message of the topic trie compared to the regex loop """
+    random.seed(1)
+    ecus = ["ecu{}".format(i) for i in range(args.subscriptions // 4)]
+    filters = []
+    for ecu in ecus:
+        filters += ["3pi4/uds/{}/#".format(ecu), "3pi4/uds/{}/ReadDataByIdentifier/+".format(ecu),
+                    "3pi4/metrics/{}".format(ecu), "3pi4/+/{}/status".format(ecu)]
+    topics = ["3pi4/uds/{}/ReadDataByIdentifier/ReadOdometerValueFromBus".format(random.choice(ecus)) for _ in range(args.messages)]
+    router = _topic_router.TopicRouter()
+    for topic_filter in filters:
+        router.add(topic_filter, None)
+
+    t1 = time.perf_counter()
+    for topic in topics:
+        router.match(topic)
+    duration = time.perf_counter() - t1
+    print("trie   {} subscriptions: {:.2f}us/message".format(len(filters), duration / len(topics) * 10**6))
+
+    legacy_topics = topics[:max(1, args.messages // 1000)] # the regex loop is too slow for the full run
+    t1 = time.perf_counter()
+    for topic in legacy_topics:
+        legacy_match(filters, topic)
+    duration = time.perf_counter() - t1
+    print("regex  {} subscriptions: {:.2f}us/message".format(len(filters), duration / len(legacy_topics) * 10**6))
+
+
+def bench_payload(args):
+    """ encode time and size of the response payload formats """
+    helper = _uds_helper.UDSHelper()
+    results = [helper._buildResponse(payload[:2], bytes.fromhex(payload)) for payload in CORPUS if not payload.startswith("7f")]
+    results.append({"type": "batch", "results": dict(("r{}".format(index), result) for index, result in enumerate(results))})
+    for format in _payload.FORMATS:
+        t1 = time.perf_counter()
+        for _ in range(args.rounds):
+            for result in results:
+                _payload.encode(result, format)
+        duration = time.perf_counter() - t1
+        sizes = [len(_payload.encode(result, format)) for result in results]
+        print("{:<8} {:7.2f}us/response, {:6.1f} bytes/response, batch of {}: {} bytes".format(
+            format, duration / (args.rounds * len(results)) * 10**6, statistics.mean(sizes[:-1]), len(results) - 1, sizes[-1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDS micro benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    receive = commands.add_parser("receive", help="response latency of _receiveISOTP")
+    receive.add_argument("--requests", type=int, default=100)
+    receive.add_argument("--delay", type=float, default=5, help="simulated ECU response time in ms")
+    receive.set_defaults(func=bench_receive)
+    decode = commands.add_parser("decode", help="decoding throughput of a corpus of responses")
+    decode.add_argument("--corpus", help="file with one hex encoded response per line, defaults to a built in corpus")
+    decode.add_argument("--rounds", type=int, default=2000)
+    decode.set_defaults(func=bench_decode)
+    router = commands.add_parser("router", help="topic dispatch cost with many subscriptions")
+    router.add_argument("--subscriptions", type=int, default=5000)
+    router.add_argument("--messages", type=int, default=20000)
+    router.set_defaults(func=bench_router)
+    payload = commands.add_parser("payload", help="encode time and size of json compared to the binary formats")
+    payload.add_argument("--rounds", type=int, default=2000)
+    payload.set_defaults(func=bench_payload)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Link profile calibration against a simulated ECU that gets slower with longer STmin and loses frames
+without flow control pauses: the probe request, measuring one profile, choosing the best, nothing usable.
+
+usage: python3 calibration_test.py
+"""
+
+import time
+import threading
+import unittest
+
+import _catalog
+import _calibration
+import _isotp_pool
+import _virtual_ecu
+
+
+SERVICES = {
+    "ReadDataByIdentifier": {
+        "ID": "22",
+        "Odometer": {"ID": "010C", "response": {"length": 3}},
+        "Serial": {"ID": "F18C"},
+    },
+}
+
+
+def _stmin(value):
+    """ seconds of a flow control STmin """
+    return value / 1000 if value < 0x80 else (value - 0xF0) / 10000
+
+
+class CalibrationTest(unittest.TestCase):
+    def setUp(self):
+        self.pause = _calibration.PAUSE
+        _calibration.PAUSE = 0
+        self.sockets = []
+
+    def tearDown(self):
+        _calibration.PAUSE = self.pause
+        for ecu in self.sockets:
+            ecu.close()
+
+    def factory(self, interface, txid, rxid, profile=None):
+        """ socket to a simulated ECU, one per profile like the ISO-TP sockets """
+        profile = _isotp_pool.link_profile(profile)
+        tester, ecu = _virtual_ecu.socket_pair()
+        self.sockets.append(ecu)
+
+        def run():
+            try:
+                request = ecu.recv(4095)
+                while request:
+                    if profile["stmin"] != 0 or profile["bs"] != 0: # else overrun, the response gets lost
+                        time.sleep(0.002 + 2 * _stmin(profile["stmin"]))
+                        ecu.send(b"\x62" + request[1:] + bytes(100))
+                    request = ecu.recv(4095)
+            except OSError:
+                pass # the measurement closed its socket
+        threading.Thread(target=run, daemon=True).start()
+        return tester
+
+    def test_probe_request(self):
+        catalog = _catalog.Catalog(_catalog.expand(SERVICES))
+        services = [["ReadDataByIdentifier", "Serial"], ["ReadDataByIdentifier", "Odometer"], ["TesterPresent", "Request"]]
+        self.assertEqual(_calibration.probe_request(catalog, services, 4095), bytes.fromhex("22010CF18C"))
+        self.assertEqual(_calibration.probe_request(catalog, services, 4095, "ReadDataByIdentifier/Serial"), bytes.fromhex("22F18C"))
+        with self.assertRaises(ValueError):
+            _calibration.probe_request(catalog, [["TesterPresent", "Request"]], 4095)
+
+    def test_measure(self):
+        result = _calibration.measure(self.factory, "virtual", 0x63B, 0x5BB, {"stmin": 1, "bs": 8}, b"\x22\xf1\x90", requests=3)
+        self.assertEqual((result["error_rate"], result["response_length"]), (0.0, 103))
+        self.assertGreater(result["throughput"], 0)
+        lost = _calibration.measure(self.factory, "virtual", 0x63B, 0x5BB, {"stmin": 0, "bs": 0}, b"\x22\xf1\x90", requests=2, p2=0.02)
+        self.assertEqual((lost["error_rate"], lost["response_length"]), (1.0, None))
+
+    def test_best(self):
+        results = [{"profile": "a", "throughput": 1000, "error_rate": 0.0}, {"profile": "b", "throughput": 1020, "error_rate": 0.0},
+                   {"profile": "c", "throughput": 5000, "error_rate": 0.1}]
+        self.assertEqual(_calibration.best(results)["profile"], "a") # b is not faster beyond the tolerance
+        self.assertEqual(_calibration.best(results, max_error_rate=0.2)["profile"], "c")
+        self.assertIsNone(_calibration.best(results[2:]))
+
+    def test_calibrate(self):
+        profile, results = _calibration.calibrate(self.factory, "virtual", "063B", "05BB", b"\x22\xf1\x90", {"txpad": "0x55"},
+                                                  requests=2, p2=0.02)
+        self.assertEqual(len(results), len(_calibration.STMINS) * len(_calibration.BLOCK_SIZES) + len(_calibration.TX_STMINS))
+        self.assertEqual(profile["stmin"], 0)
+        self.assertNotEqual(profile["bs"], 0)
+        self.assertEqual(profile["txpad"], 0x55) # kept from the base profile
+
+    def test_nothing_usable(self):
+        def factory(interface, txid, rxid, profile=None):
+            raise OSError("no such device")
+        profile, results = _calibration.calibrate(factory, "virtual", "063B", "05BB", b"\x22\xf1\x90", requests=1)
+        self.assertIsNone(profile)
+        self.assertEqual(len(results), len(_calibration.STMINS) * len(_calibration.BLOCK_SIZES))
+
+
+if __name__ == "__main__":
+    unittest.main()
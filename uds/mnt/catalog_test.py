@@ -0,0 +1,175 @@
+"""
+Compiled catalog: response lookup by SID and PID, request templates, multi-DID reads,
+and Catalogs: ECU sections in their own files, reloading a changed catalog.
+
+usage: python3 catalog_test.py
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import _catalog
+
+
+SERVICES = {
+    "ReadDataByIdentifier": {
+        "ID": "22",
+        "Odometer": {"ID": "010C", "response": {"length": 3, "decode": {"scale": 0.1}, "unit": "km"}},
+        "Serial": {"ID": "F18C", "response": {"decode": {"encoding": "ascii"}}},
+        "Session": {"ID": "F186", "response": {"length": 1, "decode": {"enum": {"01": "Default"}}}},
+    },
+    "RoutineControl": {
+        "ID": "31",
+        "Start": {"ID": "01FF00"},
+    },
+    "InputOutputControlByIdentifier": {
+        "ID": "2F",
+        "SetIntensity": {"ID": "0301", "parameters": {
+            "control": {"bit": "1F", "default": "3"},
+            "intensity": {"bit": "2F", "scale": 0.5, "default": "0"},
+        }},
+        "SetName": {"ID": "0302", "parameters": {
+            "name": {"bit": "37", "length": 4, "encoding": "ascii", "default": ""},
+        }},
+    },
+    "Negative Response": {"ID": "7F"},
+}
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.catalog = _catalog.Catalog(_catalog.expand(SERVICES))
+
+    def test_lookup(self):
+        self.assertEqual(self.catalog.lookup(bytes.fromhex("62010C01E240")),
+                         ("ReadDataByIdentifier Positive Response", "Odometer Response", 3))
+        self.assertEqual(self.catalog.lookup(bytearray.fromhex("62F18C41")), # bytearray like the socket buffers
+                         ("ReadDataByIdentifier Positive Response", "Serial Response", 3))
+        self.assertEqual(self.catalog.lookup(bytes.fromhex("62AAAA00")), ("ReadDataByIdentifier Positive Response", None, 1))
+        self.assertEqual(self.catalog.lookup(bytes.fromhex("7F2231")), ("Negative Response", None, 1))
+        self.assertEqual(self.catalog.lookup(bytes.fromhex("AA")), (None, None, 1))
+
+    def test_lookup_pid_lengths(self):
+        # the shortest PID that matches wins, like the linear search did
+        catalog = _catalog.Catalog({"RoutineControl Positive Response": {"ID": "71", "Short": {"ID": "01"}, "Long": {"ID": "01FF00"}}})
+        self.assertEqual(catalog.lookup(bytes.fromhex("7101FF0000"))[1:], ("Short", 2))
+        self.assertEqual(catalog.lookup(bytes.fromhex("7102"))[1], None)
+
+    def test_request_without_parameters(self):
+        self.assertEqual(self.catalog.encode("ReadDataByIdentifier", "Odometer"), bytes.fromhex("22010C"))
+        self.assertEqual(self.catalog.encode("RoutineControl", "Start"), bytes.fromhex("3101FF00"))
+        with self.assertRaises(KeyError):
+            self.catalog.encode("ReadDataByIdentifier", "Unknown")
+
+    def test_request_parameters(self):
+        self.assertEqual(self.catalog.encode("InputOutputControlByIdentifier", "SetIntensity", {"intensity": "50"}),
+                         bytes.fromhex("2F0301030064"))
+        self.assertEqual(self.catalog.encode("InputOutputControlByIdentifier", "SetIntensity", {"control": "0", "intensity": "1"}),
+                         bytes.fromhex("2F0301000002"))
+        # text shorter than its field stays zero padded, longer gets cut
+        self.assertEqual(self.catalog.encode("InputOutputControlByIdentifier", "SetName", {"name": "AB"}), b"\x2f\x03\x02AB\x00\x00")
+        self.assertEqual(self.catalog.encode("InputOutputControlByIdentifier", "SetName", {"name": "ABCDEF"}), b"\x2f\x03\x02ABCD")
+        with self.assertRaises(ValueError):
+            self.catalog.encode("InputOutputControlByIdentifier", "SetIntensity", {"intensity": "x"})
+
+    def test_request_leaves_catalog_alone(self):
+        before = repr(self.catalog.uds_dict)
+        self.catalog.encode("InputOutputControlByIdentifier", "SetIntensity", {"control": "1", "intensity": "2"})
+        self.assertEqual(repr(self.catalog.uds_dict), before)
+        self.assertEqual(self.catalog.requests[("InputOutputControlByIdentifier", "SetIntensity")].template, bytes.fromhex("2F0301"))
+
+    def test_decode(self):
+        self.assertAlmostEqual(self.catalog.decode("ReadDataByIdentifier Positive Response", "Odometer Response", "01E240"), 12345.6)
+        self.assertIsNone(self.catalog.decode("ReadDataByIdentifier Positive Response", "Odometer Response", "zz"))
+        self.assertIsNone(self.catalog.decode("ReadDataByIdentifier", "Unknown", "00"))
+
+    def test_read_batches(self):
+        # known lengths first, the DID of unknown length last
+        self.assertEqual(self.catalog.readBatches(["Serial", "Odometer", "Session"]),
+                         [(bytes.fromhex("22010CF186F18C"), ["Odometer", "Session", "Serial"])])
+        # the response to Odometer and Session (1 + 2 DIDs + 3 + 1 data bytes) does not fit max_length
+        self.assertEqual(self.catalog.readBatches(["Odometer", "Session", "Serial"], max_length=8),
+                         [(bytes.fromhex("22010CF18C"), ["Odometer", "Serial"]), (bytes.fromhex("22F186"), ["Session"])])
+        self.assertEqual(len(self.catalog.readBatches(["Odometer", "Session"], max_length=5)), 2)
+
+    def test_read_batches_shipped_catalog(self):
+        # all DIDs of the PTCM in gateway.json fit one request
+        catalog = _catalog.Catalogs(os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")).get()
+        parameters = ["ReadOdometerValueFromBus", "ReadAnalogDigitalConverterRawValues", "InputOutputStates", "ActiveDiagnosticInformation",
+                      "ElectroniControlUnitSerialNumber", "VehicleIdentificationNumberOriginal", "VehicleIdentificationNumberCurrent"]
+        batches = catalog.readBatches(parameters)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0][1][-1], "ElectroniControlUnitSerialNumber")
+
+    def test_split_read(self):
+        dids = [bytes.fromhex("010C"), bytes.fromhex("F186"), bytes.fromhex("F18C")]
+        self.assertEqual(self.catalog.splitRead(bytes.fromhex("62010C000010F18603F18C4142"), dids),
+                         [(dids[0], bytes.fromhex("000010")), (dids[1], b"\x03"), (dids[2], b"AB")])
+        with self.assertRaises(ValueError):
+            self.catalog.splitRead(bytes.fromhex("62F186030000"), dids[1:2]) # bytes left over
+        with self.assertRaises(ValueError):
+            self.catalog.splitRead(bytes.fromhex("62010C000010F18C41"), dids[:2]) # other DID than requested
+        with self.assertRaises(ValueError):
+            self.catalog.splitRead(bytes.fromhex("62F18C41F18603"), [dids[2], dids[1]]) # unknown length not last
+
+
+class CatalogsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "catalog.json")
+        self.write("catalog.json", {"services": SERVICES, "ecus": {"bcm": "catalog/bcm.json"}})
+        os.makedirs(os.path.join(self.directory, "catalog"))
+        self.write("catalog/bcm.json", {"ReadDataByIdentifier": {"Temperature": {"ID": "4A10"}}})
+        self.catalogs = _catalog.Catalogs(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, document, stamp=None):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as catalog_file:
+            json.dump(document, catalog_file)
+        if stamp is not None:
+            os.utime(path, ns=(stamp, stamp)) # a different mtime even on coarse file systems
+
+    def test_sections(self):
+        self.assertEqual(self.catalogs.sections(), ["bcm"])
+        bcm = self.catalogs.get("bcm")
+        self.assertIs(self.catalogs.get("bcm"), bcm) # compiled once
+        self.assertEqual(bcm.encode("ReadDataByIdentifier", "Temperature"), bytes.fromhex("224A10"))
+        self.assertEqual(bcm.encode("ReadDataByIdentifier", "Odometer"), bytes.fromhex("22010C")) # common services as well
+        with self.assertRaises(KeyError):
+            self.catalogs.get("other").encode("ReadDataByIdentifier", "Temperature")
+
+    def test_reload(self):
+        common = self.catalogs.get()
+        self.assertFalse(self.catalogs.reload())
+        self.write("catalog.json", {"services": {"ReadDataByIdentifier": {"ID": "22", "Mileage": {"ID": "010D"}}}}, 10**9)
+        self.assertTrue(self.catalogs.reload())
+        self.assertEqual(self.catalogs.version, 1)
+        self.assertIsNot(self.catalogs.get(), common)
+        self.assertEqual(self.catalogs.get().encode("ReadDataByIdentifier", "Mileage"), bytes.fromhex("22010D"))
+        self.assertEqual(self.catalogs.sections(), [])
+
+    def test_reload_section_file(self):
+        self.catalogs.get("bcm")
+        self.write("catalog/bcm.json", {"ReadDataByIdentifier": {"Humidity": {"ID": "4A11"}}}, 10**9)
+        self.assertTrue(self.catalogs.reload())
+        self.assertEqual(self.catalogs.get("bcm").encode("ReadDataByIdentifier", "Humidity"), bytes.fromhex("224A11"))
+
+    def test_broken_file_keeps_catalogs(self):
+        common = self.catalogs.get()
+        with open(self.path, "w", encoding="utf-8") as catalog_file:
+            catalog_file.write("{broken")
+        os.utime(self.path, ns=(10**9, 10**9))
+        self.assertFalse(self.catalogs.reload())
+        self.assertIs(self.catalogs.get(), common)
+        self.assertEqual(self.catalogs.version, 0)
+        self.assertFalse(self.catalogs.reload()) # tried again after the next change only
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,19 +4,25 @@ Standard module to use the paho library for setting up a mqtt-client and connect
 for paho-mqtt docu, see https://pypi.org/project/paho-mqtt/
 """
 
+import os
 import sys
 import time
+import threading
+import asyncio
 import logging
-import requests
-from threading import Thread
 import json
 import paho.mqtt.client as mqtt
-import re
+import _topic_router
+import _outbox
+import _payload
 
 
 HOSTNAME = "3pi4"
 MQTT_IP = "1.0.0.34"
 MQTT_PORT = "1883"
+OUTBOX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox") # + client id, publishes kept while offline
+MAX_INFLIGHT = 20 # stored messages sent but not yet acknowledged
+MAX_QUEUE = 16 # messages in progress per subscription, more get a busy reply
 logger = logging.getLogger(__name__)
 
 
@@ -25,55 +31,111 @@ class Client:
     Setting up a client to publish and subscribe on given topics at a given borker address
     """
 
-    def __init__(self, id=None, broker_adress=MQTT_IP, broker_port=MQTT_PORT):
-        """ initialize client """
+    def __init__(self, id=None, broker_adress=MQTT_IP, broker_port=MQTT_PORT, max_queue=MAX_QUEUE, outbox=OUTBOX,
+                 max_stored=_outbox.MAX_ENTRIES):
+        """ initialize client, outbox=None disables storing publishes while offline """
         logger.info('Initializing MQTT Client')
         self.broker_adress = broker_adress
         self.broker_port = broker_port
         self.client = mqtt.Client(HOSTNAME + "/" + id, clean_session=True, userdata=None, protocol=mqtt.MQTTv311, transport="tcp")
         self.subscribed = {} # suscribed topics and their on_message callbacks
+        self.router = _topic_router.TopicRouter() # same as subscribed, for matching incoming topics
         self.publish_callback = None
+        self.connect_callback = None # called without arguments after every (re)connect
+        self.formats = None # TopicRouter: response topic filter -> payload format, for busy replies
+        self.max_queue = max_queue
+        self.pending = {} # subscription -> messages in progress
+        self.completed = {}
+        self._pending_lock = threading.Lock()
+        self.outbox = None
+        if outbox:
+            self.outbox = _outbox.Outbox("{}-{}.sqlite".format(outbox, id.replace("/", "-")), max_stored)
+        self._inflight = [] # (outbox id, message info) of stored messages sent to the broker
+        self._last_sent = 0 # outbox id of the newest stored message sent since connecting
+        self._outbox_lock = threading.RLock() # never held while calling into paho
 
     def on_connect(self, client, userdata, flags, res_code):
         """
         post a message when broker is found and connected to,
         also do some more action, e. g. ... (?)
         """
-        logger.info("MQTT Client connected with result code {}".format(res_code))
+        logger.info("MQTT Client connected with result code %s", res_code)
         # self.client.subscribe("3pi2/test")
         for topic in self.subscribed:
-            logger.info("Subscribing to topic \"{}\"".format(topic))
+            logger.info("Subscribing to topic \"%s\"", topic)
             self.client.subscribe(topic)
+        self._replay()
+        if self.connect_callback:
+            self.connect_callback()
 
     def on_disconnect(self, client, userdata, res_code):
         """ called on disconnect (client from broker) """
-        logger.info("MQTT Client disconnected with result code {}".format(res_code))
+        logger.info("MQTT Client disconnected with result code %s", res_code)
+        with self._outbox_lock:
+            # unacknowledged stored messages get sent again after reconnecting
+            self._inflight = []
+            self._last_sent = 0
 
     def on_subscribe(self, client, userdata, mid, granted_qos):
-        logger.info("Successfully subscribed with userdata {}, message id {} and qos {}".format(userdata, mid, granted_qos))
+        logger.info("Successfully subscribed with userdata %s, message id %s and qos %s", userdata, mid, granted_qos)
 
     def on_unsubscribe(self, client, userdata, mid):
         """ called when the broker responds to an unsubscribe request """
-        logger.debug("Successfully unsubscribed with userdata {}, message id {}".format(userdata, mid))
+        logger.debug("Successfully unsubscribed with userdata %s, message id %s", userdata, mid)
 
     def on_message(self, client, userdata, msg):
-        logger.debug("Got a message on topic \"{}\", message {}".format(msg.topic, msg.payload))
-
-        # if self.subscribed[msg.topic]:
-        for key in self.subscribed:
-            pattern = key.replace("#", ".*")
-            pattern = pattern.replace("/", "\/")
-            # logger.debug("pattern, topic: {}, {}".format(pattern, msg.topic))
-            if re.match(pattern, msg.topic):
-                # logger.debug("topic matches pattern")
-                # use a thread to call the callback, to not block new publishes (etc.) in callback
-                # see: https://github.com/eclipse/paho.mqtt.python/issues/234
-                thread = Thread(target=self.subscribed[key], args=(self, msg))
-                thread.start()
-            # timestamp = int(time.time()*10**9)
-        # payload = str(msg.topic) + ' value="' + str(msg.payload) + '" ' + str(timestamp)
-        # response = requests.post('http://192.168.137.32:8086/write?db=mqttdb', data=payload)
-        # logger.debug("Write message to influxdb, status: {}".format(response.text))
+        logger.debug("Got a message on topic \"%s\", message %s", msg.topic, msg.payload)
+
+        # one trie lookup for all subscriptions (MQTT wildcard semantics)
+        for key, func in self.router.match(msg.topic):
+            with self._pending_lock:
+                accepted = self.pending.get(key, 0) < self.max_queue
+                if accepted:
+                    self.pending[key] = self.pending.get(key, 0) + 1
+            if accepted:
+                self._dispatch(key, func, msg)
+            else:
+                self.busy(key, msg)
+
+    def _dispatch(self, key, func, msg):
+        """ call the callback in a new thread, to not block new publishes (etc.) in callback """
+        # see: https://github.com/eclipse/paho.mqtt.python/issues/234
+        def run():
+            try:
+                func(self, msg)
+            except Exception:
+                logger.exception("Callback for \"%s\" failed", key)
+            finally:
+                self._done(key)
+        threading.Thread(target=run).start()
+
+    def _done(self, key):
+        with self._pending_lock:
+            self.pending[key] -= 1
+            self.completed[key] = self.completed.get(key, 0) + 1
+
+    def busy(self, key, msg):
+        """ too many messages of a subscription in progress, tell the requester (if it asked for a response) instead of waiting """
+        logger.info("Queue for \"%s\" is full, rejecting message on topic \"%s\"", key, msg.topic)
+        try:
+            message = json.loads(msg.payload.decode('utf-8'))
+            response = message['response']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        format = _payload.response_format(message, response, self.formats)
+        if format not in _payload.FORMATS:
+            format = _payload.JSON
+        error = {"type": "error", "error": "busy", "queue": self.depth(key)}
+        self.client.publish(response, _payload.encode(error, format), 1, False)
+
+    def depth(self, key):
+        """ number of messages of a subscription in progress """
+        return self.pending.get(key, 0)
+
+    def metrics(self):
+        """ messages in progress and completed per subscription """
+        with self._pending_lock:
+            return dict((key, {"depth": depth, "completed": self.completed.get(key, 0)}) for key, depth in self.pending.items())
 
     def on_publish(self, client, userdata, mid):
         """
@@ -81,30 +143,61 @@ class Client:
         Info: usefull to use as a wait function e. g. before shutting down the client
         """
         # logger.debug("Successfully published with userdata {} and message id {} ".format(userdata, mid))
+        if self._inflight:
+            self._replay(mid)
         if self.publish_callback:
             self.publish_callback(self)
 
+    def _replay(self, acknowledged=None):
+        """
+        send stored messages in order, at most MAX_INFLIGHT unacknowledged ones at a time (QoS 1),
+        acknowledged ones (and the one with message id acknowledged) are removed from the outbox
+        """
+        if self.outbox is None:
+            return
+        with self._outbox_lock:
+            done = [id for id, info in self._inflight if info.mid == acknowledged or info.is_published()]
+            if done:
+                self.outbox.remove(done)
+                self._inflight = [(id, info) for id, info in self._inflight if id not in done]
+            if not self.client.is_connected():
+                return
+            entries = self.outbox.oldest(MAX_INFLIGHT - len(self._inflight), self._last_sent)
+            if entries:
+                self._last_sent = entries[-1][0]
+        for id, topic, payload, qos, retain in entries:
+            info = self.client.publish(topic, payload, max(qos, 1), bool(retain))
+            with self._outbox_lock:
+                self._inflight.append((id, info))
+
     # def on_log(self, client, userdata, level, buf):
     #     """ gets called when the paho mqtt client has some log information """
     #     logger.debug("Got a level {} logging message: {}".format(level, buf))
 
 
-    def run(self):
-        """ bind paho methods and start client """
+    def _bind(self):
+        """ bind paho methods """
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_subscribe = self.on_subscribe
         self.client.on_publish = self.on_publish
+        self.client.on_disconnect = self.on_disconnect
         # self.client.on_log = self.on_log
         # self.client.enable_logger(logger)
         self.client.reconnect_delay_set(min_delay=0.3, max_delay=120)
+
+    def _connect(self):
+        """ connect, if the broker is not reachable the network loop keeps trying (publishes go to the outbox) """
         try:
             self.client.connect(self.broker_adress, int(self.broker_port), 60)
-        except:
-            txt = 'Broker with ip-adress {} on port {} not found'.format(self.broker_adress, self.broker_port)
+        except (OSError, ValueError) as e:
+            txt = 'Broker with ip-adress {} on port {} not found ({})'.format(self.broker_adress, self.broker_port, e)
             logger.error(txt)
-            raise Exception(txt)
-            # sys.exit()
+
+    def run(self):
+        """ bind paho methods and start client """
+        self._bind()
+        self._connect()
         # self.client.loop_forever()
         self.client.loop_start()
     
@@ -115,32 +208,130 @@ class Client:
         """
         self.client.disconnect()
         self.client.loop_stop()
+        if self.outbox:
+            self.outbox.close()
 
     def subscribe(self, topic, func=None, qos=1):
         """ subscribe to a topic """
         topic = HOSTNAME + "/" + topic
-        logger.debug("Subscribing to topic \"{}\"".format(topic))
+        logger.debug("Subscribing to topic \"%s\"", topic)
         # self.client.subscribe(topic)
         self.subscribed[topic] = func
+        self.router.add(topic, func)
         self.client.subscribe(topic, qos)
 
     def unsubscribe(self, topic):
         """ unsubscribe from a topic """
-        logger.info("Unsubscribing from topic \"{}\"".format(topic))
+        topic = HOSTNAME + "/" + topic
+        logger.info("Unsubscribing from topic \"%s\"", topic)
         self.client.unsubscribe(topic)
-        del self.subscribed[topic]
+        self.router.remove(topic)
+        self.subscribed.pop(topic, None)
 
     def publish(self, topic, message, qos=1, retain=False, func=None):
         """ publish a message on a topic """
-        logger.debug("Publish message \"{}\" on topic \"{}\"".format(message, topic))
+        logger.debug("Publish message \"%s\" on topic \"%s\"", message, topic)
         if func:
             self.publish_callback = func
-        self.client.publish(topic, message, qos, retain)
+        if self.outbox is None:
+            self.client.publish(topic, message, qos, retain)
+            return
+        if self.client.is_connected() and not len(self.outbox):
+            info = self.client.publish(topic, message, qos, retain)
+            # paho keeps QoS 1/2 messages until reconnect itself
+            if info.rc == mqtt.MQTT_ERR_SUCCESS or qos > 0:
+                return
+        # offline or older messages are waiting, keep the order
+        self.outbox.put(topic, message, qos, retain)
+        self._replay()
+
+    def is_connected(self):
+        return self.client.is_connected()
+
+    def buildService(self, service):
+        """ topic and payload (json) of a Service Discovery message, service is not modified """
+        topic = "services/" + HOSTNAME + "/" + service["request"]
+        service = dict(service, request=HOSTNAME + "/" + service["request"])
+        return topic, json.dumps(service)
 
     def publishService(self, service, qos=1, retain=True):
         """ special publish function for Service Discovery services """
-        topic = "services/" + HOSTNAME + "/" + service["request"]
-        service["request"] = HOSTNAME + "/" + service["request"]
-        logger.debug("Publish SD message \"{}\" on topic \"{}\"".format(service, topic))
-        json_message = json.dumps(service)
-        self.client.publish(topic, json_message, qos, retain)
+        topic, json_message = self.buildService(service)
+        logger.debug("Publish SD message \"%s\" on topic \"%s\"", json_message, topic)
+        self.publish(topic, json_message, qos, retain)
+
+
+class AsyncClient(Client):
+    """
+    Same as Client, but driven by an asyncio event loop instead of the paho network thread.
+    Subscription callbacks are coroutines func(client, msg), each message runs as a task on the loop.
+    """
+
+    def __init__(self, id=None, broker_adress=MQTT_IP, broker_port=MQTT_PORT, max_queue=MAX_QUEUE, outbox=OUTBOX, max_stored=_outbox.MAX_ENTRIES):
+        Client.__init__(self, id, broker_adress, broker_port, max_queue=max_queue, outbox=outbox, max_stored=max_stored)
+        self.loop = None
+        self._loop_thread = None
+        self._misc = None
+
+    def _dispatch(self, key, func, msg):
+        task = self.loop.create_task(func(self, msg))
+        task.add_done_callback(lambda task, key=key: self._task_done(key, task))
+
+    def _task_done(self, key, task):
+        self._done(key)
+        if not task.cancelled() and task.exception():
+            logger.error("Callback for \"%s\" failed: %r", key, task.exception())
+
+    def _on_loop(self, func, *args):
+        """ run func on the event loop, (re)connects call the socket callbacks from an executor thread """
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def _loop_misc(self):
+        """ keepalive pings and reconnects, paho's loop_misc needs to run about once per second """
+        delay = 0.3
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    # TCP connect and handshake block up to the socket timeout, requests go on meanwhile
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                    delay = 0.3
+                except (OSError, ValueError) as e:
+                    logger.info("Reconnect failed (%s), next try in %ss", e, delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 120)
+                    continue
+            await asyncio.sleep(1)
+
+    async def start(self):
+        """ connect and hook the paho socket into the running event loop """
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._bind()
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        await self.loop.run_in_executor(None, self._connect)
+        self._misc = self.loop.create_task(self._loop_misc())
+
+    def stop(self):
+        if self._misc:
+            self._misc.cancel()
+        self.client.disconnect()
+        if self.outbox:
+            self.outbox.close()
@@ -0,0 +1,94 @@
+"""
+Client message dispatch: messages in progress per subscription, busy replies in the format of the response topic.
+Needs paho-mqtt, no broker (publishes are recorded).
+
+usage: python3 client_test.py
+"""
+
+import json
+import asyncio
+import threading
+import unittest
+
+import client
+import _payload
+import _topic_router
+
+
+class _Message(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def _request(response=None, **message):
+    if response:
+        message["response"] = response
+    return _Message(client.HOSTNAME + "/ecu/request", json.dumps(message).encode("utf-8"))
+
+
+class ClientTest(unittest.TestCase):
+    def setUp(self):
+        self.client = client.Client("test", max_queue=2, outbox=None)
+        self.published = []
+        self.client.client.publish = lambda topic, payload, qos=0, retain=False: self.published.append((topic, payload))
+        self.release = threading.Event()
+        self.calls = []
+
+    def callback(self, mqtt_client, msg):
+        self.calls.append(msg.topic)
+        self.release.wait(1.0)
+
+    def test_threads_bounded_per_subscription(self):
+        self.client.subscribe("ecu/request", self.callback)
+        for _ in range(3):
+            self.client.on_message(None, None, _request("reply"))
+        self.assertEqual(self.client.depth(client.HOSTNAME + "/ecu/request"), 2)
+        self.assertEqual(len(self.published), 1)
+        topic, payload = self.published[0]
+        self.assertEqual((topic, json.loads(payload)), ("reply", {"type": "error", "error": "busy", "queue": 2}))
+        self.release.set()
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and not thread.daemon:
+                thread.join(1.0)
+        self.assertEqual(self.client.metrics(), {client.HOSTNAME + "/ecu/request": {"depth": 0, "completed": 2}})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_busy_reply_format(self):
+        self.client.formats = _topic_router.TopicRouter()
+        self.client.formats.add("binary/#", _payload.CBOR)
+        self.client.busy("key", _request("binary/reply"))
+        self.client.busy("key", _request("reply", format="cbor"))
+        self.client.busy("key", _request("reply", format="unknown"))
+        self.client.busy("key", _request()) # no response topic, nobody to tell
+        self.assertEqual([topic for topic, _ in self.published], ["binary/reply", "reply", "reply"])
+        self.assertEqual(_payload.decode(self.published[0][1], _payload.CBOR)["error"], "busy")
+        self.assertEqual(_payload.decode(self.published[1][1], _payload.CBOR)["error"], "busy")
+        self.assertEqual(json.loads(self.published[2][1])["error"], "busy")
+
+
+class AsyncClientTest(unittest.TestCase):
+    def test_tasks_bounded_per_subscription(self):
+        mqtt_client = client.AsyncClient("test", max_queue=1, outbox=None)
+        published = []
+        mqtt_client.client.publish = lambda topic, payload, qos=0, retain=False: published.append(topic)
+
+        async def callback(mqtt_client, msg):
+            await asyncio.sleep(0.01)
+
+        async def run():
+            mqtt_client.loop = asyncio.get_running_loop()
+            mqtt_client.subscribe("ecu/request", callback)
+            mqtt_client.on_message(None, None, _request("reply"))
+            mqtt_client.on_message(None, None, _request("reply"))
+            self.assertEqual(published, ["reply"])
+            await asyncio.sleep(0.05)
+            mqtt_client.on_message(None, None, _request("reply"))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual(mqtt_client.metrics(), {client.HOSTNAME + "/ecu/request": {"depth": 0, "completed": 2}})
+
+
+if __name__ == "__main__":
+    unittest.main()
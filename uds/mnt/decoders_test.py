@@ -0,0 +1,49 @@
+"""
+Compiled "decode" and "encoding" entries of the catalog, and legacy interpretation strings.
+
+usage: python3 decoders_test.py
+"""
+
+import unittest
+
+import _decoders
+
+
+class DecodersTest(unittest.TestCase):
+    def test_number(self):
+        self.assertEqual(_decoders.compile_decoder({"encoding": "uint"})("0102"), 258)
+        self.assertAlmostEqual(_decoders.compile_decoder({"scale": 0.1, "offset": -40})("01F4"), 10.0)
+
+    def test_text_and_hex(self):
+        self.assertEqual(_decoders.compile_decoder({"encoding": "utf-8"})("575657"), "WVW")
+        self.assertEqual(_decoders.compile_decoder({})("00ff"), "00ff")
+
+    def test_enum(self):
+        decode = _decoders.compile_decoder({"enum": {"00080201": "Default Session"}})
+        self.assertEqual(decode("00080201"), "Default Session")
+        self.assertEqual(decode("00080202"), "00080202") # unknown values stay hex
+
+    def test_fields(self):
+        decode = _decoders.compile_decoder({"fields": [{"start": 0, "length": 2, "unit": "ms"},
+                                                       {"start": 2, "length": 2, "scale": 10, "unit": "ms"}]})
+        self.assertEqual(decode("003201F4"), "50ms, 5000ms")
+
+    def test_legacy(self):
+        source = "x = str(int(x, 16) * 2)"
+        self.assertEqual(_decoders.compile_legacy(source)("10"), "32")
+        code = _decoders._legacy_code[source]
+        _decoders.compile_legacy(source)
+        self.assertIs(_decoders._legacy_code[source], code) # compiled once
+        with self.assertRaises(NameError):
+            _decoders.compile_legacy("x = open(x)")("00") # no builtins beyond the listed ones
+
+    def test_encoder(self):
+        self.assertEqual(_decoders.compile_encoder({})("12"), 12)
+        self.assertEqual(_decoders.compile_encoder({"scale": 0.5})("3"), 6)
+        self.assertEqual(_decoders.compile_encoder({"encoding": "ascii"})("AB"), b"AB")
+        self.assertEqual(_decoders.compile_encoder({"encoding": "hex"})("0a0b"), b"\x0a\x0b")
+        self.assertEqual(_decoders.compile_encoder({"interpretation": "x = format(int(x), '02x')"})("16"), 0x10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Discovery against a stub broker that keeps retained messages: changes only, and descriptors removed
+while disconnected get cleared after the reconnect.
+
+usage: python3 discovery_test.py
+"""
+
+import json
+import unittest
+
+import _discovery
+
+
+class _Broker(object):
+    """ retained messages by topic, an empty payload deletes one like on a real broker """
+
+    def __init__(self):
+        self.retained = {}
+        self.messages = [] # (topic, payload) of every publish
+
+    def publish(self, topic, payload, retain):
+        self.messages.append((topic, payload))
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+
+class _Client(object):
+    """ the parts of client.Client that Discovery uses """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def buildService(self, service):
+        return "services/host/" + service["request"], json.dumps(service)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if not self.connected:
+            raise AssertionError("publish while disconnected: " + topic)
+        self.broker.publish(topic, payload, retain)
+
+
+def _descriptors(*names):
+    return [{"request": "uds/disp/ReadDataByIdentifier/" + name, "description": name} for name in names]
+
+
+class DiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = _Broker()
+        self.client = _Client(self.broker)
+        self.discovery = _discovery.Discovery(self.client)
+
+    def topics(self, *names):
+        return set("services/host/uds/disp/ReadDataByIdentifier/" + name for name in names)
+
+    def test_changes_only(self):
+        self.discovery.update(_descriptors("A", "B"))
+        self.assertEqual(set(self.broker.retained), self.topics("A", "B"))
+        del self.broker.messages[:]
+        self.discovery.update(_descriptors("A", "B"))
+        self.assertEqual(self.broker.messages, [])
+        self.discovery.update(_descriptors("A"))
+        self.assertEqual(self.broker.messages, [(list(self.topics("B"))[0], "")])
+        self.assertEqual(set(self.broker.retained), self.topics("A"))
+
+    def test_removed_while_disconnected(self):
+        self.discovery.update(_descriptors("A", "B", "C"))
+        self.client.connected = False
+        self.discovery.update(_descriptors("A", "D"))
+        self.assertEqual(set(self.broker.retained), self.topics("A", "B", "C"))
+        self.client.connected = True
+        self.discovery.on_connect()
+        self.assertEqual(set(self.broker.retained), self.topics("A", "D"))
+
+    def test_broker_restart(self):
+        self.discovery.update(_descriptors("A", "B"))
+        self.broker.retained.clear() # retained messages lost
+        self.discovery.on_connect()
+        self.assertEqual(set(self.broker.retained), self.topics("A", "B"))
+
+
+if __name__ == "__main__":
+    unittest.main()
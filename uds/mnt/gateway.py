@@ -0,0 +1,651 @@
+"""
+UDS gateway: serves all ECUs configured in gateway.json from one asyncio event loop,
+with one MQTT connection and one ISO-TP socket pool.
+Requests go to <service>/<ecu>/<UDS service>/<parameter>, e.g. uds/disp/ReadDataByIdentifier/ReadOdometerValueFromBus
+ECUs with a "transfer" directory in the config also read memory into files there: <service>/<ecu>/transfer/read or /upload
+Decoded responses go to InfluxDB if the "influx" block of the config is "enabled" (shipped disabled, set it to true
+once the database runs at "url").
+
+usage: python3 gateway.py [--config gateway.json] [ecu ...]
+       python3 gateway.py --scan [--scan-range 000 7F7] (adds the ECUs found on the bus to the config)
+       python3 gateway.py --record traffic.rec, later without hardware: python3 gateway.py --replay traffic.rec [--speed 10]
+       python3 gateway.py --import-catalog vendor.pdx (adds its ECU variants to the catalog, select one with "catalog" per ECU)
+       python3 gateway.py --calibrate disp [--probe ReadDataByIdentifier/VehicleIdentificationNumberOriginal] [--fd]
+       (measures ISO-TP link profiles on the ECU or a --replay simulation, stores the best as its "link")
+"""
+
+import os
+import re
+import sys
+import time
+import json
+import asyncio
+import logging
+import argparse
+
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import client
+import _catalog
+import _uds_helper
+import _isotp_pool
+import _uds_async
+import _response_cache
+import _poller
+import _session
+import _scanner
+import _influx_sink
+import _discovery
+import _payload
+import _topic_router
+import _virtual_ecu
+import _metrics
+import _logging
+import _odx
+import _transfer
+import _calibration
+
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger(__name__ + ".requests") # sampled, one line per request
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gateway.json")
+SERVICE = "uds"
+BATCH = "Batch" # parameter name of multi-DID reads: <service>/<ecu>/ReadDataByIdentifier/Batch
+TRANSFERS = {"read": "ReadMemoryByAddress", "upload": "RequestUpload"} # <service>/<ecu>/transfer/<action> -> UDS service
+RESUMES = 3 # times a memory transfer continues after it stopped, before the error goes to the requester
+CATALOG_CHECK = 5.0 # seconds between checks for catalog changes
+
+
+def load_config(path=CONFIG):
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+def locate_catalog(config, config_path=CONFIG):
+    """ catalog file of a config, a relative "catalog" starts at the directory of the config file """
+    if not config.get("catalog"):
+        return _uds_helper.CATALOG_FILE
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), config["catalog"])
+
+
+def save_config(config, path=CONFIG):
+    """ replace the config file, a crash never leaves a half written file behind """
+    text = json.dumps(config, indent=4)
+    # keep [service, parameter] pairs on one line, like the hand written config
+    text = re.sub(r'\[\s+("[^"]*"),\s+("[^"]*")\s+\]', r'[\1, \2]', text)
+    with open(path + ".tmp", "w") as config_file:
+        config_file.write(text + "\n")
+    os.replace(path + ".tmp", path)
+
+
+class Ecu(object):
+    """ one ECU of the gateway: its addresses, timing and exposed services """
+
+    def __init__(self, name, config, pool, service=SERVICE, sink=None, formats=None, metrics=None, catalogs=None, directory=None):
+        self.name = name
+        self.topic = service + "/" + name
+        self.txid = config["txid"]
+        self.rxid = config["rxid"]
+        self.p2 = config.get("p2", _uds_helper.P2_TIMEOUT)
+        self.p2_star = config.get("p2_star", _uds_helper.P2_STAR_TIMEOUT)
+        self.response = config.get("response", "tester1/" + name)
+        self.services = [tuple(element) for element in config["services"]]
+        self.exposed = set(self.services)
+        self.max_length = config.get("max_length", _catalog.MAX_LENGTH) # longest request/response the ECU handles
+        self.multi_did = config.get("multi_did", True) # several DIDs per ReadDataByIdentifier, turned off if rejected
+        self.cache = _response_cache.ResponseCache(config.get("cache_entries", _response_cache.MAX_ENTRIES))
+        transfer = config.get("transfer", {})
+        # memory transfers write files into this directory only (relative to the config file's directory), they are off without it
+        directory = directory or os.path.dirname(CONFIG)
+        self.transfers = os.path.join(directory, transfer["directory"]) if transfer.get("directory") else None
+        self.address_bytes = transfer.get("address_bytes", _transfer.ADDRESS_BYTES)
+        self.size_bytes = transfer.get("size_bytes") # as few as needed by default
+        self.catalogs = catalogs if catalogs is not None else _uds_helper.CATALOGS
+        self.section = config.get("catalog", name) # section of the catalog file with the services of this ECU
+        self.catalog = self.catalogs.get(self.section)
+        self.session = _session.SessionState(self.catalog, config.get("s3", _session.S3_TIMEOUT), config.get("tester_present_interval", _session.TESTER_PRESENT_INTERVAL))
+        self.pool = pool
+        self.pool.set_profile(self.txid, self.rxid, config.get("link")) # ISO-TP options, see _isotp_pool.PROFILE
+        self.sink = sink # gets every response read from the bus
+        self.formats = formats # TopicRouter: response topic filter -> payload format
+        self.metrics = metrics # _metrics.Metrics, gets the stage timings of every request
+        self.sampled = _logging.Sampler() # which requests get a line in the request log
+        self.lock = asyncio.Lock()
+
+    async def _run(self, client, response, work, service=None, payload_format=_payload.JSON, trace=None, on_pending=None):
+        """
+        await work(transport) on the (pooled) socket of this ECU, requests of one ECU run one after another,
+        the ECU is switched to the session service needs first. "response pending" notices go to on_pending
+        or the response topic
+        """
+        async with self.lock:
+            if trace:
+                trace.mark(_metrics.LOCK)
+            # never blocks, the lock above is the only user of this address pair
+            connection = self.pool.acquire(self.txid, self.rxid)
+            broken = False
+            try:
+                if on_pending is None:
+                    on_pending = self._pending_publisher(client, response, payload_format)
+                transport = _uds_async.AsyncUDSTransport(connection.isotp_socket, self.catalog, p2=self.p2, p2_star=self.p2_star, on_pending=on_pending, on_response=self.session.observe)
+                if trace:
+                    trace.mark(_metrics.CONNECT)
+                error = await self.session.enter(transport, service)
+                if error is not None:
+                    return error
+                if trace:
+                    trace.mark(_metrics.SESSION)
+                    transport.trace = trace # session requests count as session time
+                return await work(transport)
+            except OSError:
+                broken = True
+                raise
+            finally:
+                self.pool.release(connection, broken)
+
+    def _pending_publisher(self, client, response, payload_format):
+        """ on_pending that tells one requester that the ECU asked for more time """
+        return _uds_helper.UDSHelper(client, response, catalog=self.catalog, payload_format=payload_format)._publishPending
+
+    async def keepalive(self):
+        """ TesterPresent in the background while a non-default session is active """
+        while True:
+            await asyncio.sleep(min(self.session.interval, 0.5))
+            if not self.session.idle():
+                continue
+            async with self.lock:
+                if not self.session.idle():
+                    continue # a request kept the session alive meanwhile
+                connection = self.pool.acquire(self.txid, self.rxid)
+                broken = False
+                try:
+                    self.session.keepalive(_uds_async.AsyncUDSTransport(connection.isotp_socket, self.catalog))
+                except OSError as e:
+                    logger.error("TesterPresent on %s failed: %r", self.name, e)
+                    broken = True
+                finally:
+                    self.pool.release(connection, broken)
+
+    async def execute(self, client, response, service, parameter, message={}, payload_format=_payload.JSON, trace=None):
+        """ run one UDS request """
+        if (service, parameter) not in self.exposed:
+            info = "{} / {} is not available on {}.".format(service, parameter, self.name)
+            logger.info(info)
+            return {"type": "error", "error": info}
+
+        async def request(on_pending=None):
+            result = await self._run(client, response, lambda transport: transport.execute(service, parameter, message), service, payload_format, trace, on_pending)
+            self._record(result)
+            return result
+        if service == "ReadDataByIdentifier":
+            # served from the cache if still valid, identical concurrent reads share one request,
+            # every requester gets the "response pending" notices on its own response topic
+            ttl = self.catalog.ttls.get((service, parameter), 0)
+            return await self.cache.fetch((service, parameter), ttl, request, self._pending_publisher(client, response, payload_format))
+        return await request()
+
+    async def read(self, client, response, parameters, use_cache=True, payload_format=_payload.JSON, trace=None):
+        """ read several ReadDataByIdentifier parameters in as few requests as possible """
+        for parameter in parameters:
+            if ("ReadDataByIdentifier", parameter) not in self.exposed:
+                info = "ReadDataByIdentifier / {} is not available on {}.".format(parameter, self.name)
+                logger.info(info)
+                return {"type": "error", "error": info}
+
+        cached = {}
+        for parameter in parameters if use_cache else ():
+            if self.catalog.ttls.get(("ReadDataByIdentifier", parameter), 0) <= 0:
+                continue # never cached, not a miss either
+            result = self.cache.get(("ReadDataByIdentifier", parameter))
+            if result is not None:
+                cached[parameter] = result
+        missing = [parameter for parameter in parameters if parameter not in cached]
+
+        async def work(transport):
+            results, self.multi_did = await transport.read(missing, self.max_length, self.multi_did)
+            return results
+        results = await self._run(client, response, work, "ReadDataByIdentifier", payload_format, trace) if missing else {}
+        if results.get("type") == "error":
+            return results
+        for parameter, result in results.items():
+            self._record(result)
+            if _response_cache.cacheable(result):
+                self.cache.put(("ReadDataByIdentifier", parameter), result, self.catalog.ttls.get(("ReadDataByIdentifier", parameter), 0))
+        results.update(cached)
+        return {"type": "batch", "results": results}
+
+    async def transfer(self, client, response, action, message, payload_format=_payload.JSON, trace=None):
+        """
+        <service>/<ecu>/transfer/read (ReadMemoryByAddress) or <service>/<ecu>/transfer/upload (RequestUpload)
+        {"address", "size", "file", "resume"}: size bytes at address into file in the transfer directory,
+        "resume" continues a file left incomplete by an earlier transfer
+        """
+        if self.transfers is None or action not in TRANSFERS:
+            info = "Memory transfer {} is not available on {}.".format(action, self.name)
+            logger.info(info)
+            return {"type": "error", "error": info}
+        try:
+            address, size = _isotp_pool._to_int(message["address"]), int(message["size"])
+            path = os.path.join(self.transfers, message["file"])
+            if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.transfers) or address < 0 or size <= 0:
+                raise ValueError("file must be a name in the transfer directory, address and size positive")
+        except (KeyError, ValueError, TypeError) as e:
+            return {"type": "error", "error": "Invalid transfer request ({})".format(e)}
+        os.makedirs(self.transfers, exist_ok=True)
+        offset = min(os.path.getsize(path), size) if message.get("resume") and os.path.exists(path) else 0
+        service = TRANSFERS[action]
+        with open(path, "r+b" if offset else "wb") as sink:
+            kind = _transfer.MemoryRead if service == "ReadMemoryByAddress" else _transfer.Upload
+            transfer = kind(address, size, sink, self.max_length, offset, self.address_bytes, self.size_bytes)
+
+            async def work(transport):
+                for resumes in range(RESUMES + 1):
+                    try:
+                        return await transport.transfer(transfer)
+                    except _transfer.TransferError as e:
+                        if resumes == RESUMES:
+                            logger.info("%s of %s stopped at %s of %s bytes: %s", service, self.name, transfer.received, size, e)
+                            return {"type": "error", "error": "{} stopped: {}".format(service, e), "transfer": transfer.stats()}
+                        logger.info("%s of %s interrupted at %s of %s bytes (%s), resuming", service, self.name, transfer.received, size, e)
+                        transfer.resume()
+            result = await self._run(client, response, work, service, payload_format, trace)
+        if result.get("type") == "error":
+            return result
+        logger.info("%s of %s bytes from %s into %s at %s bytes/s", service, size - offset, self.name, message["file"], result["throughput"])
+        return dict(result, type="transfer", ecu=self.name, service=service, file=message["file"], resumed=offset)
+
+    def reload(self, catalog):
+        """ use the reloaded catalog (compiled already), requests already running finish with the old one """
+        self.catalog = catalog
+        self.session.use(self.catalog)
+        self.cache.invalidate() # decoded with the old catalog
+
+    def _record(self, result):
+        if self.sink is not None:
+            self.sink.add(self.name, result)
+
+    def on_cache(self, action, message):
+        """ <service>/<ecu>/cache/invalidate ({"parameters": [...]} or everything) and <service>/<ecu>/cache/stats """
+        if action == "invalidate":
+            parameters = message.get("parameters")
+            self.cache.invalidate(None if parameters is None else [("ReadDataByIdentifier", parameter) for parameter in parameters])
+        return {"type": "cache", "ecu": self.name, "stats": self.cache.stats(), "session": self.session.stats()}
+
+    async def on_request(self, client, msg):
+        logger.debug("Callback: Got message: %s on topic: %s", msg.payload, msg.topic)
+        topics = msg.topic.split("/")
+        trace = None
+        if self.metrics is not None:
+            trace = self.metrics.trace(self.name, topics[-2], getattr(msg, "timestamp", None))
+            trace.mark(_metrics.QUEUE)
+        message = json.loads(msg.payload.decode('utf-8'))
+        response = message['response']
+        format = _payload.response_format(message, response, self.formats)
+
+        if format not in _payload.FORMATS:
+            format, result = _payload.JSON, {"type": "error", "error": "Unknown payload format {}, use one of {}.".format(format, _payload.FORMATS)}
+        elif topics[-2] == "cache":
+            result = self.on_cache(topics[-1], message)
+        elif topics[-2] == "transfer":
+            result = await self.transfer(client, response, topics[-1], message, format, trace)
+        elif topics[-2] == "ReadDataByIdentifier" and topics[-1] == BATCH:
+            result = await self.read(client, response, message.get("parameters", []), payload_format=format, trace=trace)
+        else:
+            result = await self.execute(client, response, topics[-2], topics[-1], message, format, trace)
+        try:
+            payload = _payload.encode(result, format)
+        except (TypeError, ValueError) as e:
+            logger.info("Could not encode the response on %s as %s: %r", msg.topic, format, e)
+            payload = _payload.encode({"type": "error", "error": "Could not encode the response as {} ({})".format(format, e)}, format)
+        client.publish(response, payload, 1)
+        if trace:
+            trace.mark(_metrics.PUBLISH)
+            self.metrics.finish(trace)
+        if self.sampled() and request_logger.isEnabledFor(logging.INFO):
+            self._log(topics, result, trace)
+
+    def _log(self, topics, result, trace):
+        """ one line about a (sampled) request: what was asked, the outcome and where the time went """
+        outcome = result.get("type") if isinstance(result, dict) else "no response"
+        if outcome == "uds":
+            value = result.get("interpretation") if result.get("interpretation") is not None else result.get("data")
+            outcome = "SID {}".format(result["SID"]) + (" {}".format(value) if value is not None else "")
+        elif outcome == "error":
+            outcome = "error " + str(result.get("error"))
+        timing = ""
+        if trace:
+            timing = " in {:.1f} ms ({})".format(trace.stages[_metrics.TOTAL] * 1000,
+                                                 ", ".join("{} {:.1f}".format(stage, trace.stages[stage] * 1000) for stage in _metrics.STAGES[:-1] if stage in trace.stages))
+        request_logger.info("%s %s/%s: %s%s", self.name, topics[-2], topics[-1], outcome, timing)
+
+    def descriptors(self):
+        """ service discovery messages of all exposed services """
+        uds_dict = self.catalog.uds_dict
+        messages = []
+        for element in self.services:
+            if element[1] not in uds_dict.get(element[0], {}):
+                logger.error("%s / %s of %s is not in the catalog", element[0], element[1], self.name)
+                continue
+            description = "No description available."
+            if "description" in uds_dict[element[0]][element[1]]:
+                description = uds_dict[element[0]][element[1]]["description"]
+            message = {
+                "request": self.topic + "/" + element[0] + "/" + element[1],
+                "description": description,
+                "parameters": {
+                    "response": {
+                        "default": self.response,
+                        "description": "Topic to publish response to.",
+                        "type": "string"},
+                    "format": {
+                        "default": _payload.JSON,
+                        "description": "Payload format of the response: " + ", ".join(_payload.FORMATS) + ".",
+                        "type": "string"}}}
+            if "parameters" in uds_dict[element[0]][element[1]]:
+                for parameter in uds_dict[element[0]][element[1]]["parameters"]:
+                    message["parameters"][parameter] = uds_dict[element[0]][element[1]]["parameters"][parameter]
+            messages.append(message)
+        dids = [element[1] for element in self.services if element[0] == "ReadDataByIdentifier"]
+        if dids:
+            messages.append({
+                "request": self.topic + "/ReadDataByIdentifier/" + BATCH,
+                "description": "Read several data identifiers with one request (falls back to single reads).",
+                "parameters": {
+                    "response": {
+                        "default": self.response,
+                        "description": "Topic to publish response to.",
+                        "type": "string"},
+                    "format": {
+                        "default": _payload.JSON,
+                        "description": "Payload format of the response: " + ", ".join(_payload.FORMATS) + ".",
+                        "type": "string"},
+                    "parameters": {
+                        "default": dids,
+                        "description": "ReadDataByIdentifier parameters to read.",
+                        "type": "array"}}})
+        for action, service in sorted(TRANSFERS.items()) if self.transfers else ():
+            messages.append({
+                "request": self.topic + "/transfer/" + action,
+                "description": "Read memory with {} into a file of the gateway, reports bytes/s.".format(service),
+                "parameters": {
+                    "response": {
+                        "default": self.response,
+                        "description": "Topic to publish response to.",
+                        "type": "string"},
+                    "address": {
+                        "description": "Start address, hex string or integer.",
+                        "type": "string"},
+                    "size": {
+                        "description": "Bytes to read.",
+                        "type": "integer"},
+                    "file": {
+                        "description": "File name in the transfer directory of the gateway.",
+                        "type": "string"},
+                    "resume": {
+                        "default": False,
+                        "description": "Continue an incomplete file instead of starting over.",
+                        "type": "boolean"}}})
+        return messages
+
+
+class Gateway(object):
+    """ all ECUs on one event loop: one MQTT connection, one socket pool, no threads """
+
+    def __init__(self, config, names=None, client_id=SERVICE + "/gateway", config_path=CONFIG):
+        service = config.get("service", SERVICE)
+        interface = config.get("interface", _isotp_pool.INTERFACE)
+        socket_factory = _isotp_pool.open_socket
+        self.bus = None
+        if interface == _virtual_ecu.INTERFACE:
+            # no CAN hardware, the ECUs answer from a recording
+            self.bus = _virtual_ecu.VirtualBus.load(config["replay"], config.get("replay_speed", 1.0))
+            socket_factory = self.bus.open
+        self.recorder = None
+        if config.get("record"):
+            self.recorder = _virtual_ecu.Recorder(config["record"])
+            socket_factory = self.recorder.wrap(socket_factory)
+        self.pool = _isotp_pool.ISOTPPool(interface, socket_factory=socket_factory)
+        self.sink = None
+        influx = config.get("influx")
+        if influx and influx.get("enabled", True):
+            self.sink = _influx_sink.InfluxSink(influx.get("url", _influx_sink.URL), influx.get("database", _influx_sink.DATABASE),
+                                                influx.get("batch_size", _influx_sink.BATCH_SIZE), influx.get("flush_interval", _influx_sink.FLUSH_INTERVAL))
+        self.formats = _topic_router.TopicRouter()
+        for topic_filter, format in config.get("formats", {}).items():
+            self.formats.add(topic_filter, format)
+        metrics = config.get("metrics", {})
+        self.metrics = _metrics.Metrics()
+        self.metrics_topic = metrics.get("topic", "metrics/" + client.HOSTNAME + "/" + service)
+        self.metrics_interval = metrics.get("interval", _metrics.INTERVAL)
+        self.metrics_port = metrics.get("prometheus_port") # scrape endpoint, off by default
+        self.catalogs = _uds_helper.CATALOGS
+        if config.get("catalog"):
+            self.catalogs = _catalog.Catalogs(locate_catalog(config, config_path))
+        self.catalog_interval = config.get("catalog_check", CATALOG_CHECK)
+        names = names or list(config["ecus"])
+        directory = os.path.dirname(os.path.abspath(config_path))
+        self.ecus = [Ecu(name, config["ecus"][name], self.pool, service, self.sink, self.formats, self.metrics, self.catalogs, directory) for name in names]
+        broker = config.get("broker", {})
+        self.client = client.AsyncClient(client_id, broker.get("host", client.MQTT_IP), broker.get("port", client.MQTT_PORT), outbox=config.get("outbox", client.OUTBOX))
+        self.client.formats = self.formats
+        self.service = service
+        self.topic = service + "/poll"
+        self.poller = _poller.Poller(self.ecus, self.client)
+        manifest = "services/" + client.HOSTNAME + "/" + service + "/manifest" if config.get("manifest") else None
+        self.discovery = _discovery.Discovery(self.client, manifest)
+        self.discovery.update(self.descriptors())
+        self.client.connect_callback = self.discovery.on_connect
+
+    async def on_poll(self, client, msg):
+        """
+        <service>/poll/subscribe {"ecu", "parameter", "period" (s), "topic", optional "format"} starts streaming samples to topic,
+        <service>/poll/unsubscribe {"id"} stops it, <service>/poll/stats reports jitter and missed deadlines
+        """
+        action = msg.topic.split("/")[-1]
+        message = json.loads(msg.payload.decode('utf-8'))
+        try:
+            if action == "subscribe":
+                format = _payload.response_format(message, message["topic"], self.formats)
+                subscription = self.poller.add(message["ecu"], message["parameter"], message["period"], message["topic"], format)
+                result = {"type": "poll", "subscription": subscription.stats()}
+            elif action == "unsubscribe":
+                result = {"type": "poll", "removed": self.poller.remove(message["id"])}
+            else:
+                result = {"type": "poll", "subscriptions": self.poller.stats()}
+        except (KeyError, ValueError, TypeError) as e:
+            result = {"type": "error", "error": "Invalid poll request ({})".format(e)}
+        if "response" in message:
+            client.publish(message["response"], json.dumps(result), 1)
+
+    async def on_sink(self, client, msg):
+        """ <service>/sink/stats {"response"} reports queue depth and write latency of the time series sink """
+        message = json.loads(msg.payload.decode('utf-8'))
+        result = {"type": "sink", "stats": self.sink.stats() if self.sink else None}
+        if "response" in message:
+            client.publish(message["response"], json.dumps(result), 1)
+
+    async def on_metrics(self, client, msg):
+        """ <service>/metrics/stats {"response"} reports the stage timings right away """
+        message = json.loads(msg.payload.decode('utf-8'))
+        if "response" in message:
+            client.publish(message["response"], json.dumps(self.metrics_message()), 1)
+
+    def metrics_message(self):
+        return {"type": "metrics", "timestamp": time.time(), "stages": self.metrics.stats(), "queues": self.client.metrics()}
+
+    async def publish_metrics(self):
+        """ stage timings (since the start) on the metrics topic every metrics_interval seconds """
+        while self.metrics_interval:
+            await asyncio.sleep(self.metrics_interval)
+            self.client.publish(self.metrics_topic, json.dumps(self.metrics_message()), 0)
+
+    def descriptors(self):
+        return [message for ecu in self.ecus for message in ecu.descriptors()]
+
+    def refresh_discovery(self):
+        """ call after the catalog or the config changed, only changed descriptors get published """
+        self.discovery.update(self.descriptors())
+
+    def _reload_catalogs(self):
+        """ {section: compiled catalog} of all ECUs if a catalog file changed, else None (runs in the executor) """
+        if not self.catalogs.reload():
+            return None
+        catalogs = {}
+        for ecu in self.ecus:
+            catalog = catalogs[ecu.section] = self.catalogs.get(ecu.section)
+            for key in ecu.services:
+                if key in catalog.requests:
+                    # compiled on first use otherwise, that would be on the loop
+                    catalog.requests[key], catalog.decoders[key]
+        return catalogs
+
+    async def watch_catalog(self):
+        """ reload the catalog when one of its files changed, every catalog_interval seconds """
+        loop = asyncio.get_running_loop()
+        while self.catalog_interval:
+            await asyncio.sleep(self.catalog_interval)
+            # reading and compiling large files must not stall the requests, the loop only swaps them in
+            catalogs = await loop.run_in_executor(None, self._reload_catalogs)
+            if catalogs is not None:
+                for ecu in self.ecus:
+                    ecu.reload(catalogs[ecu.section])
+                self.refresh_discovery()
+
+    async def run(self):
+        await self.client.start()
+        await asyncio.sleep(0.1) # wait to get connected
+        for ecu in self.ecus:
+            self.client.subscribe(ecu.topic + "/#", ecu.on_request, 1)
+        self.client.subscribe(self.topic + "/#", self.on_poll, 1)
+        self.client.subscribe(self.service + "/sink/#", self.on_sink, 1)
+        self.client.subscribe(self.service + "/metrics/#", self.on_metrics, 1)
+        server = await self.metrics.serve(self.metrics_port) if self.metrics_port else None
+        try:
+            await asyncio.gather(self.poller.run(), self.publish_metrics(), self.watch_catalog(), *[ecu.keepalive() for ecu in self.ecus])
+        finally:
+            if server:
+                server.close()
+
+    def stop(self):
+        self.client.stop()
+        self.pool.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.bus:
+            self.bus.close()
+        if self.sink:
+            self.sink.close()
+
+
+async def serve(names=None, config_path=CONFIG, client_id=SERVICE + "/gateway", overrides=None):
+    config = load_config(config_path)
+    config.update(overrides or {})
+    gateway = Gateway(config, names, client_id, config_path)
+    try:
+        await gateway.run()
+    finally:
+        gateway.stop()
+
+
+def main(names=None, config_path=CONFIG, client_id=SERVICE + "/gateway", overrides=None):
+    _logging.setup() # not on import, a program using this module keeps its own logging
+    asyncio.run(serve(names, config_path, client_id, overrides))
+
+
+def scan(config_path=CONFIG, first=_scanner.FIRST_ID, last=_scanner.LAST_ID, window=_scanner.WINDOW):
+    """ discover the ECUs on the bus and add them to the config """
+    config = load_config(config_path)
+    found = _scanner.scan(config.get("interface", _isotp_pool.INTERFACE), first, last, window)
+    added = _scanner.merge(config, found)
+    save_config(config, config_path)
+    for result in found:
+        logger.info("ECU %03X/%03X: %s", result["txid"], result["rxid"], result["identification"])
+    logger.info("Added %s new ECUs to %s: %s", len(added), config_path, added)
+
+
+def calibrate(name, config_path=CONFIG, probe=None, fd=False, requests=_calibration.REQUESTS, overrides=None):
+    """ measure ISO-TP link profiles on one ECU and store the best one as its "link" in the config, False if none worked """
+    config = load_config(config_path)
+    ecu = config["ecus"][name]
+    settings = dict(config, **(overrides or {})) # --replay is not stored
+    interface = settings.get("interface", _isotp_pool.INTERFACE)
+    socket_factory = _isotp_pool.open_socket
+    bus = None
+    if interface == _virtual_ecu.INTERFACE:
+        bus = _virtual_ecu.VirtualBus.load(settings["replay"], settings.get("replay_speed", 1.0))
+        socket_factory = bus.open
+    catalogs = _catalog.Catalogs(locate_catalog(config, config_path)) if config.get("catalog") else _uds_helper.CATALOGS
+    payload = _calibration.probe_request(catalogs.get(ecu.get("catalog", name)), [tuple(element) for element in ecu["services"]],
+                                         ecu.get("max_length", _catalog.MAX_LENGTH), probe)
+    try:
+        profile, results = _calibration.calibrate(socket_factory, interface, ecu["txid"], ecu["rxid"], payload, ecu.get("link"), fd, requests,
+                                                  ecu.get("p2", _uds_helper.P2_TIMEOUT), ecu.get("p2_star", _uds_helper.P2_STAR_TIMEOUT))
+    finally:
+        if bus:
+            bus.close()
+    if profile is None:
+        logger.error("No link profile of %s worked without errors, %s keeps its link profile", name, config_path)
+        return False
+    chosen = [result for result in results if result["profile"] == profile][-1]
+    # padding as hex, like the can ids
+    ecu["link"] = dict(profile, **dict((key, "0x{:02X}".format(profile[key])) for key in ("txpad", "rxpad") if profile[key] is not None))
+    save_config(config, config_path)
+    logger.info("Link profile of %s: %s (%s bytes/s, %.0f%% errors), stored in %s", name, profile, chosen["throughput"], chosen["error_rate"] * 100, config_path)
+    return True
+
+
+def import_catalog(path, config_path=CONFIG):
+    """ add the layers of an ODX/PDX file to the catalog, one section file per layer (ECUs select theirs with "catalog") """
+    config = load_config(config_path)
+    catalog_path = locate_catalog(config, config_path)
+    with open(catalog_path, encoding="utf-8") as catalog_file:
+        document = json.load(catalog_file)
+    names = dict((int(parameters["ID"], 16), service) for service, parameters in document["services"].items())
+    sections = _odx.read(path, names)
+    folder = os.path.splitext(os.path.basename(catalog_path))[0]
+    os.makedirs(os.path.join(os.path.dirname(catalog_path), folder), exist_ok=True)
+    for name, services in sections.items():
+        section = os.path.join(folder, re.sub(r"[^\w.-]", "_", name) + ".json")
+        save_config(services, os.path.join(os.path.dirname(catalog_path), section))
+        document.setdefault("ecus", {})[name] = section
+    # written last, a running gateway reloads once all sections are there
+    save_config(document, catalog_path)
+    logger.info("Added %s catalog sections to %s: %s", len(sections), catalog_path, list(sections))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDS gateway for all configured ECUs")
+    parser.add_argument("--config", default=CONFIG)
+    parser.add_argument("--scan", action="store_true", help="discover the ECUs on the bus, write them to the config and exit")
+    parser.add_argument("--scan-range", nargs=2, default=["000", "7F7"], metavar=("FIRST", "LAST"), help="request ids (hex) to scan")
+    parser.add_argument("--scan-window", type=int, default=_scanner.WINDOW, help="request ids probed at once")
+    parser.add_argument("--record", help="append all ISO-TP requests and responses to this file")
+    parser.add_argument("--replay", help="no CAN hardware, answer requests from a recording (--record)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 answers without the recorded delays")
+    parser.add_argument("--import-catalog", metavar="ODX", help="add the layers of an ODX/PDX file to the catalog and exit")
+    parser.add_argument("--calibrate", metavar="ECU", help="measure ISO-TP link profiles on the ECU, store the best in the config and exit")
+    parser.add_argument("--probe", help="<service>/<parameter> to calibrate with, default: a multi-DID read of the ECU's parameters")
+    parser.add_argument("--fd", action="store_true", help="calibrate CAN-FD frame sizes as well")
+    parser.add_argument("--calibration-requests", type=int, default=_calibration.REQUESTS, help="requests per candidate profile")
+    parser.add_argument("ecus", nargs="*", help="ECUs to serve, defaults to all in the config")
+    args = parser.parse_args()
+    _logging.setup()
+    overrides = {}
+    if args.record:
+        overrides["record"] = args.record
+    if args.replay:
+        overrides.update(interface=_virtual_ecu.INTERFACE, replay=args.replay, replay_speed=args.speed)
+    if args.import_catalog:
+        import_catalog(args.import_catalog, args.config)
+        sys.exit(0)
+    if args.calibrate:
+        sys.exit(0 if calibrate(args.calibrate, args.config, args.probe, args.fd, args.calibration_requests, overrides) else 1)
+    if args.scan:
+        scan(args.config, int(args.scan_range[0], 16), int(args.scan_range[1], 16), args.scan_window)
+        sys.exit(0)
+    while True:
+        try:
+            main(args.ecus, args.config, overrides=overrides)
+        except Exception:
+            logger.exception("main error")
+        time.sleep(3)
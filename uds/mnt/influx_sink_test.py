@@ -0,0 +1,122 @@
+"""
+InfluxSink against a local stub HTTP server: database down, back up, spilled lines replayed in order.
+
+usage: python3 influx_sink_test.py
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import http.server
+
+import _influx_sink
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        with server.lock:
+            status = server.statuses.pop(0) if server.statuses else server.status
+            server.requests += 1
+            if status < 300:
+                server.lines.extend(body.decode("utf-8").split("\n"))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class InfluxSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.status = 503 # database down
+        self.server.statuses = [] # answers of the next requests, before status
+        self.server.requests = 0
+        self.server.lines = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.directory = tempfile.mkdtemp()
+        self.spill = os.path.join(self.directory, "influx.spill")
+        self.sink = _influx_sink.InfluxSink("http://127.0.0.1:{}".format(self.server.server_address[1]), batch_size=10,
+                                            flush_interval=0.05, max_buffer=20, spill_path=self.spill, timeout=1.0)
+
+    def tearDown(self):
+        self.sink.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def add(self, first, count):
+        for index in range(first, first + count):
+            self.sink.add("disp", {"type": "uds", "SID": "62", "service": "ReadDataByIdentifier", "parameter": "Odometer",
+                                   "data": "00", "interpretation": str(index)}, timestamp=index)
+
+    def received(self):
+        """ indices of the lines the database got, in order """
+        with self.server.lock:
+            return [int(float(entry.split("value=")[1].split(",")[0])) for entry in self.server.lines]
+
+    def wait_written(self, count, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while self.sink.written < count and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.sink.written, count)
+
+    def test_down_up_replay(self):
+        self.add(0, 50) # 30 lines overflow into the spill file
+        time.sleep(1.0)
+        # backoff instead of a write every flush_interval: 0.05 + 0.1 + 0.2 + 0.4 s
+        self.assertLessEqual(self.sink.failures, 5)
+        self.assertTrue(os.path.exists(self.spill))
+        modified = os.stat(self.spill).st_mtime_ns
+        time.sleep(1.0)
+        self.assertEqual(os.stat(self.spill).st_mtime_ns, modified, "spill file rewritten while nothing was added")
+        self.server.status = 204 # back up
+        self.add(50, 5)
+        self.wait_written(55)
+        self.assertEqual(self.received(), list(range(55)))
+        self.assertFalse(os.path.exists(self.spill))
+        self.assertEqual(self.sink.stats()["spilled_bytes"], 0)
+
+    def test_replay_continues_after_acknowledged_batch(self):
+        self.add(0, 40) # 20 spilled
+        time.sleep(0.3)
+        self.assertTrue(os.path.exists(self.spill))
+        # the first spilled batch gets through, then the database is gone again
+        self.server.statuses = [204]
+        self.server.status = 503
+        deadline = time.monotonic() + 5.0
+        while not os.path.exists(self.spill + ".offset") and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.received(), list(range(10)))
+        self.server.status = 204
+        self.wait_written(40)
+        # no line twice, none lost
+        self.assertEqual(self.received(), list(range(40)))
+        self.assertFalse(os.path.exists(self.spill + ".offset"))
+
+
+class LineTest(unittest.TestCase):
+    def line(self, interpretation):
+        return _influx_sink.line("disp", {"type": "uds", "SID": "62", "service": "ReadDataByIdentifier", "parameter": "Odometer",
+                                          "data": "00", "interpretation": interpretation}, timestamp=1)
+
+    def test_fields(self):
+        self.assertEqual(self.line("1.5"), 'uds,ecu=disp,service=ReadDataByIdentifier,parameter=Odometer value=1.5,data="00",sid="62" 1000000000')
+        self.assertIn('text="open, 2\\"",', self.line('open, 2"'))
+        self.assertIsNone(_influx_sink.line("disp", {"type": "error", "error": "busy"}))
+
+    def test_non_finite_values_left_out(self):
+        for interpretation in ("nan", "inf", "-inf", float("nan")):
+            self.assertNotIn("value=", self.line(interpretation))
+            self.assertIn('data="00"', self.line(interpretation))
+
+
+if __name__ == "__main__":
+    unittest.main()
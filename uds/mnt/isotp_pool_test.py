@@ -0,0 +1,84 @@
+"""
+ISOTPPool with a stub socket factory: reuse, one user per address pair, eviction and link profiles.
+
+usage: python3 isotp_pool_test.py
+"""
+
+import time
+import unittest
+import threading
+
+import _isotp_pool
+
+
+class _Socket(object):
+    def __init__(self, interface, txid, rxid, profile):
+        self.address = (interface, txid, rxid)
+        self.profile = profile
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ISOTPPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = _isotp_pool.ISOTPPool("vcan0", idle_timeout=60, max_sockets=2, socket_factory=self.factory)
+
+    def factory(self, interface, txid, rxid, profile):
+        isotp_socket = _Socket(interface, txid, rxid, profile)
+        self.opened.append(isotp_socket)
+        return isotp_socket
+
+    def test_reuse(self):
+        connection = self.pool.acquire("063B", "0x5BB")
+        self.assertEqual(connection.isotp_socket.address, ("vcan0", 0x63B, 0x5BB))
+        self.pool.release(connection)
+        self.assertIs(self.pool.acquire(0x63B, 0x5BB), connection)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_one_user_per_address_pair(self):
+        connection = self.pool.acquire(0x63B, 0x5BB)
+        acquired = []
+        waiting = threading.Thread(target=lambda: acquired.append(self.pool.acquire(0x63B, 0x5BB)))
+        waiting.start()
+        time.sleep(0.1)
+        self.assertEqual(acquired, [])
+        self.pool.release(connection)
+        waiting.join(1.0)
+        self.assertEqual(acquired, [connection])
+
+    def test_broken_connection_reopened(self):
+        connection = self.pool.acquire(0x63B, 0x5BB)
+        self.pool.release(connection, broken=True)
+        self.assertTrue(connection.isotp_socket.closed)
+        self.assertIsNot(self.pool.acquire(0x63B, 0x5BB), connection)
+
+    def test_least_recently_used_evicted(self):
+        for txid in (0x700, 0x701, 0x702):
+            self.pool.release(self.pool.acquire(txid, txid + 8))
+            time.sleep(0.01)
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(self.opened[0].closed)
+        self.assertFalse(self.opened[2].closed)
+
+    def test_idle_sockets_closed(self):
+        self.pool.idle_timeout = 0.05
+        self.pool.release(self.pool.acquire(0x63B, 0x5BB))
+        time.sleep(0.1)
+        self.pool.evict()
+        self.assertEqual(len(self.pool), 0)
+        self.assertTrue(self.opened[0].closed)
+
+    def test_profile(self):
+        self.pool.release(self.pool.acquire(0x63B, 0x5BB))
+        self.pool.set_profile("063B", "05BB", {"stmin": 5})
+        self.assertTrue(self.opened[0].closed) # idle socket with the old profile
+        self.pool.release(self.pool.acquire(0x63B, 0x5BB))
+        self.assertEqual(self.opened[1].profile, {"stmin": 5})
+        self.assertEqual(_isotp_pool.link_profile({"txpad": "0x00", "rxpad": None})["txpad"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
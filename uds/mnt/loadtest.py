@@ -0,0 +1,264 @@
+"""
+Load test of the whole request path: tester -> broker -> gateway (on_message, ISO-TP, decode, publish) -> tester.
+The gateway runs as its own process (as deployed) against virtual ECUs (see _virtual_ecu) that answer
+every configured service after --ecu-delay ms, a local broker (e.g. mosquitto) is needed.
+Prints a JSON report (or writes it to --report) with throughput, latency percentiles per request and
+gateway memory, so runs can be compared.
+
+usage: python3 loadtest.py [--broker 127.0.0.1:1883] [--concurrency 8] [--duration 30] [--mix mix.json]
+                           [--ecu-delay 10] [--report report.json] [ecu ...]
+mix.json: [["disp", "ReadDataByIdentifier", "ReadOdometerValueFromBus", 5], ...] (ecu, service, parameter, weight)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import paho.mqtt.client as mqtt
+
+import client
+import gateway
+import _catalog
+import _uds_helper
+import _session
+import _isotp_pool
+import _virtual_ecu
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SESSION_TIMING = b"\x00\x32\x01\xf4" # P2 50 ms, P2* 5 s
+
+
+def _response(catalog, request):
+    """ positive response to a request of the catalog, data sized like the catalog says """
+    sid = request[0]
+    if sid == 0x10:
+        return b"\x50" + request[1:2] + SESSION_TIMING
+    length = catalog.lengths.get((sid + 0x40, bytes(request[1:3])), 4)
+    return bytes([sid + 0x40]) + request[1:] + bytes(range(1, length + 1))
+
+
+def synthesize(config, names, path, delay, config_path=gateway.CONFIG):
+    """ recording in which every ECU answers each of its services after delay seconds, with the catalog of the config """
+    catalogs = _catalog.Catalogs(gateway.locate_catalog(config, config_path)) if config.get("catalog") else _uds_helper.CATALOGS
+    recorder = _virtual_ecu.Recorder(path)
+    for name in names:
+        ecu = config["ecus"][name]
+        catalog = catalogs.get(ecu.get("catalog", name))
+        txid, rxid = _isotp_pool._to_int(ecu["txid"]), _isotp_pool._to_int(ecu["rxid"])
+        services = set(tuple(element) for element in ecu["services"])
+        services.update((_session.SESSION_CONTROL, session) for session in catalog.sessions.values())
+        for service, parameter in sorted(services):
+            request = catalog.encode(service, parameter)
+            recorder.write(txid, rxid, _virtual_ecu.REQUEST, request, 0.0)
+            recorder.write(txid, rxid, _virtual_ecu.RESPONSE, _response(catalog, request), delay)
+    recorder.close()
+
+
+def request_mix(config, names, path=None):
+    """ list of (ecu, service, parameter, weight), every exposed service once by default """
+    if path:
+        with open(path) as mix_file:
+            return [tuple(entry) for entry in json.load(mix_file)]
+    return [(name, service, parameter, 1) for name in names for service, parameter in config["ecus"][name]["services"]]
+
+
+def percentiles(samples):
+    """ latency statistics in ms of a list of seconds """
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+    return {"count": len(samples), "mean": round(sum(samples) / len(samples) * 1000, 3),
+            "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(samples[-1] * 1000, 3)}
+
+
+def memory(pid):
+    """ resident and peak resident memory (kB) of a process """
+    result = {}
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith(("VmRSS", "VmHWM")):
+                key, value = line.split(":")
+                result[key] = int(value.split()[0])
+    return result
+
+
+class Tester(object):
+    """ closed loop: concurrency requests are outstanding at any time, each response triggers the next request """
+
+    def __init__(self, host, port, service, mix, timeout):
+        self.service = service
+        self.mix = mix
+        self.weights = [entry[3] for entry in mix]
+        self.timeout = timeout
+        self.run_id = "{:x}".format(random.getrandbits(32))
+        self.outstanding = {} # response topic -> (start, key)
+        self.samples = {} # "ecu/service/parameter" -> [latency]
+        self.errors = {}
+        self.timeouts = 0
+        self.running = False
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._first = threading.Event()
+        self.client = mqtt.Client("loadtest-" + self.run_id, clean_session=True)
+        self.client.on_message = self.on_message
+        self.client.connect(host, port, 60)
+        self.client.subscribe("loadtest/{}/#".format(self.run_id), 1)
+        self.client.loop_start()
+
+    def send(self):
+        ecu, service, parameter, _ = random.choices(self.mix, self.weights)[0]
+        with self._lock:
+            self._sequence += 1
+            response = "loadtest/{}/{}".format(self.run_id, self._sequence)
+            self.outstanding[response] = (time.perf_counter(), "/".join((ecu, service, parameter)))
+        topic = "/".join((client.HOSTNAME, self.service, ecu, service, parameter))
+        self.client.publish(topic, json.dumps({"response": response}), 1)
+
+    def on_message(self, mqtt_client, userdata, msg):
+        result = json.loads(msg.payload.decode("utf-8"))
+        if isinstance(result, dict) and result.get("type") == "info":
+            return # response pending, the final response follows
+        with self._lock:
+            started = self.outstanding.pop(msg.topic, None)
+            if started is None:
+                return # timed out before
+            latency = time.perf_counter() - started[0]
+            if not isinstance(result, dict) or result.get("type") == "error" or result.get("SID") == "7f":
+                self.errors[started[1]] = self.errors.get(started[1], 0) + 1
+            else:
+                self.samples.setdefault(started[1], []).append(latency)
+        self._first.set()
+        if self.running:
+            self.send()
+
+    def wait_ready(self, timeout=30):
+        """ send single requests until the gateway answers """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.send()
+            if self._first.wait(1.0):
+                return True
+        return False
+
+    def run(self, concurrency, duration, requests=None):
+        with self._lock:
+            self.outstanding.clear()
+            self.samples.clear()
+            self.errors.clear()
+            self.timeouts = 0
+        self.running = True
+        started = time.perf_counter()
+        for _ in range(concurrency):
+            self.send()
+        while time.perf_counter() - started < duration:
+            time.sleep(0.1)
+            now = time.perf_counter()
+            with self._lock:
+                expired = [topic for topic, (start, _) in self.outstanding.items() if now - start > self.timeout]
+                for topic in expired:
+                    del self.outstanding[topic]
+                self.timeouts += len(expired)
+            for _ in expired:
+                self.send()
+            if requests and sum(len(samples) for samples in self.samples.values()) >= requests:
+                break
+        self.running = False
+        return time.perf_counter() - started
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="load test of the gateway request path")
+    parser.add_argument("--config", default=gateway.CONFIG)
+    parser.add_argument("--broker", default="127.0.0.1:1883", help="host:port of a local broker")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests outstanding at any time")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--requests", type=int, help="stop after this many responses")
+    parser.add_argument("--mix", help="json file with [ecu, service, parameter, weight] entries")
+    parser.add_argument("--ecu-delay", type=float, default=10, help="response time of the virtual ECUs in ms")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds until a request counts as lost")
+    parser.add_argument("--cache", action="store_true", help="keep the gateway response cache enabled")
+    parser.add_argument("--report", help="write the report to this file instead of stdout")
+    parser.add_argument("ecus", nargs="*", help="ECUs to load, defaults to all in the config")
+    args = parser.parse_args(argv)
+
+    config = gateway.load_config(args.config)
+    names = args.ecus or list(config["ecus"])
+    host, port = args.broker.rsplit(":", 1)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    recording = os.path.join(workdir, "ecus.rec")
+    synthesize(config, names, recording, args.ecu_delay / 1000, args.config)
+    run_config = dict(config, interface=_virtual_ecu.INTERFACE, replay=recording, replay_speed=1.0, manifest=False,
+                      broker={"host": host, "port": int(port)}, outbox=os.path.join(workdir, "outbox"))
+    if config.get("catalog"):
+        run_config["catalog"] = gateway.locate_catalog(config, args.config) # the run config is written to workdir
+    run_config.pop("influx", None)
+    run_config.pop("record", None)
+    if not args.cache:
+        run_config["ecus"] = dict((name, dict(ecu, cache_entries=0)) for name, ecu in config["ecus"].items())
+    config_path = os.path.join(workdir, "gateway.json")
+    gateway.save_config(run_config, config_path)
+
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "gateway.py"), "--config", config_path] + names,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    tester = Tester(host, int(port), config.get("service", gateway.SERVICE), request_mix(config, names, args.mix), args.timeout)
+    try:
+        if not tester.wait_ready():
+            raise SystemExit("gateway did not answer, is the broker running on {}?".format(args.broker))
+        idle = memory(process.pid)
+        peak = dict(idle)
+        stop = threading.Event()
+
+        def sample_memory():
+            while not stop.wait(0.5):
+                current = memory(process.pid)
+                peak["VmRSS"] = max(peak["VmRSS"], current["VmRSS"])
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+        duration = tester.run(args.concurrency, args.duration, args.requests)
+        stop.set()
+        sampler.join()
+    finally:
+        tester.close()
+        process.terminate()
+        process.wait(10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    completed = sum(len(samples) for samples in tester.samples.values())
+    report = {
+        "timestamp": time.time(),
+        "settings": {"concurrency": args.concurrency, "ecu_delay_ms": args.ecu_delay, "cache": args.cache, "ecus": names, "mix": args.mix},
+        "duration_s": round(duration, 3),
+        "completed": completed,
+        "errors": sum(tester.errors.values()),
+        "timeouts": tester.timeouts,
+        "throughput_rps": round(completed / duration, 2),
+        "latency_ms": percentiles([latency for samples in tester.samples.values() for latency in samples]),
+        "requests": dict((key, dict(percentiles(tester.samples.get(key, [])), errors=tester.errors.get(key, 0)))
+                         for key in sorted(set(tester.samples) | set(tester.errors))),
+        "gateway_memory_kb": {"idle": idle["VmRSS"], "peak": peak["VmRSS"],
+                              "per_inflight": round((peak["VmRSS"] - idle["VmRSS"]) / args.concurrency, 1)},
+    }
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as report_file:
+            report_file.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+ODX import: services of a base variant and the ECU variant inheriting them, linear and text table
+conversions, request parameters, the same file packed as PDX archive.
+
+usage: python3 odx_test.py
+"""
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import _odx
+import _catalog
+
+
+UINT8 = '<DIAG-CODED-TYPE xsi:type="STANDARD-LENGTH-TYPE" BASE-DATA-TYPE="A_UINT32"><BIT-LENGTH>8</BIT-LENGTH></DIAG-CODED-TYPE>'
+UINT16 = UINT8.replace(">8<", ">16<")
+
+
+def _const(name, position, value, coded=UINT8):
+    return ('<PARAM xsi:type="CODED-CONST"><SHORT-NAME>{}</SHORT-NAME><BYTE-POSITION>{}</BYTE-POSITION>'
+            '<CODED-VALUE>{}</CODED-VALUE>{}</PARAM>').format(name, position, value, coded)
+
+
+def _value(name, position, dop, default=""):
+    return ('<PARAM xsi:type="VALUE"><SHORT-NAME>{}</SHORT-NAME><BYTE-POSITION>{}</BYTE-POSITION>{}'
+            '<DOP-REF ID-REF="{}"/></PARAM>').format(name, position, default, dop)
+
+
+ODX = """<?xml version="1.0" encoding="UTF-8"?>
+<ODX xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" MODEL-VERSION="2.2.0">
+ <DIAG-LAYER-CONTAINER ID="DLC"><SHORT-NAME>DLC</SHORT-NAME>
+  <BASE-VARIANTS><BASE-VARIANT ID="BV_bcm"><SHORT-NAME>bcm</SHORT-NAME>
+   <DIAG-DATA-DICTIONARY-SPEC>
+    <DATA-OBJECT-PROPS>
+     <DATA-OBJECT-PROP ID="DOP_temp"><SHORT-NAME>Temp</SHORT-NAME>
+      <COMPU-METHOD><CATEGORY>LINEAR</CATEGORY><COMPU-INTERNAL-TO-PHYS><COMPU-SCALES><COMPU-SCALE><COMPU-RATIONAL-COEFFS>
+       <COMPU-NUMERATOR><V>-40</V><V>0.5</V></COMPU-NUMERATOR><COMPU-DENOMINATOR><V>1</V></COMPU-DENOMINATOR>
+      </COMPU-RATIONAL-COEFFS></COMPU-SCALE></COMPU-SCALES></COMPU-INTERNAL-TO-PHYS></COMPU-METHOD>
+      {uint8}<UNIT-REF ID-REF="U_C"/>
+     </DATA-OBJECT-PROP>
+     <DATA-OBJECT-PROP ID="DOP_state"><SHORT-NAME>State</SHORT-NAME>
+      <COMPU-METHOD><CATEGORY>TEXTTABLE</CATEGORY><COMPU-INTERNAL-TO-PHYS><COMPU-SCALES>
+       <COMPU-SCALE><LOWER-LIMIT>0</LOWER-LIMIT><UPPER-LIMIT>0</UPPER-LIMIT><COMPU-CONST><VT>closed</VT></COMPU-CONST></COMPU-SCALE>
+       <COMPU-SCALE><LOWER-LIMIT>1</LOWER-LIMIT><UPPER-LIMIT>1</UPPER-LIMIT><COMPU-CONST><VT>open</VT></COMPU-CONST></COMPU-SCALE>
+       <COMPU-SCALE><LOWER-LIMIT>2</LOWER-LIMIT><UPPER-LIMIT>9</UPPER-LIMIT><COMPU-CONST><VT>range</VT></COMPU-CONST></COMPU-SCALE>
+      </COMPU-SCALES></COMPU-INTERNAL-TO-PHYS></COMPU-METHOD>
+      {uint8}
+     </DATA-OBJECT-PROP>
+     <DATA-OBJECT-PROP ID="DOP_pct"><SHORT-NAME>Pct</SHORT-NAME><COMPU-METHOD><CATEGORY>IDENTICAL</CATEGORY></COMPU-METHOD>{uint8}</DATA-OBJECT-PROP>
+    </DATA-OBJECT-PROPS>
+    <UNIT-SPEC><UNITS><UNIT ID="U_C"><SHORT-NAME>degC</SHORT-NAME><DISPLAY-NAME>°C</DISPLAY-NAME></UNIT></UNITS></UNIT-SPEC>
+   </DIAG-DATA-DICTIONARY-SPEC>
+   <DIAG-COMMS>
+    <DIAG-SERVICE ID="DS_temp"><SHORT-NAME>ReadCabinTemperature</SHORT-NAME><LONG-NAME>Cabin temperature</LONG-NAME>
+     <REQUEST-REF ID-REF="RQ_temp"/><POS-RESPONSE-REFS><POS-RESPONSE-REF ID-REF="PR_temp"/></POS-RESPONSE-REFS></DIAG-SERVICE>
+    <DIAG-SERVICE ID="DS_dim"><SHORT-NAME>SetDimming</SHORT-NAME>
+     <REQUEST-REF ID-REF="RQ_dim"/><POS-RESPONSE-REFS><POS-RESPONSE-REF ID-REF="PR_dim"/></POS-RESPONSE-REFS></DIAG-SERVICE>
+    <DIAG-SERVICE ID="DS_broken"><SHORT-NAME>Broken</SHORT-NAME><REQUEST-REF ID-REF="RQ_missing"/></DIAG-SERVICE>
+   </DIAG-COMMS>
+   <REQUESTS>
+    <REQUEST ID="RQ_temp"><SHORT-NAME>RQ_temp</SHORT-NAME><PARAMS>{rq_temp}</PARAMS></REQUEST>
+    <REQUEST ID="RQ_dim"><SHORT-NAME>RQ_dim</SHORT-NAME><PARAMS>{rq_dim}</PARAMS></REQUEST>
+   </REQUESTS>
+   <POS-RESPONSES>
+    <POS-RESPONSE ID="PR_temp"><SHORT-NAME>PR_temp</SHORT-NAME><PARAMS>{pr_temp}</PARAMS></POS-RESPONSE>
+    <POS-RESPONSE ID="PR_dim"><SHORT-NAME>PR_dim</SHORT-NAME><PARAMS>{pr_dim}</PARAMS></POS-RESPONSE>
+   </POS-RESPONSES>
+  </BASE-VARIANT></BASE-VARIANTS>
+  <ECU-VARIANTS><ECU-VARIANT ID="EV_bcm2"><SHORT-NAME>bcm v2</SHORT-NAME><PARENT-REFS><PARENT-REF ID-REF="BV_bcm"/></PARENT-REFS>
+  </ECU-VARIANT></ECU-VARIANTS>
+ </DIAG-LAYER-CONTAINER>
+</ODX>
+""".format(
+    uint8=UINT8,
+    rq_temp=_const("SID", 0, "34") + _const("DID", 1, "0x4A10", UINT16),
+    rq_dim=_const("SID", 0, "47") + _const("DID", 1, "53249", UINT16) + _const("CP", 3, "3")
+    + _value("level", 4, "DOP_pct", "<PHYSICAL-DEFAULT-VALUE>50</PHYSICAL-DEFAULT-VALUE>"),
+    pr_temp=_const("SID", 0, "98") + _value("temp", 3, "DOP_temp") + _value("door", 4, "DOP_state"),
+    pr_dim=_const("SID", 0, "111") + _value("level", 4, "DOP_pct"))
+
+
+class OdxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "bcm.odx")
+        with open(self.path, "w", encoding="utf-8") as odx_file:
+            odx_file.write(ODX)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_services(self):
+        sections = _odx.read(self.path, {0x22: "ReadDataByIdentifier"})
+        self.assertEqual(sorted(sections), ["bcm", "bcm v2"])
+        self.assertEqual(sections["bcm v2"], sections["bcm"]) # inherited from the base variant
+        services = sections["bcm"]
+        self.assertEqual(sorted(services), ["InputOutputControlByIdentifier", "ReadDataByIdentifier"])
+        temperature = services["ReadDataByIdentifier"]["ReadCabinTemperature"]
+        self.assertEqual((temperature["ID"], temperature["description"], temperature["response"]["length"]), ("4A10", "Cabin temperature", 2))
+        self.assertEqual(temperature["response"]["decode"]["fields"], [
+            {"encoding": "uint", "scale": 0.5, "offset": -40, "unit": "°C", "start": 0, "length": 1},
+            {"enum": {"00": "closed", "01": "open"}, "start": 1, "length": 1}]) # the range is left out
+        dimming = services["InputOutputControlByIdentifier"]["SetDimming"]
+        self.assertEqual(dimming["ID"], "D00103")
+        self.assertEqual(dimming["parameters"], {"level": {"encoding": "uint", "type": "integer", "length": 1, "bit": "20", "default": "50"}})
+
+    def test_compiles(self):
+        catalog = _catalog.Catalog(_catalog.expand(_odx.read(self.path)["bcm v2"]))
+        self.assertEqual(catalog.encode("InputOutputControlByIdentifier", "SetDimming", {"level": "80"}), bytes.fromhex("2FD0010350"))
+        self.assertEqual(catalog.encode("ReadDataByIdentifier", "ReadCabinTemperature"), bytes.fromhex("224A10"))
+        self.assertEqual(catalog.lookup(bytes.fromhex("624A105001"))[1:], ("ReadCabinTemperature Response", 3))
+        self.assertEqual(catalog.decode("ReadDataByIdentifier Positive Response", "ReadCabinTemperature Response", "5001"), "0.0°C, open")
+
+    def test_pdx(self):
+        path = os.path.join(self.directory, "bcm.pdx")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.write(self.path, "bcm.odx-d")
+            archive.writestr("index.xml", "<CATALOG/>")
+        self.assertEqual(_odx.read(path), _odx.read(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Store and forward of publishes made while offline: Outbox on its own, and Client replaying it against
+a stub of the paho client (connection state, message ids, acknowledgements).
+
+usage: python3 outbox_test.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import client
+import _outbox
+
+
+class _Info(object):
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = 0
+        self.published = False
+
+    def is_published(self):
+        return self.published
+
+
+class _Paho(object):
+    """ the parts of paho.mqtt.client.Client the outbox uses, acknowledgements are given by the test """
+
+    def __init__(self):
+        self.connected = False
+        self.sent = [] # (topic, payload, qos, retain, info)
+        self._mid = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self._mid += 1
+        info = _Info(self._mid)
+        self.sent.append((topic, payload, qos, retain, info))
+        return info
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "outbox.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_oldest_first_and_remove(self):
+        outbox = _outbox.Outbox(self.path)
+        for index in range(5):
+            outbox.put("t/{}".format(index), "m{}".format(index), 1, index == 0)
+        entries = outbox.oldest(3)
+        self.assertEqual([(topic, payload, retain) for _, topic, payload, _, retain in entries], [("t/0", b"m0", 1), ("t/1", b"m1", 0), ("t/2", b"m2", 0)])
+        self.assertEqual([entry[1] for entry in outbox.oldest(10, entries[-1][0])], ["t/3", "t/4"])
+        outbox.remove([entries[0][0], entries[1][0]])
+        self.assertEqual(len(outbox), 3)
+        outbox.close()
+        # kept across restarts
+        outbox = _outbox.Outbox(self.path)
+        self.assertEqual([entry[1] for entry in outbox.oldest(10)], ["t/2", "t/3", "t/4"])
+        outbox.close()
+
+    def test_oldest_dropped_when_full(self):
+        outbox = _outbox.Outbox(self.path, max_entries=3)
+        for index in range(5):
+            outbox.put("t/{}".format(index), b"", 1, False)
+        self.assertEqual((len(outbox), outbox.dropped), (3, 2))
+        self.assertEqual([entry[1] for entry in outbox.oldest(10)], ["t/2", "t/3", "t/4"])
+        outbox.close()
+
+
+class ClientReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clients = []
+
+    def tearDown(self):
+        for mqtt_client in self.clients:
+            mqtt_client.outbox.close()
+        shutil.rmtree(self.directory)
+
+    def client(self, max_stored=_outbox.MAX_ENTRIES):
+        mqtt_client = client.Client("test", outbox=os.path.join(self.directory, "outbox"), max_stored=max_stored)
+        mqtt_client.client = _Paho()
+        self.clients.append(mqtt_client)
+        return mqtt_client
+
+    def connect(self, mqtt_client):
+        mqtt_client.client.connected = True
+        mqtt_client.on_connect(mqtt_client.client, None, {}, 0)
+
+    def acknowledge(self, mqtt_client, count):
+        """ PUBACK for the oldest count unacknowledged messages """
+        for _, _, _, _, info in [sent for sent in mqtt_client.client.sent if not sent[4].published][:count]:
+            info.published = True
+            mqtt_client.on_publish(mqtt_client.client, None, info.mid)
+
+    def test_replay_in_order_with_inflight_cap(self):
+        mqtt_client = self.client()
+        for index in range(client.MAX_INFLIGHT + 10):
+            mqtt_client.publish("t/{}".format(index), "m{}".format(index), 0)
+        self.assertEqual(mqtt_client.client.sent, [])
+        self.assertEqual(len(mqtt_client.outbox), client.MAX_INFLIGHT + 10)
+        self.connect(mqtt_client)
+        self.assertEqual(len(mqtt_client.client.sent), client.MAX_INFLIGHT)
+        # published while older ones still wait: goes behind them
+        mqtt_client.publish("t/new", "new", 1)
+        self.assertEqual(len(mqtt_client.client.sent), client.MAX_INFLIGHT)
+        self.acknowledge(mqtt_client, 5)
+        self.assertEqual(len(mqtt_client.client.sent), client.MAX_INFLIGHT + 5)
+        while len(mqtt_client.outbox):
+            self.acknowledge(mqtt_client, client.MAX_INFLIGHT)
+        topics = [topic for topic, _, _, _, _ in mqtt_client.client.sent]
+        self.assertEqual(topics, ["t/{}".format(index) for index in range(client.MAX_INFLIGHT + 10)] + ["t/new"])
+        self.assertEqual(set(qos for _, _, qos, _, _ in mqtt_client.client.sent), {1}) # stored ones are sent with QoS 1
+        # nothing waits anymore, publishes go out directly
+        mqtt_client.publish("t/direct", "direct", 1)
+        self.assertEqual(mqtt_client.client.sent[-1][0], "t/direct")
+        self.assertEqual(len(mqtt_client.outbox), 0)
+
+    def test_unacknowledged_sent_again_after_reconnect(self):
+        mqtt_client = self.client()
+        for index in range(3):
+            mqtt_client.publish("t/{}".format(index), "m", 1)
+        self.connect(mqtt_client)
+        self.acknowledge(mqtt_client, 1)
+        mqtt_client.client.connected = False
+        mqtt_client.on_disconnect(mqtt_client.client, None, 1)
+        self.connect(mqtt_client)
+        self.assertEqual([topic for topic, _, _, _, _ in mqtt_client.client.sent], ["t/0", "t/1", "t/2", "t/1", "t/2"])
+        self.acknowledge(mqtt_client, 4)
+        self.assertEqual(len(mqtt_client.outbox), 0)
+
+    def test_max_stored(self):
+        mqtt_client = self.client(max_stored=5)
+        for index in range(8):
+            mqtt_client.publish("t/{}".format(index), "m", 1)
+        self.assertEqual(mqtt_client.outbox.dropped, 3)
+        self.connect(mqtt_client)
+        self.assertEqual([topic for topic, _, _, _, _ in mqtt_client.client.sent], ["t/{}".format(index) for index in range(3, 8)])
+
+
+if __name__ == "__main__":
+    unittest.main()
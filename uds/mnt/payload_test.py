@@ -0,0 +1,69 @@
+"""
+Binary payload formats: the built in CBOR encoder byte for byte against cbor2 (if installed), bignums,
+typed interpretations and values a format cannot carry.
+
+usage: python3 payload_test.py
+"""
+
+import json
+import unittest
+from collections import OrderedDict
+
+import _payload
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+VALUES = [
+    0, 23, 24, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1, 2**64, 2**100,
+    -1, -24, -25, -256, -257, -2**64, -2**64 - 1, -2**100,
+    0.0, 1.6, -273.15, 1e300,
+    "", "a", "Read Odometer Response", "x" * 300, "°C",
+    b"", b"\x00\x01", bytes(range(256)),
+    [], [1, "a", b"b"], list(range(30)),
+    {}, {"type": "uds", "data": b"\x00\x00\x10", "results": {"a": [None, True, False]}},
+    True, False, None,
+]
+
+RESPONSE = {"type": "uds", "SID": "62", "service": "Read Data By Identifier Positive Response", "PID": "010c",
+            "parameter": "Read Odometer Response", "data": "000010", "description": None,
+            "interpretation": _payload.Interpretation(1.6), "unit": "km"}
+
+
+class PayloadTest(unittest.TestCase):
+    @unittest.skipUnless(cbor2, "cbor2 is not installed")
+    def test_cbor_same_as_cbor2(self):
+        for value in VALUES:
+            self.assertEqual(_payload.cbor_dumps(value), cbor2.dumps(value), repr(value)[:60])
+            self.assertEqual(cbor2.loads(_payload.cbor_dumps(value)), value)
+        self.assertEqual(_payload.cbor_dumps(OrderedDict([("b", 1), ("a", (2, 3))])), cbor2.dumps({"b": 1, "a": [2, 3]}))
+
+    def test_cbor_round_trip(self):
+        for value in VALUES:
+            self.assertEqual(_payload.cbor_loads(_payload.cbor_dumps(value)), value, repr(value)[:60])
+
+    def test_typed_interpretation(self):
+        self.assertEqual(json.loads(_payload.encode(RESPONSE))["interpretation"], "1.6") # JSON as before
+        compact = _payload.decode(_payload.encode(RESPONSE, _payload.CBOR), _payload.CBOR)
+        self.assertEqual(compact, {"type": "uds", "SID": b"\x62", "service": "Read Data By Identifier Positive Response", "PID": b"\x01\x0c",
+                                   "parameter": "Read Odometer Response", "data": b"\x00\x00\x10", "interpretation": 1.6, "unit": "km"})
+        batch = _payload.decode(_payload.encode({"type": "batch", "results": {"odometer": RESPONSE}}, _payload.CBOR), _payload.CBOR)
+        self.assertEqual(batch["results"]["odometer"], compact)
+
+    @unittest.skipUnless(_payload.MSGPACK in _payload.FORMATS, "msgpack is not installed")
+    def test_msgpack(self):
+        compact = _payload.decode(_payload.encode(RESPONSE, _payload.MSGPACK), _payload.MSGPACK)
+        self.assertEqual(compact["interpretation"], 1.6)
+        with self.assertRaises(ValueError):
+            _payload.encode({"interpretation": 2**64}, _payload.MSGPACK)
+
+    def test_not_encodable(self):
+        with self.assertRaises(TypeError):
+            _payload.encode({"value": object()}, _payload.CBOR)
+
+
+if __name__ == "__main__":
+    unittest.main()
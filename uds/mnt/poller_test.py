@@ -0,0 +1,92 @@
+"""
+Poller with stub ECUs: one batched read per ECU for all due subscriptions, skipped deadlines of slow reads,
+failed publishes and removed subscriptions.
+
+usage: python3 poller_test.py
+"""
+
+import json
+import asyncio
+import unittest
+
+import _poller
+
+
+class _Ecu(object):
+    catalog = None
+
+    def __init__(self, name, parameters, delay=0.0):
+        self.name = name
+        self.exposed = set(("ReadDataByIdentifier", parameter) for parameter in parameters)
+        self.delay = delay
+        self.reads = []
+
+    async def read(self, client, response, parameters, use_cache=True):
+        self.reads.append(parameters)
+        await asyncio.sleep(self.delay)
+        return {"type": "batch", "results": dict((parameter, {"type": "uds", "data": "00"}) for parameter in parameters)}
+
+
+class _Client(object):
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("broker gone")
+        self.published.append((topic, json.loads(payload)))
+
+
+class PollerTest(unittest.TestCase):
+    def poll(self, poller, seconds, setup):
+        async def run():
+            task = asyncio.ensure_future(poller.run())
+            result = setup()
+            await asyncio.sleep(seconds)
+            task.cancel()
+            return result
+        return asyncio.run(run())
+
+    def test_batched_per_ecu(self):
+        ecu = _Ecu("ptcm", ["odometer", "states"])
+        client = _Client()
+        poller = _poller.Poller([ecu], client)
+        self.poll(poller, 0.12, lambda: (poller.add("ptcm", "odometer", 0.1, "a"), poller.add("ptcm", "states", 0.1, "b")))
+        self.assertEqual(ecu.reads, [["odometer", "states"]] * 2)
+        self.assertEqual(sorted(topic for topic, _ in client.published), ["a", "a", "b", "b"])
+        self.assertEqual(client.published[0][1]["subscription"], 1)
+
+    def test_slow_reads_skip_deadlines(self):
+        ecu = _Ecu("ptcm", ["odometer"], delay=0.25)
+        client = _Client(failures=1)
+        poller = _poller.Poller([ecu], client)
+        # reads start at 0, 0.3, 0.6 and 0.9 s (next deadline after the previous read), three of them are done
+        subscription = self.poll(poller, 0.95, lambda: poller.add("ptcm", "odometer", 0.1, "a"))
+        stats = subscription.stats()
+        self.assertEqual(len(ecu.reads), 4)
+        self.assertEqual(len(client.published), 2) # the first publish failed, polling went on
+        self.assertGreater(stats["missed"], 0)
+        self.assertLess(stats["jitter_max_ms"], 100) # measured against the deadline served, not the skipped ones
+
+    def test_add_and_remove(self):
+        ecu = _Ecu("ptcm", ["odometer"])
+        poller = _poller.Poller([ecu], _Client())
+
+        async def run():
+            with self.assertRaises(ValueError):
+                poller.add("disp", "odometer", 1, "a")
+            with self.assertRaises(ValueError):
+                poller.add("ptcm", "serial", 1, "a")
+            with self.assertRaises(ValueError):
+                poller.add("ptcm", "odometer", 1, "a", "xml")
+            subscription = poller.add("ptcm", "odometer", 0, "a")
+            self.assertEqual(subscription.period, _poller.MIN_PERIOD)
+            self.assertTrue(poller.remove(subscription.id))
+            self.assertFalse(poller.remove(subscription.id))
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
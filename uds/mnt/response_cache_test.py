@@ -0,0 +1,80 @@
+"""
+ResponseCache: time to live, LRU eviction, coalesced requests and their "response pending" notices.
+
+usage: python3 response_cache_test.py
+"""
+
+import time
+import asyncio
+import unittest
+
+import _response_cache
+
+
+POSITIVE = {"type": "uds", "SID": "62", "data": "000010"}
+NEGATIVE = {"type": "uds", "SID": "7f", "data": ""}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = _response_cache.ResponseCache(max_entries=2)
+        self.requests = 0
+
+    def fetch(self, key, ttl, response=POSITIVE):
+        async def request(pending):
+            self.requests += 1
+            return response
+        return asyncio.run(self.cache.fetch(key, ttl, request))
+
+    def test_ttl(self):
+        self.fetch("odometer", 0.05)
+        self.assertIs(self.fetch("odometer", 0.05), POSITIVE)
+        self.assertEqual(self.requests, 1)
+        time.sleep(0.06)
+        self.fetch("odometer", 0.05)
+        self.assertEqual(self.requests, 2)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_uncached(self):
+        self.fetch("odometer", 0)
+        self.fetch("odometer", 0)
+        self.fetch("session", 10, NEGATIVE)
+        self.fetch("session", 10, NEGATIVE)
+        self.assertEqual(self.requests, 4)
+        stats = self.cache.stats()
+        # lookups without a time to live are neither hits nor misses
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (0, 0, 2))
+
+    def test_least_recently_used_evicted(self):
+        for key in ("a", "b", "a", "c"):
+            self.fetch(key, 10)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.cache.invalidate(["a"])
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_coalesced_requests_get_pending_notices(self):
+        notices = {"first": [], "second": [], "late": []}
+
+        async def request(pending):
+            self.requests += 1
+            await asyncio.sleep(0.01)
+            pending(b"\x7f\x22\x78")
+            await asyncio.sleep(0.02)
+            return POSITIVE
+
+        async def caller(name, delay=0):
+            await asyncio.sleep(delay)
+            return await self.cache.fetch("odometer", 0, request, notices[name].append)
+
+        async def run():
+            return await asyncio.gather(caller("first"), caller("second"), caller("late", 0.02))
+
+        self.assertEqual(asyncio.run(run()), [POSITIVE] * 3)
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(self.cache.stats()["coalesced"], 2)
+        self.assertEqual(notices, {"first": [b"\x7f\x22\x78"], "second": [b"\x7f\x22\x78"], "late": [b"\x7f\x22\x78"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
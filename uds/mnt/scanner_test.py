@@ -0,0 +1,51 @@
+"""
+Address discovery: which CAN frames count as answers to the TesterPresent probe, merging found ECUs into a config.
+
+usage: python3 scanner_test.py
+"""
+
+import socket
+import unittest
+
+import _scanner
+
+
+def _data(hex_string):
+    data = bytes.fromhex(hex_string)
+    return data + bytes([_scanner.PADDING]) * (8 - len(data))
+
+
+class ScannerTest(unittest.TestCase):
+    def test_answers(self):
+        self.assertTrue(_scanner._answers(0x5BB, 8, _data("027E00")))
+        self.assertTrue(_scanner._answers(0x5BB, 8, _data("037F3E11"))) # negative response is an ECU as well
+        self.assertTrue(_scanner._answers(0x5BB, 4, _data("037F3E11")))
+
+    def test_other_traffic(self):
+        for can_id, dlc, data in [
+                (0x63B, 8, _data("023E00")), # TesterPresent request of another tester
+                (0x5BB, 8, _data("027E80")), # wrong sub-function
+                (0x5BB, 8, _data("037F2231")), # negative response to another service
+                (0x5BB, 8, _data("037E0000")), # wrong length
+                (0x5BB, 8, _data("10147E00")), # first frame
+                (0x5BB, 8, _data("217E00")), # consecutive frame
+                (0x5BB, 2, _data("027E00")), # frame shorter than its length
+                (0x5BB | socket.CAN_ERR_FLAG, 8, _data("027E00")),
+                (0x18DAF100 | socket.CAN_EFF_FLAG, 8, _data("027E00")),
+                (0x5BB | socket.CAN_RTR_FLAG, 8, _data("027E00"))]:
+            self.assertFalse(_scanner._answers(can_id, dlc, data), (hex(can_id), dlc, data.hex()))
+
+    def test_merge(self):
+        config = {"ecus": {"disp": {"txid": "063B", "rxid": "05BB", "services": []}}}
+        found = [{"txid": 0x63B, "rxid": 0x5BB, "identification": {"ElectroniControlUnitSerialNumber": "3132", "VehicleIdentificationNumberOriginal": None}},
+                 {"txid": 0x100, "rxid": 0x180, "identification": {"ElectroniControlUnitSerialNumber": None, "VehicleIdentificationNumberOriginal": "WVW"}}]
+        self.assertEqual(_scanner.merge(config, found), ["ecu_100"])
+        self.assertEqual(config["ecus"]["disp"]["identification"], {"ElectroniControlUnitSerialNumber": "3132"})
+        self.assertEqual(config["ecus"]["disp"]["services"], []) # known ECUs keep their services
+        added = config["ecus"]["ecu_100"]
+        self.assertEqual((added["txid"], added["rxid"]), ("0100", "0180"))
+        self.assertEqual(added["services"], [["TesterPresent", "Request"], ["ReadDataByIdentifier", "VehicleIdentificationNumberOriginal"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
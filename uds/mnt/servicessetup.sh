@@ -1,3 +1,3 @@
-python3.7 /mnt/ptcm.py &
+python3.7 /mnt/gateway.py &
 
-sleep infinity
\ No newline at end of file
+sleep infinity
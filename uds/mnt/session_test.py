@@ -0,0 +1,93 @@
+"""
+SessionState with a stub transport: switching only when the session changes, S3 timeout, TesterPresent
+and falling back to the default session.
+
+usage: python3 session_test.py
+"""
+
+import time
+import asyncio
+import unittest
+
+import _catalog
+import _session
+
+
+SERVICES = {
+    "DiagnosticSessionControl": {"ID": "10", "Default": {"ID": "01"}, "Extended": {"ID": "03"}},
+    "TesterPresent": {"ID": "3E", "SuppressResponse": {"ID": "80"}},
+    "InputOutputControlByIdentifier": {"ID": "2F", "session": "Extended", "OpenTrunk": {"ID": "D00103"}},
+    "ReadDataByIdentifier": {"ID": "22", "Odometer": {"ID": "010C"}},
+}
+
+
+class _Transport(object):
+    """ answers DiagnosticSessionControl like an ECU, or with the given response """
+
+    def __init__(self, session, response=None):
+        self.session = session
+        self.response = response
+        self.sent = []
+
+    async def execute(self, service, parameter, message={}):
+        payload = self.session.catalog.encode(service, parameter)
+        response = self.response or bytes([payload[0] + 0x40]) + payload[1:2] + bytes.fromhex("003201F4")
+        self.sent.append(payload)
+        self.session.observe(payload, response)
+        return {"type": "uds", "SID": response[:1].hex()}
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+
+class SessionStateTest(unittest.TestCase):
+    def setUp(self):
+        self.session = _session.SessionState(_catalog.Catalog(_catalog.expand(SERVICES)), s3=0.2, interval=0.05)
+        self.transport = _Transport(self.session)
+
+    def enter(self, service):
+        return asyncio.run(self.session.enter(self.transport, service))
+
+    def test_switch_only_on_change(self):
+        self.assertIsNone(self.enter("ReadDataByIdentifier"))
+        self.assertIsNone(self.enter("InputOutputControlByIdentifier"))
+        self.assertIsNone(self.enter("InputOutputControlByIdentifier"))
+        self.assertEqual(self.transport.sent, [bytes.fromhex("1003")])
+        self.assertEqual(self.session.stats(), {"session": "Extended", "switches": 1})
+
+    def test_s3_timeout(self):
+        self.enter("InputOutputControlByIdentifier")
+        time.sleep(0.25)
+        self.assertEqual(self.session.current(), _session.DEFAULT)
+        self.enter("InputOutputControlByIdentifier")
+        self.assertEqual(self.transport.sent, [bytes.fromhex("1003")] * 2)
+
+    def test_keepalive(self):
+        self.enter("InputOutputControlByIdentifier")
+        self.assertFalse(self.session.idle())
+        for _ in range(5):
+            time.sleep(0.06) # together longer than S3
+            self.assertTrue(self.session.idle())
+            self.session.keepalive(self.transport)
+        self.assertEqual(self.session.current(), "Extended")
+        self.assertEqual(self.transport.sent[1:], [bytes.fromhex("3E80")] * 5)
+
+    def test_fallback_to_default(self):
+        self.enter("InputOutputControlByIdentifier")
+        # "service not supported in active session": the ECU left the session on its own
+        self.session.observe(bytes.fromhex("2FD00103"), bytes.fromhex("7F2F7F"))
+        self.assertEqual(self.session.current(), _session.DEFAULT)
+        self.assertFalse(self.session.idle())
+        self.enter("InputOutputControlByIdentifier")
+        self.session.observe(bytes.fromhex("1101"), bytes.fromhex("5101")) # ECUReset
+        self.assertEqual(self.session.current(), _session.DEFAULT)
+
+    def test_switch_rejected(self):
+        self.transport.response = bytes.fromhex("7F1022")
+        result = self.enter("InputOutputControlByIdentifier")
+        self.assertEqual(result, {"type": "uds", "SID": "7f"})
+        self.assertEqual(self.session.current(), _session.DEFAULT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Topic filter trie: MQTT wildcard matching, "$" topics, replacing and removing filters.
+
+usage: python3 topic_router_test.py
+"""
+
+import unittest
+
+import _topic_router
+
+
+class TopicRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = _topic_router.TopicRouter()
+        for topic_filter in ["uds/disp/ReadDataByIdentifier/Odometer", "uds/+/ReadDataByIdentifier/+", "uds/disp/#", "#", "+/+", "uds/+"]:
+            self.router.add(topic_filter, topic_filter.upper())
+
+    def matches(self, topic):
+        return sorted(topic_filter for topic_filter, _ in self.router.match(topic))
+
+    def test_match(self):
+        self.assertEqual(self.matches("uds/disp/ReadDataByIdentifier/Odometer"),
+                         ["#", "uds/+/ReadDataByIdentifier/+", "uds/disp/#", "uds/disp/ReadDataByIdentifier/Odometer"])
+        self.assertEqual(self.matches("uds/ptcm/ReadDataByIdentifier/Odometer"), ["#", "uds/+/ReadDataByIdentifier/+"])
+        self.assertEqual(self.matches("uds/disp"), ["#", "+/+", "uds/+", "uds/disp/#"]) # "#" matches the parent level as well
+        self.assertEqual(self.matches("uds"), ["#"])
+        self.assertEqual(self.matches("uds/disp/ReadDataByIdentifier"), ["#", "uds/disp/#"])
+        self.assertEqual(self.matches("uds//x"), ["#"]) # empty levels are levels
+        self.assertEqual(dict(self.router.match("uds/ptcm"))["uds/+"], "UDS/+")
+
+    def test_system_topics(self):
+        self.assertEqual(self.matches("$SYS/broker"), [])
+        self.router.add("$SYS/#", None)
+        self.assertEqual(self.router.match("$SYS/broker"), [("$SYS/#", None)])
+
+    def test_replace_and_remove(self):
+        self.assertEqual(len(self.router), 6)
+        self.router.add("uds/+", "other")
+        self.assertEqual(len(self.router), 6)
+        self.assertEqual(dict(self.router.match("uds/ptcm"))["uds/+"], "other")
+        self.router.remove("uds/disp/ReadDataByIdentifier/Odometer")
+        self.router.remove("uds/disp/ReadDataByIdentifier/Odometer") # unknown filters are ignored
+        self.router.remove("uds/unknown")
+        self.assertEqual(len(self.router), 5)
+        self.assertEqual(self.matches("uds/disp/ReadDataByIdentifier/Odometer"), ["#", "uds/+/ReadDataByIdentifier/+", "uds/disp/#"])
+        for topic_filter in ["uds/+/ReadDataByIdentifier/+", "uds/disp/#", "#", "+/+", "uds/+"]:
+            self.router.remove(topic_filter)
+        self.assertEqual(len(self.router), 0)
+        self.assertEqual(self.router._root.children, {}) # empty nodes pruned
+
+    def test_invalid_filters(self):
+        for topic_filter in ["uds/#/x", "uds/disp#", "uds/+x/y", "a+"]:
+            with self.assertRaises(ValueError):
+                self.router.add(topic_filter, None)
+        self.assertEqual(len(self.router), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+Memory transfers driven by hand (request/accept): ReadMemoryByAddress blocks, RequestUpload states, retries,
+resuming after an interruption; and AsyncUDSTransport.transfer storing the blocks off the event loop.
+
+usage: python3 transfer_test.py
+"""
+
+import io
+import asyncio
+import threading
+import unittest
+
+import _transfer
+import _uds_async
+import _virtual_ecu
+
+
+MEMORY = bytes(range(256)) * 4
+ADDRESS = 0x1000
+
+
+def _read(request):
+    """ address and size of a ReadMemoryByAddress or RequestUpload request (format after the SID and dataFormat) """
+    request = request[1:] if request[0] == 0x23 else request[2:]
+    address_bytes, size_bytes = request[0] & 0xF, request[0] >> 4
+    address = int.from_bytes(request[1:1 + address_bytes], "big") - ADDRESS
+    return address, int.from_bytes(request[1 + address_bytes:1 + address_bytes + size_bytes], "big")
+
+
+class _Sink(io.BytesIO):
+    """ file sink remembering the threads it was written from """
+
+    def __init__(self):
+        io.BytesIO.__init__(self)
+        self.threads = set()
+
+    def write(self, data):
+        self.threads.add(threading.get_ident())
+        return io.BytesIO.write(self, data)
+
+
+class MemoryReadTest(unittest.TestCase):
+    def test_blocks(self):
+        buffer = bytearray(300)
+        transfer = _transfer.MemoryRead(ADDRESS, 300, buffer, max_length=101)
+        requests = []
+        request = transfer.request()
+        while request is not None:
+            requests.append(request)
+            address, size = _read(request)
+            transfer.accept(b"\x63" + MEMORY[address:address + size])
+            request = transfer.request()
+        transfer.store()
+        self.assertEqual(bytes(buffer), MEMORY[:300])
+        self.assertEqual(requests[0], bytes.fromhex("231400001000") + b"\x64") # 4 address bytes, 1 size byte
+        self.assertEqual([_read(request) for request in requests], [(0, 100), (100, 100), (200, 100)])
+        self.assertEqual(transfer.stats()["blocks"], 3)
+
+    def test_buffer_too_small(self):
+        with self.assertRaises(ValueError):
+            _transfer.MemoryRead(ADDRESS, 300, bytearray(200), max_length=101)
+
+    def test_retries(self):
+        transfer = _transfer.MemoryRead(ADDRESS, 100, bytearray(100), max_length=101, retries=2)
+        request = transfer.request()
+        transfer.accept(None)
+        transfer.accept(None)
+        self.assertEqual(transfer.request(), request) # asked again
+        with self.assertRaises(_transfer.TransferError) as error:
+            transfer.accept(None)
+        self.assertIsNone(error.exception.response)
+        self.assertEqual(transfer.stats()["repeated"], 2)
+
+    def test_resume_into_file(self):
+        sink = io.BytesIO(MEMORY[:50])
+        transfer = _transfer.MemoryRead(ADDRESS, 200, sink, max_length=101, offset=50)
+        self.assertEqual(_read(transfer.request()), (50, 100))
+        transfer.accept(b"\x63" + MEMORY[50:150])
+        self.assertEqual(_read(transfer.request()), (150, 50))
+        with self.assertRaises(_transfer.TransferError):
+            transfer.accept(bytes.fromhex("7F2331"))
+        transfer.resume()
+        self.assertEqual(_read(transfer.request()), (150, 50)) # the block that failed
+        transfer.accept(b"\x63" + MEMORY[150:200])
+        self.assertIsNone(transfer.request())
+        transfer.store()
+        self.assertEqual(sink.getvalue(), MEMORY[:200])
+
+
+class UploadTest(unittest.TestCase):
+    def upload(self, size, max_length=1024):
+        self.buffer = bytearray(size)
+        return _transfer.Upload(ADDRESS, size, self.buffer, max_length)
+
+    def test_states(self):
+        transfer = self.upload(10)
+        self.assertEqual(transfer.request(), bytes.fromhex("350014000010000A"))
+        transfer.accept(bytes.fromhex("75200006")) # blocks of 6 - 2 data bytes
+        self.assertEqual((transfer.state, transfer.block_length), (_transfer.Upload.DATA, 4))
+        for counter, start in [(1, 0), (2, 4), (3, 8)]:
+            self.assertEqual(transfer.request(), bytes([0x36, counter]))
+            transfer.accept(bytes([0x76, counter]) + MEMORY[start:min(start + 4, 10)])
+        self.assertEqual((transfer.state, transfer.request()), (_transfer.Upload.EXIT, b"\x37"))
+        transfer.accept(b"\x77")
+        self.assertEqual(transfer.state, _transfer.Upload.DONE)
+        self.assertIsNone(transfer.request())
+        transfer.store()
+        self.assertEqual(bytes(self.buffer), MEMORY[:10])
+
+    def test_counter_wraps_to_zero(self):
+        transfer = self.upload(300)
+        transfer.request()
+        transfer.accept(bytes.fromhex("75200003")) # one data byte per block
+        counters = []
+        while transfer.state == _transfer.Upload.DATA:
+            request = transfer.request()
+            counters.append(request[1])
+            transfer.accept(bytes([0x76, request[1], 0]))
+        self.assertEqual(counters[254:257], [255, 0, 1])
+
+    def test_wrong_counter(self):
+        transfer = self.upload(10)
+        transfer.request()
+        transfer.accept(bytes.fromhex("75200006"))
+        with self.assertRaises(_transfer.TransferError):
+            transfer.accept(bytes.fromhex("760200000000"))
+
+    def test_resume_after_data(self):
+        transfer = self.upload(10)
+        transfer.request()
+        transfer.accept(bytes.fromhex("75200006"))
+        transfer.request()
+        transfer.accept(b"\x76\x01" + MEMORY[:4])
+        transfer.request()
+        with self.assertRaises(_transfer.TransferError):
+            transfer.accept(bytes.fromhex("7F3624"))
+        transfer.resume()
+        # the interrupted upload is closed first, whatever the ECU answers
+        self.assertEqual((transfer.state, transfer.request()), (_transfer.Upload.ABORT, b"\x37"))
+        transfer.accept(bytes.fromhex("7F3724"))
+        self.assertEqual(transfer.state, _transfer.Upload.START)
+        self.assertEqual(transfer.request(), bytes.fromhex("3500140000100406")) # the rest only
+        transfer.accept(bytes.fromhex("75200006"))
+        self.assertEqual(transfer.request(), b"\x36\x01") # counter starts over
+
+    def test_resume_before_exit_sent_again(self):
+        transfer = self.upload(10)
+        transfer.resume() # interrupted before any request: nothing to close
+        self.assertEqual(transfer.state, _transfer.Upload.START)
+        transfer.request()
+        transfer.accept(bytes.fromhex("75200010"))
+        transfer.request()
+        transfer.accept(b"\x76\x01" + MEMORY[:10])
+        transfer.resume() # interrupted in EXIT: RequestTransferExit again
+        self.assertEqual((transfer.state, transfer.request()), (_transfer.Upload.EXIT, b"\x37"))
+
+    def test_no_block_length(self):
+        transfer = self.upload(10)
+        transfer.request()
+        with self.assertRaises(_transfer.TransferError):
+            transfer.accept(bytes.fromhex("7500"))
+
+
+class AsyncTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.tester, self.ecu = _virtual_ecu.socket_pair()
+        self.ecu.setblocking(False)
+        self.transport = _uds_async.AsyncUDSTransport(self.tester, p2=0.1, p2_star=0.3)
+
+    def tearDown(self):
+        self.tester.close()
+        self.ecu.close()
+
+    def run_transfer(self, transfer):
+        async def ecu():
+            loop = asyncio.get_running_loop()
+            while True:
+                request = await loop.sock_recv(self.ecu, 4095)
+                address, size = _read(request)
+                self.ecu.send(b"\x63" + MEMORY[address:address + size])
+
+        async def main():
+            task = asyncio.get_running_loop().create_task(ecu())
+            try:
+                return await self.transport.transfer(transfer), threading.get_ident()
+            finally:
+                task.cancel()
+
+        return asyncio.run(main())
+
+    def test_file_written_off_the_loop(self):
+        sink = _Sink()
+        stats, loop_thread = self.run_transfer(_transfer.MemoryRead(ADDRESS, 1000, sink, max_length=101))
+        self.assertEqual((stats["transferred"], stats["blocks"]), (1000, 10))
+        self.assertEqual(sink.getvalue(), MEMORY[:1000])
+        self.assertTrue(sink.threads)
+        self.assertNotIn(loop_thread, sink.threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+AsyncUDSTransport on a socketpair, the test plays the ECU: responses, "response pending" and multi-DID reads.
+
+usage: python3 uds_async_test.py
+"""
+
+import asyncio
+import unittest
+
+import _catalog
+import _uds_async
+import _virtual_ecu
+
+
+SERVICES = {
+    "ReadDataByIdentifier": {
+        "ID": "22",
+        "Odometer": {"ID": "010C", "response": {"length": 3, "decode": {"scale": 0.1}}},
+        "Session": {"ID": "F186", "response": {"length": 1}},
+    },
+    "Negative Response": {"ID": "7F"},
+}
+
+
+class AsyncUDSTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.tester, self.ecu = _virtual_ecu.socket_pair()
+        self.ecu.setblocking(False)
+        self.pending = []
+        self.transport = _uds_async.AsyncUDSTransport(self.tester, _catalog.Catalog(_catalog.expand(SERVICES)),
+                                                      p2=0.05, p2_star=0.3, on_pending=self.pending.append)
+
+    def tearDown(self):
+        self.tester.close()
+        self.ecu.close()
+
+    def run_ecu(self, work, answers):
+        """ result of work(transport), answers: request -> [(delay, response), ...] """
+        requests = []
+
+        async def ecu():
+            loop = asyncio.get_running_loop()
+            while True:
+                request = await loop.sock_recv(self.ecu, 4095)
+                requests.append(request)
+                for delay, response in answers.get(request, []):
+                    await asyncio.sleep(delay)
+                    self.ecu.send(response)
+
+        async def main():
+            task = asyncio.get_running_loop().create_task(ecu())
+            try:
+                return await work(self.transport)
+            finally:
+                task.cancel()
+
+        return asyncio.run(main()), requests
+
+    def test_response(self):
+        result, _ = self.run_ecu(lambda transport: transport.execute("ReadDataByIdentifier", "Odometer"),
+                                 {bytes.fromhex("22010C"): [(0, bytes.fromhex("62010C000010"))]})
+        self.assertEqual((result["data"], result["interpretation"]), ("000010", "1.6"))
+
+    def test_pending_waits_p2_star(self):
+        # the final response comes later than p2, but within p2_star of the pending notice
+        answers = {bytes.fromhex("22010C"): [(0, bytes.fromhex("7F2278")), (0.15, bytes.fromhex("62010C000010"))]}
+        result, _ = self.run_ecu(lambda transport: transport.request(bytes.fromhex("22010C")), answers)
+        self.assertEqual(result, bytes.fromhex("62010C000010"))
+        self.assertEqual(self.pending, [bytes.fromhex("7F2278")])
+
+    def test_timeout(self):
+        result, _ = self.run_ecu(lambda transport: transport.request(bytes.fromhex("22010C")), {})
+        self.assertIsNone(result)
+
+    def test_multi_did_read(self):
+        answers = {bytes.fromhex("22010CF186"): [(0, bytes.fromhex("62010C000010F18603"))]}
+        (results, multi_did), requests = self.run_ecu(lambda transport: transport.read(["Odometer", "Session"]), answers)
+        self.assertTrue(multi_did)
+        self.assertEqual(requests, [bytes.fromhex("22010CF186")])
+        self.assertEqual((results["Odometer"]["data"], results["Session"]["data"]), ("000010", "03"))
+
+    def test_multi_did_rejected(self):
+        answers = {bytes.fromhex("22010CF186"): [(0, bytes.fromhex("7F2213"))],
+                   bytes.fromhex("22010C"): [(0, bytes.fromhex("62010C000010"))],
+                   bytes.fromhex("22F186"): [(0, bytes.fromhex("62F18603"))]}
+        (results, multi_did), requests = self.run_ecu(lambda transport: transport.read(["Odometer", "Session"]), answers)
+        self.assertFalse(multi_did)
+        self.assertEqual(requests[1:], [bytes.fromhex("22010C"), bytes.fromhex("22F186")])
+        self.assertEqual(results["Session"]["data"], "03")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+UDSHelper on a socketpair: P2 and P2* timing of "response pending" (NRC 0x78), late payloads, multi-DID reads.
+
+usage: python3 uds_helper_test.py
+"""
+
+import json
+import time
+import unittest
+import threading
+
+import _catalog
+import _uds_helper
+import _virtual_ecu
+
+
+SERVICES = {
+    "ReadDataByIdentifier": {
+        "ID": "22",
+        "Odometer": {"ID": "010C", "response": {"length": 3}},
+        "Session": {"ID": "F186", "response": {"length": 1}},
+    },
+    "Negative Response": {"ID": "7F"},
+}
+
+
+class _Client(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, json.loads(payload)))
+
+
+class UDSHelperTest(unittest.TestCase):
+    def setUp(self):
+        self.tester, self.ecu = _virtual_ecu.socket_pair()
+        self.client = _Client()
+        self.helper = _uds_helper.UDSHelper(self.client, "reply", isotp_socket=self.tester, p2=0.05, p2_star=0.3)
+
+    def tearDown(self):
+        self.tester.close()
+        self.ecu.close()
+
+    def answer(self, *responses):
+        """ send (delay after the previous one, payload) from the ECU side """
+        def run():
+            for delay, payload in responses:
+                time.sleep(delay)
+                self.ecu.send(payload)
+        sender = threading.Thread(target=run)
+        sender.start()
+        return sender
+
+    def test_response_within_p2(self):
+        self.answer((0.01, bytes.fromhex("62010C000010"))).join()
+        self.assertEqual(self.helper._receivePayload(), bytes.fromhex("62010C000010"))
+        self.assertEqual(self.client.published, [])
+
+    def test_pending_waits_p2_star(self):
+        # both waits after a pending notice are longer than P2, shorter than P2*
+        sender = self.answer((0.01, bytes.fromhex("7F2278")), (0.1, bytes.fromhex("7F2278")), (0.1, bytes.fromhex("62010C000010")))
+        started = time.monotonic()
+        self.assertEqual(self.helper._receivePayload(), bytes.fromhex("62010C000010"))
+        self.assertGreater(time.monotonic() - started, 0.2)
+        sender.join()
+        self.assertEqual([(topic, message["PID"]) for topic, message in self.client.published], [("reply", "2278"), ("reply", "2278")])
+
+    def test_timeouts(self):
+        started = time.monotonic()
+        self.assertIsNone(self.helper._receivePayload())
+        self.assertLess(time.monotonic() - started, 0.2) # P2, not P2*
+        self.answer((0.0, bytes.fromhex("7F2278"))).join()
+        started = time.monotonic()
+        self.assertIsNone(self.helper._receivePayload())
+        self.assertGreater(time.monotonic() - started, 0.25) # P2* after the pending notice
+
+    def test_late_payload_dropped(self):
+        self.answer((0.0, bytes.fromhex("62F18603"))).join() # response to an earlier request that timed out
+        time.sleep(0.01)
+        self.helper._transmitISOTP(bytes.fromhex("22010C"))
+        self.assertEqual(self.ecu.recv(4095), bytes.fromhex("22010C"))
+        self.assertIsNone(self.helper._receivePayload())
+
+    def test_multi_did_fallback_remembered(self):
+        helper = _uds_helper.UDSHelper(isotp_socket=self.tester, catalog=_catalog.Catalog(_catalog.expand(SERVICES)), p2=0.2)
+        requests = []
+
+        def ecu():
+            answers = {bytes.fromhex("22010CF186"): bytes.fromhex("7F2213"), bytes.fromhex("22010C"): bytes.fromhex("62010C000010"),
+                       bytes.fromhex("22F186"): bytes.fromhex("62F18603")}
+            while len(requests) < 5:
+                requests.append(self.ecu.recv(4095))
+                self.ecu.send(answers[requests[-1]])
+        responder = threading.Thread(target=ecu)
+        responder.start()
+        results = helper.readDataByIdentifiers(["Odometer", "Session"])
+        self.assertFalse(helper.multi_did)
+        self.assertEqual(results["Session"]["data"], "03")
+        # the next read goes without trying multiple DIDs again
+        self.assertEqual(helper.readDataByIdentifiers(["Odometer", "Session"])["Odometer"]["data"], "000010")
+        responder.join(1.0)
+        self.assertEqual([request.hex() for request in requests], ["22010cf186", "22010c", "22f186", "22010c", "22f186"])
+
+
+if __name__ == "__main__":
+    unittest.main()
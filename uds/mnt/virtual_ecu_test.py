@@ -0,0 +1,98 @@
+"""
+Record and replay: a recording of one ECU played back by VirtualBus, recorded timing and speed,
+answers to requests that were not recorded, and recording through a wrapped socket factory.
+
+usage: python3 virtual_ecu_test.py
+"""
+
+import os
+import time
+import select
+import shutil
+import tempfile
+import unittest
+
+import _virtual_ecu
+
+
+def _exchange(isotp_socket, request, timeout=1.0):
+    """ send request and wait for the next response payload """
+    isotp_socket.send(request)
+    if not select.select([isotp_socket], [], [], timeout)[0]:
+        return None
+    return isotp_socket.recv()
+
+
+class VirtualEcuTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "traffic.rec")
+        recorder = _virtual_ecu.Recorder(self.path)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.REQUEST, bytes.fromhex("22010C"), 100.0)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.RESPONSE, bytes.fromhex("62010C000010"), 100.2)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.REQUEST, bytes.fromhex("22010C"), 101.0)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.RESPONSE, bytes.fromhex("62010C000011"), 101.2)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.REQUEST, bytes.fromhex("22F186"), 102.0)
+        recorder.write(0x63B, 0x5BB, _virtual_ecu.RESPONSE, bytes.fromhex("62F18603"), 102.0)
+        recorder.close()
+        self.buses = []
+        self.sockets = []
+
+    def tearDown(self):
+        for isotp_socket in self.sockets:
+            isotp_socket.close()
+        for bus in self.buses:
+            bus.close()
+        shutil.rmtree(self.directory)
+
+    def bus(self, speed):
+        bus = _virtual_ecu.VirtualBus.load(self.path, speed)
+        self.buses.append(bus)
+        self.sockets.append(bus.open("virtual", 0x63B, 0x5BB))
+        return self.sockets[-1]
+
+    def test_read_records(self):
+        records = list(_virtual_ecu.read_records(self.path))
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[1], (100.2, 0x63B, 0x5BB, _virtual_ecu.RESPONSE, bytes.fromhex("62010C000010")))
+        with open(os.path.join(self.directory, "other"), "wb") as other:
+            other.write(b"not a recording")
+        with self.assertRaises(ValueError):
+            list(_virtual_ecu.read_records(other.name))
+
+    def test_recorded_exchanges_in_turn(self):
+        isotp_socket = self.bus(0)
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("22010C")), bytes.fromhex("62010C000010"))
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("22010C")), bytes.fromhex("62010C000011"))
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("22010C")), bytes.fromhex("62010C000010"))
+
+    def test_recorded_timing(self):
+        started = time.monotonic()
+        self.assertIsNotNone(_exchange(self.bus(2), bytes.fromhex("22010C")))
+        self.assertGreater(time.monotonic() - started, 0.09) # 0.2 s recorded, twice as fast
+
+    def test_not_recorded(self):
+        isotp_socket = self.bus(0)
+        # multi-DID read put together from the recorded single reads
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("22010CF186")), bytes.fromhex("62010C000010F18603"))
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("22F190")), bytes.fromhex("7F2231"))
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("3E00")), bytes.fromhex("7E00"))
+        self.assertIsNone(_exchange(isotp_socket, bytes.fromhex("3E80"), 0.1)) # suppressed response
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("1003")), bytes.fromhex("5003003201F4"))
+        self.assertEqual(_exchange(isotp_socket, bytes.fromhex("2E010C00")), bytes.fromhex("7F2E11"))
+
+    def test_record_replayed_traffic(self):
+        bus = _virtual_ecu.VirtualBus.load(self.path, 0)
+        self.buses.append(bus)
+        path = os.path.join(self.directory, "again.rec")
+        recorder = _virtual_ecu.Recorder(path)
+        isotp_socket = recorder.wrap(bus.open)("virtual", 0x63B, 0x5BB)
+        self.sockets.append(isotp_socket)
+        _exchange(isotp_socket, bytes.fromhex("22F186"))
+        recorder.close()
+        self.assertEqual([(direction, payload.hex()) for _, _, _, direction, payload in _virtual_ecu.read_records(path)],
+                         [(_virtual_ecu.REQUEST, "22f186"), (_virtual_ecu.RESPONSE, "62f18603")])
+
+
+if __name__ == "__main__":
+    unittest.main()